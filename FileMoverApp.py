@@ -1,209 +1,74 @@
 import customtkinter as ctk
-import shutil
 import os
-import zipfile
-import pickle
-import datetime
 import logging
 import threading
-import tempfile
-import re
-import subprocess
-import string
-import stat
-import ctypes
-from pathlib import Path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
 from tkinter import filedialog, messagebox, Text
 from tkinterdnd2 import DND_FILES, TkinterDnD
 from config import (
     load_base_root,
     save_base_root,
+    load_backup_roots,
+    save_backup_roots,
     load_keywords,
     save_keywords,
     load_event_format,
     save_event_format,
-    TOKEN_PATH,
-    SUPPORTED_IMAGE_EXTENSIONS,
-    SCOPES,)
-from google.auth.transport.requests import Request
-from decrypt_utils import decrypt_credentials
+    settings,
+    BASE_ROOT_KEY,
+    BACKUP_ROOTS_KEY,
+    DEDUPE_MODE,)
+from event_store import EventStore
+from file_selection import FileSelection
+from event_template import compile_event_format, TemplateError
+from event_router import route_by_capture_time
+from ingest import (
+    CalendarAuthError,
+    IngestSession,
+    build_event_index,
+    fetch_hit_event_names,
+    get_calendar_session,
+    preload_calendar_session,)
+from ingest_journal import find_unfinished_journals
+from job_queue import QUEUED, RUNNING, JobQueue
+from planner import build_plan
+from tracing import tracer
+from transfer_engine import DONE, FAILED, CANCELLED, SKIPPED
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 logging.basicConfig(filename="error.log", level=logging.ERROR)
 
-# キーワードにヒットしているか判定
-def is_hit_keywords_event(title: str, description: str = "") -> bool:
-    keywords = load_keywords()
-    combined = (title or "") + " " + (description or "")
-    combined = combined.lower()
-    for keyword in keywords:
-        if keyword.lower() in combined:
-            return True
-    return False
-
-# ヒットするイベントを取得
-def get_hit_keywords_events(max_results=250):
-    creds = None
+# ファイル一覧に表示する転送結果の記号
+TRANSFER_MARKS = {DONE: "✅", FAILED: "❌", CANCELLED: "⏹", SKIPPED: "⏭"}
+# ジョブ一覧に表示する状態
+JOB_STATUS_TEXT = {QUEUED: "待機", RUNNING: "実行中", DONE: "完了", FAILED: "失敗", CANCELLED: "中止"}
+
+# ヒットするイベントを取得（失敗時はダイアログを出して None を返す）
+# on_progress(names) を渡すと、取得途中のヒット一覧が届くたびに呼ばれる（ワーカースレッドから）
+def get_hit_keywords_events(max_results=250, all_calendars=False, on_progress=None):
     try:
-        if os.path.exists(TOKEN_PATH):
-            with open(TOKEN_PATH, 'rb') as token:
-                creds = pickle.load(token)
-
-        if not creds or not creds.valid:
-            try:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                else:
-                    config_dict = decrypt_credentials()
-                    flow = InstalledAppFlow.from_client_config(config_dict, SCOPES)
-                    creds = flow.run_local_server(port=0, timeout_seconds=60)
-                    if not os.path.exists(TOKEN_PATH):
-                        TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
-                        make_hidden(TOKEN_PATH.parent)
-                    
-                with open(TOKEN_PATH, 'wb') as token:
-                    pickle.dump(creds, token)
-                # 生成された復号ファイルを削除
-                try:
-                    os.chmod(TOKEN_PATH, stat.S_IREAD | stat.S_IWRITE)
-                except FileNotFoundError:
-                    pass
-            except Exception as e:
-                logging.error("Google認証エラー", exc_info=True)
-                messagebox.showerror("Google認証失敗", f"Google認証中に問題が発生しました。\n操作を中止または権限が不足している可能性があります。\n\n{str(e)}")
-                return None
-
-        service = build('calendar', 'v3', credentials=creds)
-        now = datetime.datetime.utcnow()
-        one_year_ago = now - datetime.timedelta(days=365)
-
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=one_year_ago.isoformat() + 'Z',
-            timeMax=now.isoformat() + 'Z',
-            maxResults=max_results,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-
-        hit_keyword_events = []
-        fmt = load_event_format()
-        for event in events_result.get('items', []):
-            title = event.get('summary', '')
-            description = event.get('description', '')
-            if is_hit_keywords_event(title, description):
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                dt = datetime.datetime.fromisoformat(start)
-
-                # --- 日付フォーマット置換ロジック ---
-                def format_with_date(fmt: str, dt: datetime.datetime) -> str:
-                    match = re.search(r"\{date:([^}]+)\}", fmt)
-                    if match:
-                        date_fmt = match.group(1)
-                        formatted_date = dt.strftime(date_fmt)
-                        fmt = fmt.replace(match.group(0), formatted_date)
-                    else:
-                        # デフォルト形式
-                        fmt = fmt.replace("{date}", dt.strftime("%Y%m%d"))
-                    return fmt.replace("{event}", title)
-
-                formatted = format_with_date(fmt, dt)
-                hit_keyword_events.append(formatted)
-        return hit_keyword_events
+        return fetch_hit_event_names(max_results, all_calendars, on_progress)
+    except CalendarAuthError as e:
+        logging.error("Google認証エラー", exc_info=True)
+        messagebox.showerror("Google認証失敗", f"Google認証中に問題が発生しました。\n操作を中止または権限が不足している可能性があります。\n\n{str(e)}")
     except FileNotFoundError as e:
         messagebox.showerror("エラー", "必要なファイル（credentials.json や token.pickle）が見つかりません。")
     except Exception as e:
         logging.error("処理失敗", exc_info=True)
         messagebox.showerror("エラー", f"Google予定取得中にエラーが発生しました: {str(e)}")
 
-# zip解凍用ヘルパー関数
-# 画像ファイルの判定
-def is_image(file_path):
-    ext = os.path.splitext(file_path)[1].lower()
-    return ext in SUPPORTED_IMAGE_EXTENSIONS
-
-# zipファイル解凍(Sjis→UTF-8変換)
-def extract_and_copy_images(zip_path, target_dir):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # 日本語が混ざると文字化けするので一旦7zで展開
-        cmd = [
-            os.path.join(os.getcwd(), "7za.exe"),
-            "x", f"-o{temp_dir}", zip_path, "-y"
-        ]
-        # 7zでzipファイルを展開
-        try:
-            subprocess.run(
-                cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
-        except Exception as e:
-            messagebox.showerror("展開失敗", f"7zでZIPを展開できませんでした: {str(e)}")
-            return
-
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                full_path = os.path.join(root, file)
-                if is_image(full_path):
-                    os.makedirs(target_dir, exist_ok=True)
-                    dest_path = os.path.join(target_dir, file)
-
-                    counter = 1
-                    base, ext = os.path.splitext(dest_path)
-                    while os.path.exists(dest_path):
-                        dest_path = f"{base}_{counter}{ext}"
-                        counter += 1
-
-                    shutil.copy2(full_path, dest_path)
-
-# フォーマットの妥当性を検証
-def validate_format(format_str: str) -> bool:
-    # 無効なプレースホルダ検出（{未閉じ}, {空}, 変数名に使えない文字など）
-    invalid_chars = r'[\/:*?"<>|]'
-    if re.findall(invalid_chars, format_str):
-        return False
-
-        # プレースホルダ抽出: str.formatの構文に従う
-    try:
-        formatter = string.Formatter()
-        fields = [field_name for _, field_name, _, _ in formatter.parse(format_str) if field_name]
-    except ValueError:
-        return False  # フォーマット構文エラー（例：未閉じの{}など）
-
-    # 必須の置換子チェック
-    if not any(tag in format_str for tag in ("{event}", "{date}")):
-        return False
-
-    # 不正なフィールド名（Pythonの識別子 + strftime指定子許可）
-    for f in fields:
-        if not re.fullmatch(r"[a-zA-Z_][a-zA-Z0-9_]*(?::[^{}]*)?", f):
-            return False
-
-    return True
-
-def make_hidden(path: Path):
-    """Windowsで指定フォルダを隠し属性にする"""
-    if os.name == "nt" and path.exists():
-        FILE_ATTRIBUTE_HIDDEN = 0x02
-        try:
-            ctypes.windll.kernel32.SetFileAttributesW(str(path), FILE_ATTRIBUTE_HIDDEN)
-        except Exception as e:
-            print(f"⚠ 隠し属性の付与に失敗しました: {e}")
-
 class FileMoverApp(TkinterDnD.Tk):
     def __init__(self):
         super().__init__()
         # 初期表示時
         self.attributes("-alpha", 1.0)
         self.base_root = load_base_root()
+        self.backup_roots = load_backup_roots()
         self.title("File Mover App")
-        self.geometry("400x650")
+        self.geometry("400x900")
 
-        self.file_paths = []
+        # 選択中のファイル（順序付き集合。ドロップしたフォルダは裏で展開する）
+        self.selection = FileSelection()
         self.dest_base_dir = None
 
         self.status_label = ctk.CTkLabel(self, text="Googleアカウントを認証してください", text_color="black")
@@ -214,7 +79,22 @@ class FileMoverApp(TkinterDnD.Tk):
         self.select_base_button.pack(padx=20)
 
         self.base_dir_display = ctk.CTkLabel(self, text=f"保存先の親フォルダ: {self.base_root}", text_color="gray")
-        self.base_dir_display.pack(anchor="w", padx=20, pady=(0, 10))
+        self.base_dir_display.pack(anchor="w", padx=20, pady=(0, 2))
+
+        # バックアップ先（保存先と同時に書き込む）
+        self.backup_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.backup_frame.pack(pady=2)
+        self.add_backup_button = ctk.CTkButton(self.backup_frame, text="バックアップ先を追加", width=180, command=self.add_backup_root)
+        self.add_backup_button.pack(side="left", padx=5)
+        self.clear_backup_button = ctk.CTkButton(self.backup_frame, text="バックアップ先を解除", width=180, command=self.clear_backup_roots)
+        self.clear_backup_button.pack(side="left", padx=5)
+        self.backup_display = ctk.CTkLabel(self, text=self._backup_text(), text_color="gray", justify="left")
+        self.backup_display.pack(anchor="w", padx=20, pady=(0, 10))
+        # 保存先の設定がほかの画面やプロセスから変わったら表示を合わせる
+        # （通知は書き換えたスレッドから届くので、フラグだけ立てて after() で反映する）
+        self._settings_changed = False
+        self._unsubscribe_settings = settings.subscribe(self._on_settings_changed, BASE_ROOT_KEY, BACKUP_ROOTS_KEY)
+        self.after(1000, self._poll_settings)
         
         button_width = 180
         self.edit_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -236,6 +116,9 @@ class FileMoverApp(TkinterDnD.Tk):
         self.google_reset.pack(side="left", padx=5)
         self.google_fetch = ctk.CTkButton(self.google_buttons_frame, text="予定一覧を取得", width=button_width, command=self.fetch_events_list)
         self.google_fetch.pack(side="left", padx=5)
+        self.all_calendars_var = ctk.BooleanVar(value=False)
+        self.all_calendars_check = ctk.CTkCheckBox(self, text="すべてのカレンダーから取得", variable=self.all_calendars_var)
+        self.all_calendars_check.pack(anchor="w", padx=20, pady=(2, 0))
         self.event_combo = ctk.CTkComboBox(self, values=[], width=400, command=self.set_event_entry)
         self.event_combo.set("")
         self.event_combo.pack(padx=20, pady=5)
@@ -268,6 +151,9 @@ class FileMoverApp(TkinterDnD.Tk):
             font=("Segoe UI", 11)
         )
         self.file_display.pack(padx=20, pady=5, fill="both")
+        self.selection_label = ctk.CTkLabel(self, text="", text_color="gray")
+        self.selection_label.pack(anchor="w", padx=20)
+        self._scan_polling = False
 
         self.file_display.drop_target_register(DND_FILES)
         self.file_display.dnd_bind('<<Drop>>', self.on_drop)
@@ -276,8 +162,59 @@ class FileMoverApp(TkinterDnD.Tk):
         self.after(200, lambda: self.file_display.dnd_bind('<<Drop>>', self.on_drop))
 
         # ========= 実行 =========
-        self.exec_button = ctk.CTkButton(self, text="実行", command=self.execute)
-        self.exec_button.pack(pady=20)
+        self.move_mode_var = ctk.BooleanVar(value=False)
+        self.move_mode_check = ctk.CTkCheckBox(self, text="移動モード（転送後に元ファイルを削除）", variable=self.move_mode_var)
+        self.move_mode_check.pack(anchor="w", padx=20, pady=(5, 0))
+        self.dedupe_var = ctk.BooleanVar(value=True)
+        self.dedupe_check = ctk.CTkCheckBox(self, text="取り込み済みと同じ内容のファイルはスキップ", variable=self.dedupe_var)
+        self.dedupe_check.pack(anchor="w", padx=20, pady=(5, 0))
+        self.ledger_var = ctk.BooleanVar(value=True)
+        self.ledger_check = ctk.CTkCheckBox(self, text="前回取り込んだ元ファイルは読み込まずにスキップ", variable=self.ledger_var)
+        self.ledger_check.pack(anchor="w", padx=20, pady=(5, 0))
+        self.route_var = ctk.BooleanVar(value=False)
+        self.route_check = ctk.CTkCheckBox(self, text="撮影日時で予定ごとに振り分け（該当なしは入力したイベントへ）", variable=self.route_var)
+        self.route_check.pack(anchor="w", padx=20, pady=(5, 0))
+
+        self.exec_buttons = ctk.CTkFrame(self, fg_color="transparent")
+        self.exec_buttons.pack(pady=20)
+        self.preview_button = ctk.CTkButton(self.exec_buttons, text="計画を確認", width=button_width, command=self.preview_plan)
+        self.preview_button.pack(side="left", padx=5)
+        self.exec_button = ctk.CTkButton(self.exec_buttons, text="実行", width=button_width, command=self.execute)
+        self.exec_button.pack(side="left", padx=5)
+
+        # ========= 転送状況（ジョブがある間だけ表示） =========
+        self.ingest = IngestSession()
+        # 取り込みジョブのキュー（ドライブごとに同時実行数を制限して裏で実行する）
+        self.jobs = JobQueue()
+        if not self.jobs.is_idle():
+            # 前回の残りのジョブ（移動モードなら元ファイルを消す）は確認してから再開する（offer_resume）
+            self.jobs.pause()
+        self.jobs.start()
+        # 実行ボタン1回分ごとのジョブ（すべて終わったら結果を表示する）
+        self._batches = []
+        self._polling = False
+        self._shown_version = -1
+        self._job_labels = {}
+        self.transfer_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.progress_bar = ctk.CTkProgressBar(self.transfer_frame)
+        self.progress_bar.pack(fill="x", pady=(0, 5))
+        self.transfer_label = ctk.CTkLabel(self.transfer_frame, text="", text_color="gray")
+        self.transfer_label.pack()
+        self.transfer_buttons = ctk.CTkFrame(self.transfer_frame, fg_color="transparent")
+        self.transfer_buttons.pack(pady=5)
+        self.pause_button = ctk.CTkButton(self.transfer_buttons, text="一時停止", width=button_width, command=self.toggle_pause)
+        self.pause_button.pack(side="left", padx=5)
+        self.cancel_button = ctk.CTkButton(self.transfer_buttons, text="中止", width=button_width, command=self.cancel_transfer)
+        self.cancel_button.pack(side="left", padx=5)
+        self.job_list = ctk.CTkScrollableFrame(self.transfer_frame, height=110, label_text="ジョブ")
+        self.job_list.pack(fill="x", pady=(5, 0))
+        self.clear_jobs_button = ctk.CTkButton(self.transfer_frame, text="完了したジョブを一覧から消す", command=self.jobs.clear_finished)
+        self.clear_jobs_button.pack(pady=(5, 0))
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Google連携のライブラリと初回認証用のクライアント設定は、最初の画面を描いた後に裏で読み込む
+        self.after_idle(lambda: self.after(300, preload_calendar_session))
+        self.after(800, self.offer_resume)
 
     # === 各種処理 ===
     def select_base_root(self): pass
@@ -290,27 +227,38 @@ class FileMoverApp(TkinterDnD.Tk):
     # 転送用のファイルを選択する
     def select_files(self):
         paths = filedialog.askopenfilenames(title="ファイルを選択")
-        for path in paths:
-            if path not in self.file_paths:
-                self.file_paths.append(path)
-
-        # 表示更新
-        self.file_display.delete("1.0", ctk.END)
-        for path in self.file_paths:
-            self.file_display.insert(ctk.END, f"{path}\n")
+        self._add_paths(paths)
 
-    # ドラッグ＆ドロップでファイルを受け取る
+    # ドラッグ＆ドロップでファイル・フォルダを受け取る
     def on_drop(self, event):
         dropped = self.tk.splitlist(event.data)
-        for path in dropped:
-            path = path.strip("{").strip("}")
-            if path not in self.file_paths:
-                self.file_paths.append(path)
-
-        # 表示更新
-        self.file_display.delete("1.0", ctk.END)
-        for path in self.file_paths:
-            self.file_display.insert(ctk.END, f"{path}\n")
+        self._add_paths(path.strip("{").strip("}") for path in dropped)
+
+    # 新しく加わった分だけ一覧の末尾に追記する（フォルダの中身は裏で読み込みながら少しずつ追記）
+    def _add_paths(self, paths):
+        self._append_lines(self.selection.add(paths))
+        if self.selection.scanning and not self._scan_polling:
+            self._scan_polling = True
+            self.after(50, self._poll_scan)
+
+    def _poll_scan(self):
+        self._append_lines(self.selection.drain())
+        if self.selection.scanning:
+            self.after(100, self._poll_scan)
+        else:
+            self._scan_polling = False
+            self._update_selection_label()
+
+    def _append_lines(self, paths):
+        if paths:
+            self.file_display.insert(ctk.END, "".join(f"{path}\n" for path in paths))
+        self._update_selection_label()
+
+    def _update_selection_label(self):
+        text = f"{len(self.selection)} 件 / {self.selection.total_bytes / 1024 / 1024:.1f} MB"
+        if self.selection.scanning:
+            text += "（フォルダを読み込み中...）"
+        self.selection_label.configure(text=text)
     
     # 保存先の親フォルダを選択
     def select_base_root(self):
@@ -320,40 +268,41 @@ class FileMoverApp(TkinterDnD.Tk):
             self.base_dir_display.configure(text=f"保存先の親フォルダ: {selected}")
             save_base_root(selected)
     
-    # zipファイルを展開
-    def extract_zip_smart(self, zip_path, output_base_dir):
-        zip_name = os.path.splitext(os.path.basename(zip_path))[0]
-        extract_dir = os.path.join(output_base_dir, zip_name)
-        os.makedirs(extract_dir, exist_ok=True)
-
-        # 一時展開先を作成（安全な中間フォルダ）
-        temp_dir = os.path.join(extract_dir, "_temp")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-
-        # 再帰的にファイルがある階層を探す
-        def find_deepest_dir_with_files(start_path):
-            for root, dirs, files in os.walk(start_path):
-                if files:
-                    return root
-            return start_path  # ファイルがない場合も戻す
-
-        source_dir = find_deepest_dir_with_files(temp_dir)
-
-        # ファイルとフォルダを extract_dir に移動
-        for item in os.listdir(source_dir):
-            src_path = os.path.join(source_dir, item)
-            dest_path = os.path.join(extract_dir, item)
-            if os.path.isdir(src_path):
-                shutil.move(src_path, dest_path)
-            else:
-                shutil.move(src_path, dest_path)
+    def _on_settings_changed(self, changed):
+        self._settings_changed = True
+
+    def _poll_settings(self):
+        settings.revalidate()
+        if self._settings_changed:
+            self._settings_changed = False
+            self.base_root = load_base_root()
+            self.backup_roots = load_backup_roots()
+            self.base_dir_display.configure(text=f"保存先の親フォルダ: {self.base_root}")
+            self.backup_display.configure(text=self._backup_text())
+        self.after(1000, self._poll_settings)
+
+    def _backup_text(self) -> str:
+        if not self.backup_roots:
+            return "バックアップ先: なし"
+        return "バックアップ先:\n" + "\n".join(self.backup_roots)
+
+    # バックアップ先の親フォルダを追加（保存先と同じ「イベント/サブフォルダ」に同時に書き込む）
+    def add_backup_root(self):
+        selected = filedialog.askdirectory(title="バックアップ先の親フォルダを選択")
+        if not selected:
+            return
+        if os.path.normcase(os.path.abspath(selected)) == os.path.normcase(os.path.abspath(self.base_root)):
+            messagebox.showwarning("バックアップ先", "保存先の親フォルダと同じフォルダは指定できません。")
+            return
+        if selected not in self.backup_roots:
+            self.backup_roots.append(selected)
+            save_backup_roots(self.backup_roots)
+            self.backup_display.configure(text=self._backup_text())
 
-        # 一時展開ディレクトリを削除
-        shutil.rmtree(temp_dir)
-        print(f"[展開完了] {zip_path} → {extract_dir}")
+    def clear_backup_roots(self):
+        self.backup_roots = []
+        save_backup_roots(self.backup_roots)
+        self.backup_display.configure(text=self._backup_text())
 
     # イベント名を自動入力
     def autofill_event_name(self):
@@ -372,25 +321,38 @@ class FileMoverApp(TkinterDnD.Tk):
     # Googleカレンダーから予定を取得
     def fetch_events_list(self):
         self.status_label.configure(text="Googleカレンダーから予定を取得中…")
-        threading.Thread(target=self._fetch_events_background, daemon=True).start()
+        all_calendars = self.all_calendars_var.get()
+        threading.Thread(target=self._fetch_events_background, args=(all_calendars,), daemon=True).start()
+
+    # 取得途中のヒット一覧でドロップダウンを更新（メインスレッドで実行）
+    def _show_partial_events(self, events):
+        self.event_combo.configure(values=events)
+        self.status_label.configure(text=f"Googleカレンダーから予定を取得中…（{len(events)} 件）")
 
     # Googleアカウント認証と予定取得
-    def _fetch_events_background(self):
+    def _fetch_events_background(self, all_calendars=False):
         try:
-            events = get_hit_keywords_events()
-            if events:
-                self.event_combo.configure(values=events)
-                self.event_combo.set(events[-1])
-                self.set_event_entry(events[-1])
-                self.status_label.configure(text=f"✅ Google認証成功、予定を {len(events)} 件取得しました")
-            else:
-                self.status_label.configure(text="該当予定が見つかりませんでした")
-                messagebox.showinfo("なし", "予定が見つかりませんでした。")
+            events = get_hit_keywords_events(
+                all_calendars=all_calendars,
+                on_progress=lambda partial: self.after(0, self._show_partial_events, partial),
+            )
+            self.after(0, self._show_fetched_events, events)
         except Exception as e:
             self.status_label.configure(text="取得中にエラー")
             logging.error("Google予定取得失敗", exc_info=True)
             messagebox.showerror("取得エラー", f"Google予定取得時にエラー: {str(e)}")
 
+    # 取得完了後の表示
+    def _show_fetched_events(self, events):
+        if events:
+            self.event_combo.configure(values=events)
+            self.event_combo.set(events[-1])
+            self.set_event_entry(events[-1])
+            self.status_label.configure(text=f"✅ Google認証成功、予定を {len(events)} 件取得しました")
+        else:
+            self.status_label.configure(text="該当予定が見つかりませんでした")
+            messagebox.showinfo("なし", "予定が見つかりませんでした。")
+
     # イベント名入力
     def set_event_entry(self, selected_event):
         self.event_entry.delete(0, ctk.END)
@@ -398,9 +360,14 @@ class FileMoverApp(TkinterDnD.Tk):
 
     # Googleアカウントのトークンをリセット
     def reset_google_token(self):
-        if os.path.exists(TOKEN_PATH):
+        calendar_session = get_calendar_session()
+        if os.path.exists(calendar_session.token_path):
             # トークンリセット
-            os.remove(TOKEN_PATH)
+            calendar_session.reset()
+            # 前のアカウントの予定キャッシュも破棄
+            store = EventStore()
+            store.reset()
+            store.close()
 
             # イベント一覧（ドロップダウン）をクリア
             self.event_combo.set("")
@@ -425,56 +392,325 @@ class FileMoverApp(TkinterDnD.Tk):
         FormatEditor(self)
 
     def execute(self):
-        if not self.file_paths:
+        if not len(self.selection):
             messagebox.showwarning("未選択", "ファイルが選択されていません。")
             return
+        if self.selection.scanning:
+            messagebox.showwarning("読み込み中", "フォルダの中身を読み込んでいます。完了してから実行してください。")
+            return
+        # 実行待ち・実行中のジョブに積んだファイルは二重に積まない
+        active = self.jobs.active_sources()
+        paths = [path for path in self.selection if path not in active]
+        if not paths:
+            messagebox.showinfo("実行中", "選択したファイルはすべて実行待ち・実行中です。")
+            return
 
         # イベント名取得
         event_name = self.event_entry.get().strip()
-        if not event_name:
+        route = self.route_var.get()
+        if not event_name and not route:
             proceed = messagebox.askyesno("未入力確認", "イベント名が未入力です。\nこのまま続行しますか？")
             if not proceed:
                 return
 
+        move = self.move_mode_var.get()
+        if move and not messagebox.askyesno("移動モード確認", "転送に成功した元ファイルは削除されます（zipは残ります）。\nよろしいですか？"):
+            return
+
         # 保存先サブフォルダ名取得
         subfolder = self.subfolder_entry.get().strip()
 
         # 所定の親ディレクトリ
         base_root = self.base_root
-        event_dir = os.path.join(base_root, event_name)
-        final_dest_dir = os.path.join(event_dir, subfolder)
-        os.makedirs(final_dest_dir, exist_ok=True)
+        dedupe = DEDUPE_MODE if self.dedupe_var.get() else None
+        # 実行1回分（振り分けると複数のジョブになる）。すべて終わったら結果をまとめて表示する
+        batch = {"paths": paths, "job_ids": [], "pre_skipped": {}, "use_ledger": self.ledger_var.get()}
+        if batch["use_ledger"]:
+            # 同じカード・フォルダを再度選んだ場合は stat だけで取り込み済みを除く
+            paths, ingested = self.ingest.filter_ingested(paths)
+            if ingested:
+                batch["pre_skipped"] = {path: SKIPPED for path in ingested}
+                for path in ingested:
+                    self._mark_file_line(path, TRANSFER_MARKS[SKIPPED])
+                if not paths:
+                    messagebox.showinfo("取り込み済み", f"選択した {len(ingested)} 件はすべて以前に取り込み済みです。")
+                    self._keep_unfinished(batch["pre_skipped"])
+                    return
+        if route:
+            # ヘッダーの読み込みに時間がかかるので裏で振り分ける
+            self.exec_button.configure(state="disabled")
+            self.status_label.configure(text="撮影日時を読み込み中...")
+            threading.Thread(target=self._route_background,
+                             args=(batch, paths, event_name, subfolder, base_root, move, dedupe), daemon=True).start()
+            return
+        self._run_plan(batch, [(event_name, paths)], subfolder, base_root, move, dedupe)
+
+    # 保存先の名前・容量を先に計算し、空き容量が足りなければ積まない
+    def _run_plan(self, batch, groups, subfolder, base_root, move, dedupe):
+        self.exec_button.configure(state="normal")
+        plan = build_plan([(os.path.join(base_root, name, subfolder), paths) for name, paths in groups],
+                          move, base_root, self.backup_roots)
+        if plan.shortages:
+            messagebox.showerror("空き容量不足", "保存先の空き容量が足りないため転送を始めませんでした。\n\n" + plan.summary())
+            return
+        for group in plan.groups:
+            job = self.jobs.add(group.sources, group.dest_dir, base_root, planned=group.planned_names(),
+                                move=move, dedupe=dedupe, mirrors=group.mirror_dirs, use_ledger=batch["use_ledger"])
+            batch["job_ids"].append(job.job_id)
+        self._batches.append(batch)
+        self._show_jobs()
+
+    # 転送前に保存先の名前・容量を確認する
+    def preview_plan(self):
+        if not len(self.selection) or self.selection.scanning:
+            messagebox.showwarning("未選択", "ファイルが選択されていません（または読み込み中です）。")
+            return
+        event_name = self.event_entry.get().strip()
+        subfolder = self.subfolder_entry.get().strip()
+        plan = build_plan([(os.path.join(self.base_root, event_name, subfolder), self.selection.paths())],
+                          self.move_mode_var.get(), self.base_root, self.backup_roots)
+        note = "\n\n※撮影日時での振り分けは実行時に行います" if self.route_var.get() else ""
+        if messagebox.askyesno("転送計画", plan.summary() + note + "\n\n計画をJSONで保存しますか？"):
+            path = filedialog.asksaveasfilename(title="転送計画を保存", defaultextension=".json",
+                                                filetypes=[("JSON", "*.json")])
+            if path:
+                plan.save(path)
+
+    # 撮影日時で予定ごとに振り分けてから順に転送する
+    def _route_background(self, batch, paths, fallback_event, subfolder, base_root, move, dedupe):
+        try:
+            routes, unmatched = route_by_capture_time(paths, build_event_index())
+        except Exception as e:
+            logging.error("振り分け失敗", exc_info=True)
+            self.after(0, lambda: self._route_failed(e))
+            return
+        self.after(0, lambda: self._start_routed(batch, routes, unmatched, fallback_event, subfolder, base_root, move, dedupe))
+
+    def _route_failed(self, error):
+        self.exec_button.configure(state="normal")
+        self.status_label.configure(text="")
+        messagebox.showerror("エラー", f"撮影日時での振り分けに失敗しました: {error}")
+
+    def _start_routed(self, batch, routes, unmatched, fallback_event, subfolder, base_root, move, dedupe):
+        self.status_label.configure(text=f"{len(routes)} 件の予定へ振り分けました")
+        groups = list(routes.items())
+        if unmatched:
+            if fallback_event:
+                groups.append((fallback_event, unmatched))
+            else:
+                messagebox.showwarning("該当なし", f"撮影日時に該当する予定がない {len(unmatched)} 件は取り込みません。\n"
+                                       "イベント名を入力すると、そのフォルダへ取り込みます。")
+        if not groups:
+            self.exec_button.configure(state="normal")
+            return
+        self._run_plan(batch, groups, subfolder, base_root, move, dedupe)
+
+    # ジョブはキューのスレッドで実行し、進捗は after() で反映
+    def _show_jobs(self):
+        self.pause_button.configure(text="再開" if self.jobs.paused else "一時停止")
+        self.transfer_frame.pack(padx=20, pady=(0, 10), fill="x")
+        if not self._polling:
+            self._polling = True
+            self.after(200, self._poll_jobs)
+
+    # 前回中断した取り込みがあれば再開を提案する（キューが再開を受け持つものは除く）
+    def offer_resume(self):
+        self._offer_resume_jobs()
+        owned = self.jobs.owned_journals()
+        for path, state in find_unfinished_journals():
+            if os.path.abspath(path) in owned:
+                continue
+            dest_dir = state.header.get("dest_dir")
+            options = state.header.get("options", {})
+            unfinished = state.unfinished
+            if not messagebox.askyesno(
+                    "再開確認",
+                    f"前回の取り込みが完了していません（残り {len(unfinished)} 件）。\n"
+                    f"保存先: {dest_dir}\n\n未完了のファイルだけ再開しますか？"):
+                if messagebox.askyesno("破棄確認", "この取り込みの記録を破棄しますか？"):
+                    os.remove(path)
+                continue
+            # 中断時にすでに移動し終えていた分はジョブの開始時にジャーナルから除く
+            self._append_lines(self.selection.add(unfinished))
+            job = self.jobs.add(unfinished, dest_dir, options.get("base_root", self.base_root),
+                                move=options.get("move", False), dedupe=options.get("dedupe"),
+                                mirrors=options.get("mirrors", ()), journal=str(path))
+            self._batches.append({"paths": unfinished, "job_ids": [job.job_id], "pre_skipped": {}, "use_ledger": True})
+            self._show_jobs()
+
+    # 前回の終了時に残っていたジョブは一時停止した状態で読み込んでいるので、続けるかを確認する
+    def _offer_resume_jobs(self):
+        pending = [job for job in self.jobs.jobs() if not job.finished]
+        if not pending:
+            return
+        self._show_jobs()
+        moves = sum(1 for job in pending if job.move)
+        lines = "\n".join(f"・{job.label}（{len(job.sources)} 件{'・移動' if job.move else ''}）" for job in pending[:5])
+        if len(pending) > 5:
+            lines += f"\n…ほか {len(pending) - 5} 件"
+        note = f"\n\n移動モードのジョブが {moves} 件あり、再開すると元ファイルを削除します。" if moves else ""
+        if messagebox.askyesno("再開確認", f"前回のジョブが {len(pending)} 件残っています。\n{lines}{note}\n\n再開しますか？"):
+            self.jobs.resume()
+        elif messagebox.askyesno("破棄確認", "残っているジョブを中止し、記録を破棄しますか？\n（いいえを選ぶと一時停止のままにします）"):
+            for job in pending:
+                journal = job.journal
+                self.jobs.cancel(job.job_id)
+                if journal and os.path.exists(journal):
+                    os.remove(journal)
+            self.jobs.resume()
+        self.pause_button.configure(text="再開" if self.jobs.paused else "一時停止")
+
+    # ジョブの進捗を画面へ反映
+    def _poll_jobs(self):
+        jobs = self.jobs.jobs()
+        for job in jobs:
+            if job.engine:
+                for path, state, _ in job.engine.poll():
+                    self._mark_file_line(path, TRANSFER_MARKS[state])
+        self._refresh_job_list(jobs)
+
+        running = [job for job in jobs if job.status == RUNNING and job.engine]
+        progresses = [job.engine.progress() for job in running]
+        total_bytes = sum(progress.total_bytes for progress in progresses)
+        done_bytes = sum(progress.done_bytes for progress in progresses)
+        self.progress_bar.set(done_bytes / total_bytes if total_bytes else 0)
+        waiting = sum(1 for job in jobs if job.status == QUEUED)
+        text = f"実行中 {len(running)} 件 / 待機 {waiting} 件"
+        if progresses:
+            text += f"  {sum(progress.throughput for progress in progresses) / 1024 / 1024:.1f} MB/s"
+        for progress in progresses:
+            for mirror, (written, failed) in progress.mirrors.items():
+                text += f"\nバックアップ {os.path.basename(mirror) or mirror}: {written / 1024 / 1024:.0f} MB"
+                if failed:
+                    text += f"（失敗 {failed} 件）"
+        if self.jobs.paused:
+            text += "  (一時停止中)"
+        if tracer.enabled:
+            # 計測中は段階ごとの延べ時間を表示する（FILEMOVER_TRACE を設定して起動したとき）
+            text += f"\n{tracer.summary_text()}"
+        self.transfer_label.configure(text=text)
+
+        for batch in list(self._batches):
+            batch_jobs = [self.jobs.get(job_id) for job_id in batch["job_ids"]]
+            if all(job is None or job.finished for job in batch_jobs):
+                self._batches.remove(batch)
+                self._finish_batch(batch, [job for job in batch_jobs if job])
+
+        if self.jobs.is_idle() and not self._batches:
+            self._polling = False
+            self.transfer_frame.pack_forget()
+        else:
+            self.after(200, self._poll_jobs)
+
+    # ジョブ一覧（状態が変わったときだけ描き直し、実行中の件数は毎回更新する）
+    def _refresh_job_list(self, jobs):
+        if self.jobs.version != self._shown_version:
+            self._shown_version = self.jobs.version
+            for child in self.job_list.winfo_children():
+                child.destroy()
+            self._job_labels = {}
+            for job in jobs:
+                row = ctk.CTkFrame(self.job_list, fg_color="transparent")
+                row.pack(fill="x")
+                label = ctk.CTkLabel(row, text="", anchor="w", justify="left")
+                label.pack(side="left", fill="x", expand=True)
+                if not job.finished:
+                    for text, command in (("✕", lambda j=job.job_id: self.jobs.cancel(j)),
+                                          ("↓", lambda j=job.job_id: self.jobs.move(j, 1)),
+                                          ("↑", lambda j=job.job_id: self.jobs.move(j, -1))):
+                        ctk.CTkButton(row, text=text, width=28, command=command).pack(side="right", padx=1)
+                self._job_labels[job.job_id] = label
+        for job in jobs:
+            label = self._job_labels.get(job.job_id)
+            if label is None:
+                continue
+            text = f"[{JOB_STATUS_TEXT[job.status]}] {job.label}"
+            if job.engine and job.status == RUNNING:
+                progress = job.engine.progress()
+                text += f"  {progress.done_files}/{progress.total_files} 件（並列 {job.workers}）"
+            elif job.status == QUEUED:
+                text += f"  {len(job.sources)} 件"
+            elif job.message:
+                text += f"  {job.message}"
+            label.configure(text=text)
+
+    # 実行1回分のジョブがすべて終わったら結果をまとめて表示
+    def _finish_batch(self, batch, jobs):
+        engines = [job.engine for job in jobs if job.engine]
+        for engine in engines:
+            for path, state, _ in engine.poll():
+                self._mark_file_line(path, TRANSFER_MARKS[state])
+        # 開始前に失敗したジョブ（保存先を作れないなど）も失敗として扱う
+        errors = [(job.dest_dir, OSError(job.message)) for job in jobs if job.engine is None and job.status == FAILED]
+        errors += [error for engine in engines for error in engine.errors]
+        mirror_errors = [error for engine in engines for failed in engine.mirror_errors.values() for error in failed]
+        if mirror_errors:
+            # バックアップ先の失敗は保存先の取り込みとは別に知らせる
+            for path, error in mirror_errors:
+                logging.error(f"バックアップ失敗: {path}", exc_info=error)
+            lines = [f"・{path}: {error}" for path, error in mirror_errors[:10]]
+            if len(mirror_errors) > 10:
+                lines.append(f"ほか {len(mirror_errors) - 10} 件")
+            messagebox.showwarning("バックアップ失敗", f"{len(mirror_errors)} 件をバックアップ先に書き込めませんでした。\n"
+                                   "保存先への取り込みは続けています。\n\n" + "\n".join(lines))
+        status = dict(batch["pre_skipped"])
+        status.update((path, state) for engine in engines for path, state in engine.status.items())
+        if errors:
+            for path, error in errors:
+                logging.error(f"処理失敗: {path}", exc_info=error)
+            lines = []
+            for path, error in errors[:10]:
+                if isinstance(error, PermissionError):
+                    lines.append(f"・{os.path.basename(path)}: アクセスが拒否されました（他のアプリで開いていないか確認してください）")
+                else:
+                    lines.append(f"・{os.path.basename(path)}: {error}")
+            if len(errors) > 10:
+                lines.append(f"ほか {len(errors) - 10} 件")
+            messagebox.showerror("エラー", f"{len(errors)} 件のファイルを処理できませんでした。\n\n" + "\n".join(lines))
+        elif any(job.status == CANCELLED for job in jobs):
+            messagebox.showinfo("中止", "転送を中止しました。")
+        elif any(path not in status for path in batch["paths"]):
+            # 振り分け先のない予定外のファイルが残っている
+            messagebox.showinfo("完了", f"{len(jobs)} 件の予定のフォルダに処理しました。\n該当する予定のないファイルは一覧に残しています。")
+        else:
+            skipped = sum(1 for state in status.values() if state == SKIPPED)
+            note = f"\n（取り込み済みと同じ内容の {skipped} 件はスキップしました）" if skipped else ""
+            where = f"「{jobs[0].dest_dir}」" if len(jobs) == 1 else f"{len(jobs)} 件の予定のフォルダ"
+            messagebox.showinfo("完了", f"すべてのファイルを{where}に処理しました。{note}")
+        # 成功したファイルを一覧から外し、失敗・未処理のファイルだけを残す
+        self._keep_unfinished(status)
+
+    def _keep_unfinished(self, status):
+        self.selection.retain(lambda path: status.get(path) not in (DONE, SKIPPED))
+        self.file_display.delete("1.0", ctk.END)
+        self._append_lines(self.selection.paths())
 
-        os.makedirs(final_dest_dir, exist_ok=True)  # 必要なら作成
+    def _mark_file_line(self, path, mark):
+        line = self.selection.line_of(path)
+        if line:
+            self.file_display.insert(f"{line}.0", f"{mark} ")
 
-        for path in self.file_paths:
-            filename = os.path.basename(path)
-            dest_path = os.path.join(final_dest_dir, filename)
+    def toggle_pause(self):
+        if self.jobs.paused:
+            self.jobs.resume()
+            self.pause_button.configure(text="一時停止")
+        else:
+            self.jobs.pause()
+            self.pause_button.configure(text="再開")
 
-            try:
-                # zipファイルの場合：コピー → 展開 → 削除
-                if filename.lower().endswith(".zip"):
-                    extract_and_copy_images(path, final_dest_dir)
-                else:
-                    # 通常ファイルはリネーム付きコピー
-                    base, ext = os.path.splitext(filename)
-                    counter = 1
-                    renamed_path = dest_path
-                    while os.path.exists(renamed_path):
-                        renamed_path = os.path.join(final_dest_dir, f"{base}_{counter}{ext}")
-                        counter += 1
-                    shutil.copy2(path, renamed_path)
-            except PermissionError:
-                messagebox.showerror("コピー失敗", f"アクセスが拒否されました：{filename}。\n他のアプリケーションで開いていないか確認してください。")
-            except Exception as e:
-                logging.error("処理失敗", exc_info=True)
-                messagebox.showerror("エラー", f"{filename} の処理中にエラー: {str(e)}")
-                return
+    def cancel_transfer(self):
+        if messagebox.askyesno("中止確認", "実行中・待機中のジョブをすべて中止しますか？"):
+            self.jobs.cancel_all()
 
-        messagebox.showinfo("完了", f"すべてのファイルを「{final_dest_dir}」に処理しました。")
-        # ✅ 成功時に file_paths をクリアして Text欄もリセット
-        self.file_paths.clear()
-        self.file_display.delete("1.0", ctk.END)
+    # 終了時は実行中のジョブを中断し、次回起動時に続きから再開する
+    def on_close(self):
+        if not self.jobs.is_idle() and not messagebox.askyesno(
+                "終了確認", "実行中・待機中のジョブがあります。\n次回起動時に続きから再開します。終了しますか？"):
+            return
+        self.jobs.stop()
+        self.ingest.close()
+        self._unsubscribe_settings()
+        self.destroy()
 
 # キーワード編集画面クラス
 class KeywordEditor(ctk.CTkToplevel):
@@ -499,6 +735,7 @@ class KeywordEditor(ctk.CTkToplevel):
 
         raw = self.textbox.get("1.0", ctk.END)
         keywords = [k.strip() for k in raw.split(",") if k.strip()]
+        # 保存するとキーワードのマッチャーにも通知され、次の判定から新しいキーワードが使われる
         save_keywords(keywords)
         messagebox.showinfo("保存完了", "キーワードを保存しました。")
         self.destroy()
@@ -508,16 +745,18 @@ class FormatEditor(ctk.CTkToplevel):
     def __init__(self, master=None):
         super().__init__(master)
         self.title("イベントフォーマット編集")
-        self.geometry("400x250")
+        self.geometry("400x290")
         self.transient(master)
         info_text = (
             "フォーマットで使用可能な変数:\n"
             "{date} または {date:<strftime形式>} - 予定の日付\n"
-            "{event} - イベント名\n\n"
+            "{end} または {end:<strftime形式>} - 予定の終了日\n"
+            "{event} - イベント名\n"
+            "{location} - 場所\n\n"
             "日付フォーマットの例:\n"
             '例: "{date:%Y-%m-%d}_{event}" → "2025-05-29_撮影会"'
         )
-        info_box = ctk.CTkTextbox(self, height=120, width=460, wrap="word")
+        info_box = ctk.CTkTextbox(self, height=160, width=460, wrap="word")
         info_box.insert("1.0", info_text)
         info_box.configure(state="disabled", border_width=0, fg_color="transparent")
         info_box.pack(pady=(10, 5))
@@ -532,8 +771,10 @@ class FormatEditor(ctk.CTkToplevel):
 
     def save_format(self):
         format_str = self.entry.get().strip()
-        if not validate_format(format_str):
-            messagebox.showerror("フォーマットエラー", "有効な {event} または {date} が含まれていないか、構文エラーがあります。")
+        try:
+            compile_event_format(format_str)
+        except TemplateError as e:
+            messagebox.showerror("フォーマットエラー", f"有効な {{event}} または {{date}} が含まれていないか、構文エラーがあります。\n\n{e}")
             return
         format_str = self.entry.get().strip()
         if format_str:
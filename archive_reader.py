@@ -0,0 +1,506 @@
+import datetime
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from config import NESTED_ARCHIVE_DEPTH, NESTED_SPOOL_MEMORY, SUPPORTED_IMAGE_EXTENSIONS
+
+# 汎用目的ビット11（EFS）: ファイル名がUTF-8で格納されている
+ZIP_FLAG_UTF8 = 0x800
+# メンバーを一時ファイルへ書き出すときのバッファ
+SPOOL_BUFFER_SIZE = 1024 * 1024
+
+class ArchiveError(Exception):
+    """アーカイブを読めない（壊れている・対応するライブラリがない）"""
+
+# 画像ファイルの判定
+def is_image(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    return ext in SUPPORTED_IMAGE_EXTENSIONS
+
+def decode_member_name(info: zipfile.ZipInfo) -> str:
+    """zip内のファイル名を正しく復元する（Windowsで作られたzipはShift_JIS/CP932が多い）"""
+    if info.flag_bits & ZIP_FLAG_UTF8:
+        return info.filename
+    # zipfile はEFSなしの名前をCP437として読むので、元のバイト列に戻して判定し直す
+    raw = info.filename.encode("cp437")
+    for encoding in ("utf-8", "cp932"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return info.filename
+
+class _SpoolReader:
+    """一時バッファを閉じずに先頭から読ませる（同じメンバーを何度でも開けるようにする）"""
+
+    def __init__(self, spool):
+        self._spool = spool
+        spool.seek(0)
+
+    def read(self, size=-1):
+        return self._spool.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+class ArchiveMember:
+    """アーカイブ内のファイル1件（ZipInfo と同じ名前の属性を持つ）
+
+    filename はアーカイブ内で一意な名前（入れ子の場合は「内側のアーカイブ名/メンバー名」）、
+    name は表示用に復元した名前。stamp は取り込み済みの判定に使う値（zipはCRC、それ以外は更新日時）。
+    順にしか読めない形式（tar・7z）のメンバーは open() を一度しか呼べないが、
+    open_buffered() は一時バッファに読み込んで何度でも開けるようにする。
+    """
+
+    def __init__(self, filename, name, file_size, date_time, opener, stamp=None, CRC=None,
+                 reopenable=True, spool_dir=None):
+        self.filename = filename
+        self.name = name
+        self.file_size = file_size
+        self.date_time = date_time
+        self.CRC = CRC
+        self.stamp = CRC if stamp is None else stamp
+        self._opener = opener
+        self.reopenable = reopenable
+        self._spool_dir = spool_dir
+        self._spool = None
+        self._opened = False
+
+    def open(self):
+        if self._spool is not None:
+            return _SpoolReader(self._spool)
+        if not self.reopenable:
+            if self._opened:
+                raise ArchiveError(f"このメンバーは一度しか読めません: {self.filename}")
+            self._opened = True
+        return self._opener()
+
+    def open_buffered(self):
+        """中身を読み直せるように一時バッファ（大きければ一時ファイル）へ読み込んでから開く"""
+        if self.reopenable:
+            return self.open()
+        if self._spool is None:
+            spool = tempfile.SpooledTemporaryFile(max_size=NESTED_SPOOL_MEMORY, dir=self._spool_dir)
+            with self.open() as src:
+                shutil.copyfileobj(src, spool, SPOOL_BUFFER_SIZE)
+            self._spool = spool
+        return _SpoolReader(self._spool)
+
+    def release(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def with_prefix(self, prefix: str) -> "ArchiveMember":
+        """入れ子のアーカイブ内のメンバーとして名前に外側のメンバー名を付ける"""
+        self.filename = f"{prefix}/{self.filename}"
+        self.name = f"{prefix}/{self.name}"
+        return self
+
+class ArchiveReader:
+    """アーカイブ形式ごとの読み込み（members() でメンバーを格納順に返す）
+
+    source はパス、またはシーク可能なファイルオブジェクト（入れ子のアーカイブ）。
+    """
+
+    # 対応する拡張子（小文字、長いものから判定する）
+    suffixes = ()
+    # 中身を展開せずにメンバー一覧を得られるか（転送計画で使う）
+    cheap_listing = True
+
+    def __init__(self, source, spool_dir=None):
+        self.source = source
+        self.spool_dir = spool_dir
+        # 入れ子のアーカイブでは外側のメンバーの日時（日時を持たないメンバーの代わりに使う）
+        self.archive_time = None
+
+    def fallback_time(self) -> datetime.datetime:
+        """日時が記録されていないメンバーに使う日時（アーカイブ自体の更新日時。毎回同じ値になる）"""
+        if self.archive_time is not None:
+            return self.archive_time
+        if isinstance(self.source, (str, os.PathLike)):
+            try:
+                return datetime.datetime.fromtimestamp(os.stat(self.source).st_mtime)
+            except OSError:
+                pass
+        # zip で表せる最も古い日時
+        return datetime.datetime(1980, 1, 1)
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @classmethod
+    def handles(cls, name: str) -> bool:
+        return name.lower().endswith(cls.suffixes)
+
+    def members(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class ZipArchiveReader(ArchiveReader):
+    """zip（中央ディレクトリを読むだけで一覧が得られ、メンバーは個別に開ける）"""
+
+    suffixes = (".zip",)
+
+    def __init__(self, source, spool_dir=None):
+        super().__init__(source, spool_dir)
+        try:
+            self._zip = zipfile.ZipFile(source)
+        except zipfile.BadZipFile as e:
+            raise ArchiveError(str(e)) from e
+
+    def members(self):
+        for info in self._zip.infolist():
+            if info.is_dir():
+                continue
+            yield ArchiveMember(info.filename, decode_member_name(info), info.file_size, info.date_time,
+                                lambda info=info: self._zip.open(info), CRC=info.CRC)
+
+    def close(self):
+        self._zip.close()
+
+class TarArchiveReader(ArchiveReader):
+    """tar / tar.gz / tar.bz2 / tar.xz（ストリームとして先頭から順に読み、全体をメモリに載せない）"""
+
+    suffixes = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tbz", ".tar.xz", ".txz")
+    # 一覧を得るだけでも全体の伸張が必要
+    cheap_listing = False
+
+    def __init__(self, source, spool_dir=None):
+        super().__init__(source, spool_dir)
+        try:
+            if isinstance(source, (str, os.PathLike)):
+                self._tar = tarfile.open(source, mode="r|*")
+            else:
+                self._tar = tarfile.open(fileobj=source, mode="r|*")
+        except tarfile.TarError as e:
+            raise ArchiveError(str(e)) from e
+
+    def members(self):
+        try:
+            for info in self._tar:
+                if not info.isfile():
+                    continue
+                moment = datetime.datetime.fromtimestamp(info.mtime)
+                yield ArchiveMember(info.name, info.name, info.size, moment.timetuple()[:6],
+                                    lambda info=info: self._tar.extractfile(info), stamp=int(info.mtime),
+                                    reopenable=False, spool_dir=self.spool_dir)
+        except tarfile.TarError as e:
+            raise ArchiveError(str(e)) from e
+
+    def close(self):
+        self._tar.close()
+
+# 7z の展開スレッドが先読みしておくチャンク数（py7zr は約1MBずつ書き込む）
+SEVEN_ZIP_QUEUE_CHUNKS = 8
+
+class _Aborted(Exception):
+    """読み込み側が閉じたので7zの展開を打ち切る"""
+
+class _MemberStream:
+    """7zの展開スレッドから読み込み側へ1メンバー分の中身を渡すキュー
+
+    展開スレッドは put() で書き、終わったら finish() する。py7zr は CRC をメンバーを書き終えてから
+    照合するので、読み込み側は最後まで読んだあと照合の結果（verified）を待ってから EOF を返す。
+    """
+
+    def __init__(self, abort: threading.Event):
+        self._chunks = queue.Queue(maxsize=SEVEN_ZIP_QUEUE_CHUNKS)
+        self._abort = abort
+        self._pending = b""
+        self._eof = False
+        self.verified = threading.Event()
+        self.error = None
+
+    # === 展開スレッド側 ===
+    def put(self, chunk):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        self.put(None)
+
+    def fail(self, error):
+        self.error = error
+        self.verified.set()
+        try:
+            self.put(None)
+        except _Aborted:
+            pass
+
+    # === 読み込み側 ===
+    def read(self, size=-1) -> bytes:
+        parts = [self._pending]
+        length = len(self._pending)
+        while not self._eof and (size is None or size < 0 or length < size):
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+                self.verified.wait()
+                if self.error is not None:
+                    raise ArchiveError(str(self.error)) from self.error
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = b"".join(parts)
+        if size is None or size < 0:
+            self._pending = b""
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+    def drain(self):
+        """読まれなかった残りを読み捨てる（展開スレッドを次のメンバーへ進める）"""
+        self._pending = b""
+        while not self._eof:
+            if self._chunks.get() is None:
+                self._eof = True
+
+class _StreamWriter:
+    """py7zr の書き込み先（py7zr.io.Py7zIO と同じメソッド）。中身を _MemberStream へ流す"""
+
+    def __init__(self, stream: _MemberStream):
+        self._stream = stream
+        self._size = 0
+
+    def write(self, data) -> int:
+        self._stream.put(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def read(self, size=None) -> bytes:
+        return b""
+
+    def seek(self, offset, whence=0) -> int:
+        return self._size
+
+    def flush(self):
+        pass
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        self._stream.finish()
+
+class _StreamReader:
+    """読み込み側に渡すファイルオブジェクト"""
+
+    def __init__(self, stream: _MemberStream):
+        self._stream = stream
+
+    def read(self, size=-1) -> bytes:
+        return self._stream.read(size)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class SevenZipArchiveReader(ArchiveReader):
+    """7z（py7zr がある場合のみ）
+
+    画像と入れ子のアーカイブのメンバーだけを targets に指定し、展開スレッドが py7zr から受け取った中身を
+    そのまま読み込み側へ流す（一時フォルダへは書き出さず、メモリも先読みの数MBだけ）。
+    ソリッド圧縮では前から順にしか伸張できないので、tar と同じくメンバーは格納順に読むこと。
+    """
+
+    suffixes = (".7z",)
+
+    def __init__(self, source, spool_dir=None):
+        super().__init__(source, spool_dir)
+        try:
+            import py7zr
+        except ImportError as e:
+            raise ArchiveError("7z の展開には py7zr が必要です（pip install py7zr）") from e
+        try:
+            with py7zr.SevenZipFile(source, mode="r") as archive:
+                self._infos = [info for info in archive.list() if not info.is_directory]
+        except py7zr.Bad7zFile as e:
+            raise ArchiveError(str(e)) from e
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._thread = None
+        self._opened = None
+        self._current = None
+        self._error = None
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import py7zr  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _extract(self, targets):
+        """展開スレッド: targets のメンバーを順に _MemberStream へ書き込む"""
+        import py7zr
+
+        current = [None]
+        reader = self
+
+        class Factory:
+            def create(self, filename):
+                if current[0] is not None:
+                    # 次のメンバーに進んだ = 前のメンバーの CRC は一致した
+                    current[0].verified.set()
+                stream = current[0] = _MemberStream(reader._abort)
+                reader._hand_over((filename, stream))
+                return _StreamWriter(stream)
+
+        try:
+            if not isinstance(self.source, (str, os.PathLike)):
+                self.source.seek(0)
+            with py7zr.SevenZipFile(self.source, mode="r") as archive:
+                archive.extract(targets=targets, factory=Factory())
+            if current[0] is not None:
+                current[0].verified.set()
+        except _Aborted:
+            pass
+        except Exception as e:
+            self._error = e
+            if current[0] is not None:
+                current[0].fail(e)
+        finally:
+            try:
+                self._hand_over(None)
+            except _Aborted:
+                pass
+
+    def _hand_over(self, item):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                self._opened.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _open_member(self, filename):
+        with self._lock:
+            if self._thread is None:
+                targets = [info.filename for info in self._infos if is_image(info.filename) or reader_for(info.filename)]
+                self._opened = queue.Queue(maxsize=1)
+                self._thread = threading.Thread(target=self._extract, args=(targets,), name="7z-extract", daemon=True)
+                self._thread.start()
+            while True:
+                if self._current is not None:
+                    self._current.drain()
+                item = self._opened.get() if self._current is not False else None
+                if item is None:
+                    # 展開が終わった（以降は開けない）
+                    self._current = False
+                    if self._error is not None:
+                        raise ArchiveError(str(self._error)) from self._error
+                    raise ArchiveError(f"7z のメンバーは格納順にしか読めません: {filename}")
+                name, self._current = item
+                if name == filename:
+                    return _StreamReader(self._current)
+
+    def members(self):
+        fallback = None
+        for info in self._infos:
+            moment = info.creationtime
+            if moment is None:
+                fallback = fallback or self.fallback_time()
+                moment = fallback
+            yield ArchiveMember(info.filename, info.filename, info.uncompressed, moment.timetuple()[:6],
+                                lambda info=info: self._open_member(info.filename),
+                                stamp=info.crc32 if info.crc32 is not None else int(moment.timestamp()),
+                                reopenable=False, spool_dir=self.spool_dir)
+
+    def close(self):
+        if self._thread is not None:
+            self._abort.set()
+            self._thread.join()
+            self._thread = None
+
+# 判定順（register_reader で追加した形式が優先される）
+ARCHIVE_READERS = [ZipArchiveReader, TarArchiveReader, SevenZipArchiveReader]
+
+def register_reader(reader_class):
+    """新しいアーカイブ形式を追加する"""
+    ARCHIVE_READERS.insert(0, reader_class)
+    return reader_class
+
+def reader_for(name):
+    for reader_class in ARCHIVE_READERS:
+        if reader_class.handles(name):
+            return reader_class
+    return None
+
+def is_archive(path) -> bool:
+    """展開して取り込む対象か（7z は py7zr がなければそのままコピーする）"""
+    reader_class = reader_for(os.path.basename(path))
+    return reader_class is not None and reader_class.available()
+
+def open_archive(source, name=None, spool_dir=None) -> ArchiveReader:
+    name = name or os.path.basename(os.fspath(source))
+    reader_class = reader_for(name)
+    if reader_class is None:
+        raise ArchiveError(f"対応していない形式です: {name}")
+    return reader_class(source, spool_dir)
+
+def iter_archive_images(path, spool_dir=None, max_depth: int = NESTED_ARCHIVE_DEPTH):
+    """アーカイブ内の画像メンバーを格納順に返す（アーカイブ内のアーカイブも max_depth 階層までたどる）
+
+    入れ子のアーカイブは NESTED_SPOOL_MEMORY まではメモリ、それを超える分は spool_dir の一時ファイルに
+    読み込んでから開くので、アーカイブの大きさにかかわらずメモリの使用量は一定に収まる。
+    返したメンバーは次のメンバーへ進むまでに読み終えること（tar は順にしか読めない）。
+    """
+    with open_archive(path, spool_dir=spool_dir) as reader:
+        yield from _iter_images(reader, spool_dir, max_depth)
+
+def _iter_images(reader, spool_dir, depth):
+    for member in reader.members():
+        if is_image(member.name):
+            yield member
+        elif depth > 0 and reader_for(member.name):
+            yield from _iter_nested(member, spool_dir, depth - 1)
+
+def _iter_nested(member, spool_dir, depth):
+    with tempfile.SpooledTemporaryFile(max_size=NESTED_SPOOL_MEMORY, dir=spool_dir) as spool:
+        with member.open() as src:
+            shutil.copyfileobj(src, spool, SPOOL_BUFFER_SIZE)
+        spool.seek(0)
+        try:
+            nested = open_archive(spool, member.name, spool_dir)
+        except ArchiveError:
+            # 壊れた・未対応の入れ子は飛ばす（外側の取り込みは続ける）
+            return
+        nested.archive_time = datetime.datetime(*member.date_time)
+        with nested:
+            for inner in _iter_images(nested, spool_dir, depth):
+                yield inner.with_prefix(member.filename)
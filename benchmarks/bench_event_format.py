@@ -0,0 +1,70 @@
+"""イベント名フォーマットのベンチマーク
+
+旧実装（イベントごとにクロージャ定義 + re.search）と EventTemplate を比較する。
+    python benchmarks/bench_event_format.py [イベント数]
+"""
+import datetime
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_template import compile_event_format
+
+FORMATS = ["{date}_{event}", "{date:%Y-%m-%d}_{event}"]
+
+def make_events(count, rng):
+    events = []
+    base = datetime.datetime(2025, 1, 1, 9, 0, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        start = base + datetime.timedelta(hours=rng.randint(0, 24 * 365))
+        if i % 3:
+            start_value = {"dateTime": start.isoformat()}
+        else:
+            start_value = {"date": start.date().isoformat()}
+        events.append({"summary": f"撮影会 {i}", "start": start_value})
+    return events
+
+def legacy_format(events, fmt):
+    names = []
+    for event in events:
+        title = event.get('summary', '')
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        dt = datetime.datetime.fromisoformat(start)
+
+        def format_with_date(fmt: str, dt: datetime.datetime) -> str:
+            match = re.search(r"\{date:([^}]+)\}", fmt)
+            if match:
+                date_fmt = match.group(1)
+                formatted_date = dt.strftime(date_fmt)
+                fmt = fmt.replace(match.group(0), formatted_date)
+            else:
+                fmt = fmt.replace("{date}", dt.strftime("%Y%m%d"))
+            return fmt.replace("{event}", title)
+
+        names.append(format_with_date(fmt, dt))
+    return names
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    events = make_events(count, random.Random(0))
+    print(f"events={count}")
+    for fmt in FORMATS:
+        start = time.perf_counter()
+        legacy = legacy_format(events, fmt)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        template = compile_event_format(fmt)
+        rendered = [template.render(event) for event in events]
+        new_time = time.perf_counter() - start
+
+        assert legacy == rendered, "出力が旧実装と一致しません"
+        print(f"{fmt:28s} legacy {count / legacy_time:10.0f} ev/s  template {count / new_time:10.0f} ev/s"
+              f"  ({legacy_time / new_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
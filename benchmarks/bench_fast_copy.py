@@ -0,0 +1,66 @@
+"""転送バックエンドのベンチマーク
+
+shutil.copy2 と fast_copy の各方式を、大きなファイルと小さなファイルで比較する。
+    python benchmarks/bench_fast_copy.py [大ファイルMB] [小ファイル数] [作業フォルダ]
+作業フォルダを別ドライブにすると、デバイスをまたいだ場合の比較になる。
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_copy import BUFFERED, COPY_FILE_RANGE, REFLINK, SENDFILE, copy_file, transfer_file
+
+def timed(label, func, paths, dest_dir, total_bytes):
+    os.makedirs(dest_dir)
+    start = time.perf_counter()
+    used = set()
+    for path in paths:
+        result = func(path, os.path.join(dest_dir, os.path.basename(path)))
+        if result:
+            used.add(result)
+    elapsed = time.perf_counter() - start
+    note = f" [{', '.join(sorted(used))}]" if used else ""
+    print(f"  {label:18s} {elapsed:7.3f} s  {total_bytes / elapsed / 1024 / 1024:9.1f} MB/s{note}")
+    shutil.rmtree(dest_dir)
+
+def run_case(title, paths, work_dir):
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    print(f"{title}: {len(paths)} files, {total_bytes / 1024 / 1024:.1f} MB")
+    timed("copy2", lambda s, d: shutil.copy2(s, d) and None, paths, os.path.join(work_dir, "copy2"), total_bytes)
+    timed("auto", lambda s, d: transfer_file(s, d)[0], paths, os.path.join(work_dir, "auto"), total_bytes)
+    backends = [BUFFERED]
+    if sys.platform.startswith("linux"):
+        backends = [REFLINK, COPY_FILE_RANGE, SENDFILE, BUFFERED]
+    for backend in backends:
+        timed(backend, lambda s, d, b=backend: copy_file(s, d, b), paths,
+              os.path.join(work_dir, backend), total_bytes)
+
+def main():
+    large_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    small_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    work_root = sys.argv[3] if len(sys.argv) > 3 else None
+    with tempfile.TemporaryDirectory() as src_dir, tempfile.TemporaryDirectory(dir=work_root) as work_dir:
+        large = os.path.join(src_dir, "large.cr2")
+        with open(large, "wb") as f:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(large_mb):
+                f.write(chunk)
+        small_dir = os.path.join(src_dir, "small")
+        os.makedirs(small_dir)
+        small = []
+        payload = os.urandom(16 * 1024)
+        for i in range(small_count):
+            path = os.path.join(small_dir, f"IMG_{i:05d}.JPG")
+            with open(path, "wb") as f:
+                f.write(payload)
+            small.append(path)
+
+        run_case("large", [large], work_dir)
+        run_case("small", small, work_dir)
+
+if __name__ == "__main__":
+    main()
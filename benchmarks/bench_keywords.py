@@ -0,0 +1,73 @@
+"""キーワード判定のマイクロベンチマーク
+
+旧実装（イベントごとにJSONを読み込んで線形探索）と KeywordMatcher を比較する。
+    python benchmarks/bench_keywords.py [イベント数] [キーワード数]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_matcher import KeywordMatcher
+
+WORDS = ["撮影", "会議", "ランチ", "定例", "ミーティング", "オフ会", "イベント", "打ち合わせ",
+         "meeting", "review", "sync", "party", "travel", "dentist", "kemocon", "Photo"]
+
+def make_keywords(count, rng):
+    keywords = ["ケモ", "けも", "獣", "kemocon", "OFFF", "もふ", "JMoF", "撮影"]
+    while len(keywords) < count:
+        keywords.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyzアイウエオカキクケコ") for _ in range(rng.randint(3, 8))))
+    return keywords
+
+def make_events(count, rng):
+    events = []
+    for _ in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        description = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 20)))
+        events.append((title, description))
+    return events
+
+def legacy_is_hit(keywords_file, title, description=""):
+    # 旧 is_hit_keywords_event と同じくイベントごとにファイルを読む
+    with open(keywords_file, "r", encoding="utf-8") as f:
+        keywords = json.load(f).get("KEYWORDS", [])
+    combined = ((title or "") + " " + (description or "")).lower()
+    for keyword in keywords:
+        if keyword.lower() in combined:
+            return True
+    return False
+
+def main():
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_keywords = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    rng = random.Random(0)
+    keywords = make_keywords(n_keywords, rng)
+    events = make_events(n_events, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        keywords_file = os.path.join(tmp, "config_keywords.json")
+        with open(keywords_file, "w", encoding="utf-8") as f:
+            json.dump({"KEYWORDS": keywords}, f, ensure_ascii=False)
+
+        start = time.perf_counter()
+        legacy_hits = sum(legacy_is_hit(keywords_file, t, d) for t, d in events)
+        legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(keywords)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new_hits = sum(matcher.is_hit_event(t, d) for t, d in events)
+    new_time = time.perf_counter() - start
+
+    print(f"events={n_events} keywords={n_keywords}")
+    print(f"legacy : {legacy_time * 1000:8.1f} ms  hits={legacy_hits}")
+    print(f"matcher: {new_time * 1000:8.1f} ms  hits={new_hits} (build {build_time * 1000:.1f} ms)")
+    print(f"speedup: {legacy_time / new_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""起動時間のベンチマーク（-X importtime で import の内訳を、実際に画面を作って最初の描画までを測る）
+
+    python benchmarks/bench_startup.py [--module FileMoverApp] [--repeat 5] [--no-window] [--out 結果.json]
+起動時に読み込むべきでない重いライブラリ（Google / AWS / 暗号化）が import されていれば eager_heavy に載る。
+画面の計測にはディスプレイと customtkinter / tkinterdnd2 が必要。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時には読み込まず、画面表示後に裏で読み込むパッケージ
+HEAVY_PACKAGES = ("googleapiclient", "google_auth_oauthlib", "google.auth", "boto3", "botocore", "cryptography")
+
+# 子プロセスで実行する「import → 画面生成 → 最初の描画」までの計測
+FIRST_WINDOW_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import {module} as app_module
+imported = time.perf_counter()
+app = app_module.{app_class}()
+app.update_idletasks()
+app.update()
+drawn = time.perf_counter()
+loaded = sorted(name for name in sys.modules if name.split(".")[0] in {heavy_roots!r})
+print(json.dumps({{"import": imported - started, "first_window": drawn - started, "heavy": loaded}}))
+app.destroy()
+"""
+
+def parse_importtime(stderr: str) -> list:
+    """-X importtime の出力を [(名前, 自身のμs, 累積μs, 深さ), ...] にする"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+def measure_imports(module: str) -> dict:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    rows = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+        return {"error": error}
+    top = next((row for row in rows if row[0] == module), None)
+    # 直接 import しているモジュールを累積時間の大きい順に
+    children = sorted((row for row in rows if row[3] == 1), key=lambda row: row[2], reverse=True)
+    heavy = sorted({name for name, _, _, _ in rows if name.startswith(HEAVY_PACKAGES)})
+    return {
+        "process_seconds": round(elapsed, 4),
+        "import_seconds": round(top[2] / 1e6, 4) if top else None,
+        "modules": len(rows),
+        "slowest": [{"module": name, "cumulative_ms": round(cumulative / 1000, 2), "self_ms": round(own / 1000, 2)}
+                    for name, own, cumulative, _ in children[:15]],
+        "eager_heavy": heavy,
+    }
+
+def measure_first_window(module: str, app_class: str) -> dict:
+    script = FIRST_WINDOW_SCRIPT.format(module=module, app_class=app_class,
+                                        heavy_roots=sorted({name.split(".")[0] for name in HEAVY_PACKAGES}))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0 or not result.stdout.strip():
+        lines = result.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit {result.returncode}"}
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return {"process_seconds": round(elapsed, 4), "import_seconds": round(data["import"], 4),
+            "first_window_seconds": round(data["first_window"], 4), "heavy_loaded_at_first_window": data["heavy"]}
+
+def summarize(runs: list, keys) -> dict:
+    """複数回の計測から中央値と最小値を出す（失敗した回は除く）"""
+    ok = [run for run in runs if "error" not in run]
+    if not ok:
+        return runs[-1]
+    summary = dict(ok[-1])
+    for key in keys:
+        values = [run[key] for run in ok if run.get(key) is not None]
+        if values:
+            summary[key] = round(statistics.median(values), 4)
+            summary[f"{key}_min"] = round(min(values), 4)
+    summary["runs"] = len(ok)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="FileMoverApp")
+    parser.add_argument("--app-class", default="FileMoverApp")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-window", action="store_true", help="画面は作らず import だけを測る")
+    parser.add_argument("--out", help="結果のJSONの保存先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "module": args.module,
+        "imports": summarize([measure_imports(args.module) for _ in range(args.repeat)],
+                             ("process_seconds", "import_seconds")),
+    }
+    if not args.no_window:
+        results["window"] = summarize([measure_first_window(args.module, args.app_class) for _ in range(args.repeat)],
+                                      ("process_seconds", "import_seconds", "first_window_seconds"))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""取り込み・展開・予定の絞り込みを段階ごとに測るベンチマーク（Tk・通信なし）
+
+合成データ（小さなJPEG多数・RAW相当の大きなファイル・CP932名で深い階層のzip・同名ファイル・
+1万件の予定を返す偽のCalendarサービス）を作業フォルダに生成し、段階ごとに
+files/s・MB/s・CPU時間・最大RSS・システムコール数を測って JSON に書き出す。
+    python benchmarks/bench_suite.py [--out 結果.json] [--work 作業フォルダ] [--quick] [--compare 前回.json]
+乱数の種は固定なので、同じ引数で取った結果同士を比べれば退行に気付ける。
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_fetch import sync_calendars
+from config import DEFAULT_KEYWORDS, TRANSFER_WORKERS
+from dedupe_index import ContentIndex, hash_file
+from event_store import EventStore
+from ingest import format_event_names
+from ingest_journal import IngestJournal
+from keyword_matcher import KeywordMatcher
+from manifest import IngestManifest
+from planner import build_plan
+from transfer_engine import TransferEngine
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+# zip内の深い階層（Windowsのエクスプローラーで圧縮したカードのコピーを想定）
+WRAPPER_FOLDERS = ["撮影データ", "2024年", "イベント", "カメラＡ", "DCIM", "100CANON"]
+EVENT_TITLES = ["定例会議", "ランチ", "打ち合わせ", "歯医者", "review", "sync", "travel"]
+HIT_TITLES = ["撮影会", "ケモノオフ会", "kemocon 2024", "もふもふ撮影"]
+
+# === 計測 ===
+
+# 数えるPython側のシステムコール相当の監査イベント（stat は監査されない）
+AUDITED_PREFIXES = ("open", "os.", "shutil.")
+_audit_counts = collections.Counter()
+
+def _audit(event, args):
+    if event.startswith(AUDITED_PREFIXES):
+        _audit_counts[event] += 1
+
+def _proc_io() -> dict:
+    """Linux: プロセス全体（全スレッド）の read/write 系システムコール数"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(fields["syscr"]), "write": int(fields["syscw"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+def _reset_peak_rss() -> bool:
+    """Linux: 最大RSS（VmHWM）を現在値に戻す（段階ごとの最大値を測るため）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux はKB単位
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+class Stage:
+    """with ブロック1つ分の所要時間・CPU時間・最大RSS・システムコール数を測る"""
+
+    def __init__(self, name, files: int = 0, nbytes: int = 0):
+        self.name = name
+        self.files = files
+        self.bytes = nbytes
+        self.result = None
+
+    def __enter__(self):
+        self._peak_reset = _reset_peak_rss()
+        self._io = _proc_io()
+        self._audit = collections.Counter(_audit_counts)
+        self._cpu = os.times()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._started
+        cpu = os.times()
+        io = _proc_io()
+        audited = collections.Counter(_audit_counts)
+        audited.subtract(self._audit)
+        self.result = {
+            "files": self.files,
+            "bytes": self.bytes,
+            "seconds": round(seconds, 4),
+            "files_per_s": round(self.files / seconds, 1) if seconds else None,
+            "mb_per_s": round(self.bytes / seconds / 1024 / 1024, 1) if seconds else None,
+            "cpu_seconds": round(cpu.user + cpu.system - self._cpu.user - self._cpu.system, 3),
+            "peak_rss_mb": round(_peak_rss_mb() or 0, 1),
+            # リセットできない環境ではプロセス開始からの最大値になる
+            "peak_rss_scope": "stage" if self._peak_reset else "process",
+            "syscalls": {
+                **{key: io[key] - self._io[key] for key in io if key in self._io},
+                "audited": sum(count for count in audited.values() if count > 0),
+                "audited_by_event": {event: count for event, count in sorted(audited.items()) if count > 0},
+            },
+        }
+        return False
+
+# === 合成データ ===
+
+class _Cp932ZipInfo(zipfile.ZipInfo):
+    """ファイル名をUTF-8フラグなしのCP932で書き込む（日本語版Windowsの標準の圧縮と同じ形式）"""
+
+    def _encodeFilenameFlags(self):
+        return self.filename.encode("cp932"), self.flag_bits & ~0x800
+
+def _payload(rng, size: int) -> bytes:
+    return JPEG_HEADER + rng.randbytes(max(size - len(JPEG_HEADER), 0))
+
+def make_jpegs(directory, count: int, rng, min_kb: int = 16, max_kb: int = 96) -> list:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"IMG_{i:05d}.JPG")
+        with open(path, "wb") as f:
+            f.write(_payload(rng, rng.randint(min_kb, max_kb) * 1024))
+        paths.append(path)
+    return paths
+
+def make_raws(directory, count: int, size_mb: int, rng) -> list:
+    """RAW相当の大きなファイル（1MBのブロックを繰り返すので生成は速いが、中身は圧縮できない）"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"IMG_{i:04d}.CR2")
+        block = rng.randbytes(1024 * 1024)
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+def make_cp932_zips(directory, count: int, members: int, rng):
+    """CP932 の名前で深い階層に画像を格納した zip を作り、(パス一覧, 画像数, 画像の合計バイト) を返す"""
+    os.makedirs(directory, exist_ok=True)
+    paths, images, total = [], 0, 0
+    for i in range(count):
+        path = os.path.join(directory, f"カード{i:02d}.zip")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zip_ref:
+            folder = "/".join(WRAPPER_FOLDERS + [f"撮影{i:02d}"])
+            zip_ref.writestr(_Cp932ZipInfo(f"{folder}/説明.txt", (2024, 5, 1, 9, 0, 0)), "撮影メモ".encode("cp932"))
+            for j in range(members):
+                data = _payload(rng, rng.randint(16, 96) * 1024)
+                zip_ref.writestr(_Cp932ZipInfo(f"{folder}/写真_{j:04d}.jpg", (2024, 5, 1, 10, j // 60 % 60, j % 60)), data)
+                images += 1
+                total += len(data)
+        paths.append(path)
+    return paths, images, total
+
+def make_collisions(directory, cards: int, per_card: int, rng) -> list:
+    """同じファイル名（IMG_0001.JPG ...）のカードを複数枚、同じ保存先へまとめる想定"""
+    paths = []
+    for card in range(cards):
+        card_dir = os.path.join(directory, f"card{card:02d}")
+        os.makedirs(card_dir, exist_ok=True)
+        for i in range(per_card):
+            path = os.path.join(card_dir, f"IMG_{i:04d}.JPG")
+            with open(path, "wb") as f:
+                f.write(_payload(rng, rng.randint(8, 32) * 1024))
+            paths.append(path)
+    return paths
+
+def make_events(count: int, rng, hit_ratio: float = 0.1) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    events = []
+    for i in range(count):
+        start = now - datetime.timedelta(minutes=rng.randint(0, 364 * 24 * 60))
+        title = rng.choice(HIT_TITLES) if rng.random() < hit_ratio else rng.choice(EVENT_TITLES)
+        if i % 5:
+            start_value = {"dateTime": start.isoformat()}
+            end_value = {"dateTime": (start + datetime.timedelta(hours=2)).isoformat()}
+        else:
+            start_value = {"date": start.date().isoformat()}
+            end_value = {"date": (start.date() + datetime.timedelta(days=1)).isoformat()}
+        events.append({"id": f"ev{i:06d}", "status": "confirmed", "summary": f"{title} #{i}",
+                       "description": "場所: 会議室A" if i % 7 else "", "start": start_value, "end": end_value})
+    return events
+
+class _FakeRequest:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self):
+        return self._result
+
+class FakeCalendarService:
+    """events().list(...).execute() だけを持つ Calendar API の代わり（通信なし）
+
+    初回は全件をページ分けして返し、syncToken 付きの差分同期では変更なしを返す。
+    """
+
+    def __init__(self, events):
+        self._events = events
+
+    def events(self):
+        return self
+
+    def list(self, calendarId="primary", maxResults=250, pageToken=None, syncToken=None, **params):
+        if syncToken:
+            return _FakeRequest({"items": [], "nextSyncToken": syncToken})
+        start = int(pageToken or 0)
+        page = {"items": self._events[start:start + maxResults]}
+        if start + maxResults < len(self._events):
+            page["nextPageToken"] = str(start + maxResults)
+        else:
+            page["nextSyncToken"] = "sync-1"
+        return _FakeRequest(page)
+
+# === 段階 ===
+
+def ingest(work, name, sources, dest_dir, library, workers, files, nbytes) -> dict:
+    """画面の「実行」と同じ構成（重複判定・検証・マニフェスト・ジャーナルあり）で取り込む"""
+    os.makedirs(dest_dir, exist_ok=True)
+    engine = TransferEngine(dest_dir, workers=workers, content_index=library, dedupe="skip",
+                            manifest=IngestManifest(dest_dir),
+                            journal=IngestJournal(os.path.join(work, f"{name}.jsonl"), sources))
+    with Stage(name, files, nbytes) as stage:
+        engine.start(sources)
+        engine.wait()
+        engine.manifest.close()
+        engine.journal.close()
+    if engine.errors:
+        raise RuntimeError(f"{name}: {engine.errors[:3]}")
+    return stage.result
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    work = args.work
+    library_root = os.path.join(work, "library")
+    stages = {}
+
+    print("generating workloads ...", file=sys.stderr)
+    jpegs = make_jpegs(os.path.join(work, "src", "jpeg"), args.jpegs, rng)
+    raws = make_raws(os.path.join(work, "src", "raw"), args.raws, args.raw_mb, rng)
+    zips, zip_images, zip_bytes = make_cp932_zips(os.path.join(work, "src", "zip"), args.zips, args.zip_members, rng)
+    collisions = make_collisions(os.path.join(work, "src", "collide"), args.cards, args.per_card, rng)
+    events = make_events(args.events, rng)
+    size_of = lambda paths: sum(os.path.getsize(path) for path in paths)
+
+    dest_of = lambda name: os.path.join(library_root, name)
+    groups = [(dest_of("jpeg"), jpegs), (dest_of("raw"), raws), (dest_of("zip"), zips), (dest_of("collide"), collisions)]
+    with Stage("plan", sum(len(sources) for _, sources in groups)) as stage:
+        plan = build_plan(groups, base_root=library_root)
+        stage.bytes = plan.total_bytes
+    stages["plan"] = stage.result
+
+    library = ContentIndex(library_root)
+    try:
+        stages["ingest_jpeg"] = ingest(work, "ingest_jpeg", jpegs, dest_of("jpeg"), library, args.workers,
+                                       len(jpegs), size_of(jpegs))
+        stages["ingest_raw"] = ingest(work, "ingest_raw", raws, dest_of("raw"), library, args.workers,
+                                      len(raws), size_of(raws))
+        stages["extract_zip"] = ingest(work, "extract_zip", zips, dest_of("zip"), library, args.workers,
+                                       zip_images, zip_bytes)
+        stages["ingest_collisions"] = ingest(work, "ingest_collisions", collisions, dest_of("collide"), library,
+                                             args.workers, len(collisions), size_of(collisions))
+        # 取り込み済みのカードをもう一度入れた場合（すべて同じ内容として飛ばされる）
+        stages["dedupe_skip"] = ingest(work, "dedupe_skip", jpegs, dest_of("jpeg_again"), library, args.workers,
+                                       len(jpegs), size_of(jpegs))
+    finally:
+        library.close()
+
+    # 同じサイズのファイルが大量にある保存先（連写の固定長JPEGなど）での重複判定
+    same_size = make_jpegs(os.path.join(work, "same_size", "library"), args.same_size, rng, 32, 32)
+    probes = make_jpegs(os.path.join(work, "same_size", "new"), min(args.same_size, 500), rng, 32, 32)
+    index = ContentIndex(os.path.join(work, "same_size"))
+    try:
+        index.add_many((path, os.path.getsize(path), os.stat(path).st_mtime_ns, hash_file(path)) for path in same_size)
+        with Stage("dedupe_same_size", len(probes), size_of(probes)) as stage:
+            for path in probes:
+                index.find_duplicate_file(path)
+        stages["dedupe_same_size"] = stage.result
+    finally:
+        index.close()
+
+    service = FakeCalendarService(events)
+    store = EventStore(os.path.join(work, "events.sqlite3"))
+    try:
+        with Stage("calendar_sync", len(events)) as stage:
+            sync_calendars(store, lambda: service, ["primary"], page_size=250)
+        stages["calendar_sync"] = stage.result
+        # 差分同期（変更なし）の固定費
+        with Stage("calendar_resync") as stage:
+            sync_calendars(store, lambda: service, ["primary"], page_size=250)
+        stages["calendar_resync"] = stage.result
+        matcher = KeywordMatcher(DEFAULT_KEYWORDS)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with Stage("keyword_filter", len(events)) as stage:
+            names = format_event_names(store.iter_matching_events(matcher, now - datetime.timedelta(days=365), now),
+                                       "{date}_{event}")
+        stages["keyword_filter"] = dict(stage.result, hits=len(names))
+    finally:
+        store.close()
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("out", "work", "compare")},
+        "stages": stages,
+    }
+
+def compare(current: dict, previous: dict):
+    print(f"{'stage':20s} {'seconds':>9s} {'previous':>9s} {'change':>8s}")
+    for name, result in current["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if not before or not before.get("seconds"):
+            print(f"{name:20s} {result['seconds']:9.3f}")
+            continue
+        change = (result["seconds"] / before["seconds"] - 1) * 100
+        print(f"{name:20s} {result['seconds']:9.3f} {before['seconds']:9.3f} {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", help="結果のJSONの保存先（省略時は標準出力）")
+    parser.add_argument("--work", help="作業フォルダ（保存先のドライブで測るときに指定。省略時は一時フォルダ）")
+    parser.add_argument("--compare", help="前回の結果のJSONと所要時間を比べる")
+    parser.add_argument("--quick", action="store_true", help="小さなデータで動作確認だけする")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS)
+    parser.add_argument("--jpegs", type=int, default=5000)
+    parser.add_argument("--raws", type=int, default=2)
+    parser.add_argument("--raw-mb", type=int, default=2048)
+    parser.add_argument("--zips", type=int, default=10)
+    parser.add_argument("--zip-members", type=int, default=300)
+    parser.add_argument("--cards", type=int, default=10)
+    parser.add_argument("--per-card", type=int, default=300)
+    parser.add_argument("--same-size", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=10000)
+    args = parser.parse_args()
+    if args.quick:
+        args.jpegs, args.raws, args.raw_mb = 300, 1, 64
+        args.zips, args.zip_members, args.cards, args.per_card, args.same_size = 2, 50, 3, 50, 1000
+
+    sys.addaudithook(_audit)
+    work_root = args.work
+    with tempfile.TemporaryDirectory(dir=work_root, prefix="bench-") as work:
+        args.work = work
+        results = run(args)
+        args.work = work_root
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""転送エンジンのベンチマーク（Tk不要）
+
+逐次 shutil.copy2（旧 execute 相当）と TransferEngine のワーカー数別スループットを比較する。
+    python benchmarks/bench_transfer.py [ファイル数] [1ファイルのKB]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfer_engine import TransferEngine
+
+def make_sources(src_dir, count, size_kb):
+    payload = os.urandom(size_kb * 1024)
+    paths = []
+    for i in range(count):
+        path = os.path.join(src_dir, f"IMG_{i:05d}.CR2")
+        with open(path, "wb") as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+def report(label, count, total_bytes, elapsed):
+    print(f"{label:18s} {elapsed:7.2f} s  {count / elapsed:8.1f} files/s  {total_bytes / elapsed / 1024 / 1024:8.1f} MB/s")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    size_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+    with tempfile.TemporaryDirectory() as tmp:
+        src_dir = os.path.join(tmp, "src")
+        os.makedirs(src_dir)
+        paths = make_sources(src_dir, count, size_kb)
+        total_bytes = count * size_kb * 1024
+
+        dest = os.path.join(tmp, "sequential")
+        os.makedirs(dest)
+        start = time.perf_counter()
+        for path in paths:
+            shutil.copy2(path, os.path.join(dest, os.path.basename(path)))
+        report("copy2 sequential", count, total_bytes, time.perf_counter() - start)
+        shutil.rmtree(dest)
+
+        for workers in (1, 4, 8):
+            dest = os.path.join(tmp, f"engine{workers}")
+            engine = TransferEngine(dest, workers=workers)
+            start = time.perf_counter()
+            engine.start(paths)
+            engine.wait()
+            report(f"engine x{workers}", count, total_bytes, time.perf_counter() - start)
+            assert not engine.errors, engine.errors
+            shutil.rmtree(dest)
+
+if __name__ == "__main__":
+    main()
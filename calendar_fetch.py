@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import CALENDAR_FETCH_WORKERS
+from tracing import EVENT_FETCH, span
+
+def iter_pages(request_factory, **params):
+    """nextPageToken をたどって全ページを順に返すジェネレータ"""
+    page_token = None
+    while True:
+        request_params = dict(params)
+        if page_token:
+            request_params["pageToken"] = page_token
+        page = request_factory(**request_params).execute()
+        yield page
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+def iter_event_pages(service, calendar_id: str = "primary", **params):
+    """events().list の全ページを返す"""
+    return iter_pages(service.events().list, calendarId=calendar_id, **params)
+
+def list_calendar_ids(service) -> list:
+    """calendarList から参照可能なカレンダーIDを取得（primary を先頭に）"""
+    ids = []
+    for page in iter_pages(service.calendarList().list, minAccessRole="reader"):
+        for item in page.get("items", []):
+            if item.get("primary"):
+                ids.insert(0, "primary")
+            else:
+                ids.append(item["id"])
+    return ids or ["primary"]
+
+def sync_calendars(store, service_factory, calendar_ids, page_size: int = 250,
+                   max_workers: int = CALENDAR_FETCH_WORKERS, on_page=None) -> int:
+    """複数カレンダーを上限付きスレッドプールで並行に同期する
+
+    所要時間は合計ではなく最も遅いカレンダーに比例する。
+    on_page(calendar_id, items) はページを反映するたびにワーカースレッドから呼ばれる。
+    service_factory() はワーカースレッドから呼ばれる（CalendarSession.service は requests のセッションを
+    通る1つのサービスを全スレッドで共有する）。
+    """
+    calendar_ids = list(calendar_ids)
+    if not calendar_ids:
+        return 0
+
+    def sync_one(calendar_id):
+        with span(EVENT_FETCH, calendar=calendar_id) as sp:
+            changed = store.sync(service_factory(), calendar_id, page_size=page_size, on_page=on_page)
+            sp.set(changed=changed)
+            return changed
+
+    changed = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calendar_ids)))) as pool:
+        futures = {pool.submit(sync_one, cid): cid for cid in calendar_ids}
+        for future in as_completed(futures):
+            try:
+                changed += future.result()
+            except Exception as e:
+                errors.append((futures[future], e))
+    if errors:
+        # 1件でも失敗したら最初のエラーを呼び出し元へ（成功分はストアに反映済み）
+        raise errors[0][1]
+    return changed
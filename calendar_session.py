@@ -0,0 +1,197 @@
+import datetime
+import os
+import pickle
+import stat
+import threading
+from config import CALENDAR_FETCH_WORKERS, CALENDAR_HTTP_TIMEOUT, SCOPES, TOKEN_PATH, TOKEN_REFRESH_MARGIN, make_hidden
+from decrypt_utils import get_client_config, prefetch_client_config
+
+# google-api-python-client などは読み込みに時間がかかるので、必要になった時点で import する
+# （保存済みのトークンが有効なら、ブラウザ認証用の google_auth_oauthlib は読み込まない）
+
+class SessionHttp:
+    """googleapiclient の http（httplib2.Http の request() と同じ形）を requests のセッションで送る
+
+    requests のコネクションプールはスレッド間で共有できるので、サービスも全スレッドで1つを使う。
+    """
+
+    def __init__(self, session, timeout: float = CALENDAR_HTTP_TIMEOUT):
+        self.session = session
+        self.timeout = timeout
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+        import requests
+
+        try:
+            response = self.session.request(method, uri, data=body, headers=headers, timeout=self.timeout,
+                                            allow_redirects=redirections > 0)
+        except requests.exceptions.Timeout as e:
+            raise TimeoutError(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            # googleapiclient が再試行の対象にする例外に合わせる
+            raise ConnectionError(str(e)) from e
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # 本文は requests が展開済み（httplib2 と同じく元の値は -content-encoding に残す）
+        if "content-encoding" in info:
+            info["-content-encoding"] = info.pop("content-encoding")
+            info.pop("content-length", None)
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        self.session.close()
+
+class CalendarSession:
+    """認証情報とCalendarサービスをメモリに保持し、期限前にバックグラウンドで更新する"""
+
+    def __init__(self, token_path=TOKEN_PATH, refresh_margin: float = TOKEN_REFRESH_MARGIN,
+                 client_config_loader=get_client_config):
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self._load_client_config = client_config_loader
+        self._lock = threading.RLock()
+        self._creds = None
+        self._generation = 0
+        self._timer = None
+        # トークン更新用のHTTPセッション（コネクションを使い回す。初めて更新するときに作る）
+        self._http_session = None
+        self._request_object = None
+        # API呼び出し用（認証情報が変わるたびに作り直す）
+        self._api_http = None
+        self._service = None
+        self._service_generation = None
+
+    def _refresh_request(self):
+        """トークン更新に使う google.auth のリクエスト"""
+        with self._lock:
+            if self._request_object is None:
+                import requests
+                from google.auth.transport.requests import Request
+
+                self._http_session = requests.Session()
+                self._request_object = Request(session=self._http_session)
+            return self._request_object
+
+    # === 認証情報 ===
+    def credentials(self):
+        """有効な認証情報を返す（必要に応じて読み込み・更新・ブラウザ認証）"""
+        with self._lock:
+            if self._creds is None and os.path.exists(self.token_path):
+                with open(self.token_path, 'rb') as token:
+                    self._creds = pickle.load(token)
+
+            creds = self._creds
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    creds.refresh(self._refresh_request())
+                else:
+                    from google_auth_oauthlib.flow import InstalledAppFlow
+
+                    flow = InstalledAppFlow.from_client_config(self._load_client_config(), SCOPES)
+                    creds = flow.run_local_server(port=0, timeout_seconds=60)
+                self._set_credentials(creds)
+            elif self._timer is None:
+                self._schedule_refresh()
+            return self._creds
+
+    def _set_credentials(self, creds):
+        self._creds = creds
+        # 認証情報が変わったらスレッドごとのサービスも作り直す
+        self._generation += 1
+        self._save_token()
+        self._schedule_refresh()
+
+    def _save_token(self):
+        if not os.path.exists(self.token_path):
+            self.token_path.parent.mkdir(parents=True, exist_ok=True)
+            make_hidden(self.token_path.parent)
+        with open(self.token_path, 'wb') as token:
+            pickle.dump(self._creds, token)
+        try:
+            os.chmod(self.token_path, stat.S_IREAD | stat.S_IWRITE)
+        except FileNotFoundError:
+            pass
+
+    def _schedule_refresh(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        creds = self._creds
+        if not creds or not creds.refresh_token or not creds.expiry:
+            return
+        # expiry はナイーブなUTC
+        remaining = (creds.expiry - datetime.datetime.utcnow()).total_seconds()
+        self._timer = threading.Timer(max(remaining - self.refresh_margin, 0), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            self._timer = None
+            if not self._creds:
+                return
+            try:
+                self._creds.refresh(self._refresh_request())
+                self._save_token()
+            except Exception:
+                # 失敗時は次回 credentials() 呼び出しで再試行される
+                return
+            self._schedule_refresh()
+
+    # === サービス ===
+    def service(self):
+        """Calendarサービス（全スレッドで共有し、API呼び出しは requests のコネクションプールを通る）"""
+        creds = self.credentials()
+        with self._lock:
+            if self._service_generation != self._generation:
+                import requests
+                from google.auth.transport.requests import AuthorizedSession
+                from googleapiclient.discovery import build
+
+                if self._api_http is not None:
+                    self._api_http.close()
+                # アクセストークンの付与・期限切れ時の更新は AuthorizedSession が行う（更新の通信はトークン更新用のセッション）
+                session = AuthorizedSession(creds, auth_request=self._refresh_request())
+                session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1,
+                                                                        pool_maxsize=CALENDAR_FETCH_WORKERS))
+                self._api_http = SessionHttp(session)
+                self._service = build('calendar', 'v3', http=self._api_http, cache_discovery=False)
+                self._service_generation = self._generation
+            return self._service
+
+    def prefetch(self):
+        """トークン未取得なら、初回認証に必要なクライアント設定を先に取得しておく"""
+        if not os.path.exists(self.token_path):
+            return prefetch_client_config()
+        return None
+
+    def preload(self):
+        """予定の取得で使うライブラリを先に読み込んでおく（呼び出したスレッドで import する）"""
+        import googleapiclient.discovery  # noqa: F401
+        self._refresh_request()
+        if not os.path.exists(self.token_path):
+            import google_auth_oauthlib.flow  # noqa: F401
+
+    def reset(self):
+        """認証情報を破棄（アカウント変更時）"""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._creds = None
+            self._generation += 1
+            if os.path.exists(self.token_path):
+                os.remove(self.token_path)
+
+    def close(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if self._api_http is not None:
+            self._api_http.close()
+        if self._http_session is not None:
+            self._http_session.close()
@@ -0,0 +1,134 @@
+import datetime
+import os
+import struct
+
+# 撮影日時を探すために読む先頭バイト数（Exif/TIFFヘッダーはほぼこの範囲に収まる）
+HEADER_READ_SIZE = 64 * 1024
+
+# TIFFタグ
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+
+# TIFF構造を持つRAWの先頭（II*\0 / MM\0* に加えて、Olympus ORF と Panasonic RW2 の独自マジック）
+_TIFF_MAGICS = (b"II*\0", b"MM\0*", b"IIRO", b"IIRS", b"MMOR", b"IIU\0")
+
+def _parse_exif_datetime(value: bytes, offset: bytes = None):
+    text = value.split(b"\0", 1)[0].decode("ascii", "ignore").strip()
+    try:
+        moment = datetime.datetime.strptime(text, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    if offset:
+        # OffsetTimeOriginal（例: "+09:00"）があればタイムゾーン付きにする
+        try:
+            zone = datetime.datetime.strptime(offset.split(b"\0", 1)[0].decode("ascii"), "%z").tzinfo
+            return moment.replace(tzinfo=zone)
+        except ValueError:
+            pass
+    # 記録がなければカメラの時計は現地時刻とみなす
+    return moment.astimezone()
+
+class _TiffReader:
+    """メモリ上のTIFF構造からIFDのタグを読む（範囲外を指すオフセットは無視）"""
+
+    def __init__(self, data: bytes, base: int = 0):
+        self.data = data
+        self.base = base
+        self.endian = "<" if data[base:base + 2] == b"II" else ">"
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, self.base + offset)
+
+    def first_ifd(self) -> int:
+        return self._unpack("I", 4)[0]
+
+    def read_ifd(self, offset: int) -> dict:
+        """タグ番号 → (型, 個数, 値またはオフセットの4バイト) を返す"""
+        tags = {}
+        try:
+            (count,) = self._unpack("H", offset)
+            for i in range(count):
+                tag, kind, n = self._unpack("HHI", offset + 2 + i * 12)
+                raw = self.data[self.base + offset + 10 + i * 12:self.base + offset + 14 + i * 12]
+                tags[tag] = (kind, n, raw)
+        except struct.error:
+            pass
+        return tags
+
+    def ascii_value(self, entry):
+        kind, n, raw = entry
+        if kind != 2:
+            return None
+        if n <= 4:
+            return raw[:n]
+        (offset,) = struct.unpack(self.endian + "I", raw)
+        start = self.base + offset
+        if start + n > len(self.data):
+            return None
+        return self.data[start:start + n]
+
+    def long_value(self, entry):
+        kind, _, raw = entry
+        if kind in (4, 13):
+            return struct.unpack(self.endian + "I", raw)[0]
+        return None
+
+def _tiff_datetime(data: bytes, base: int = 0):
+    reader = _TiffReader(data, base)
+    try:
+        ifd0 = reader.read_ifd(reader.first_ifd())
+    except struct.error:
+        return None
+    exif_offset = reader.long_value(ifd0[TAG_EXIF_IFD]) if TAG_EXIF_IFD in ifd0 else None
+    if exif_offset:
+        exif = reader.read_ifd(exif_offset)
+        if TAG_DATETIME_ORIGINAL in exif:
+            value = reader.ascii_value(exif[TAG_DATETIME_ORIGINAL])
+            offset = reader.ascii_value(exif[TAG_OFFSET_TIME_ORIGINAL]) if TAG_OFFSET_TIME_ORIGINAL in exif else None
+            moment = value and _parse_exif_datetime(value, offset)
+            if moment:
+                return moment
+    if TAG_DATETIME in ifd0:
+        value = reader.ascii_value(ifd0[TAG_DATETIME])
+        return value and _parse_exif_datetime(value)
+    return None
+
+def _jpeg_datetime(data: bytes):
+    """JPEGのセグメントをたどってAPP1(Exif)だけを読む"""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker in (0xD9, 0xDA):
+            # 画像データ以降にExifはない
+            return None
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b"Exif\0\0":
+            return _tiff_datetime(data, pos + 10)
+        pos += 2 + length
+    return None
+
+def parse_capture_time(data: bytes):
+    """ファイル先頭のバイト列から撮影日時（タイムゾーン付き）を読む。見つからなければ None"""
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_datetime(data)
+    if data[:4] in _TIFF_MAGICS:
+        return _tiff_datetime(data)
+    return None
+
+def read_capture_time(path, fallback_to_mtime: bool = True):
+    """Exif/RAWヘッダーの撮影日時、なければ更新日時を返す"""
+    try:
+        with open(path, "rb") as f:
+            moment = parse_capture_time(f.read(HEADER_READ_SIZE))
+    except (OSError, ValueError, IndexError, struct.error):
+        moment = None
+    if moment is None and fallback_to_mtime:
+        try:
+            moment = datetime.datetime.fromtimestamp(os.path.getmtime(path)).astimezone()
+        except OSError:
+            return None
+    return moment
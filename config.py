@@ -1,6 +1,9 @@
+import copy
 import json
 import os
 import sys
+import threading
+import time
 from pathlib import Path
 
 def get_base_dir() -> Path:
@@ -10,21 +13,89 @@ def get_base_dir() -> Path:
 
 BASE_DIR = get_base_dir()
 RUNTIME_DIR = BASE_DIR / "runtime"
-RUNTIME_DIR.mkdir(exist_ok=True)
 
 def get_resource_path(filename: str) -> Path:
     return RUNTIME_DIR / filename
 
+def make_hidden(path: Path):
+    """Windowsで指定フォルダを隠し属性にする"""
+    if os.name == "nt" and path.exists():
+        import ctypes
+        FILE_ATTRIBUTE_HIDDEN = 0x02
+        try:
+            ctypes.windll.kernel32.SetFileAttributesW(str(path), FILE_ATTRIBUTE_HIDDEN)
+        except Exception as e:
+            print(f"⚠ 隠し属性の付与に失敗しました: {e}")
+
 # 各種パス定数
 TOKEN_PATH = BASE_DIR / ".filemoverapp" / "token.pickle"
+EVENT_STORE_PATH = BASE_DIR / ".filemoverapp" / "events.sqlite3"
+CLIENT_CONFIG_CACHE_PATH = BASE_DIR / ".filemoverapp" / "client_config.enc"
+# Windows では DPAPI で保護したキャッシュの鍵（平文では置かない）
+LOCAL_KEY_PATH = BASE_DIR / ".filemoverapp" / "local.key"
+JOURNAL_DIR = BASE_DIR / ".filemoverapp" / "journals"
+SOURCE_LEDGER_PATH = BASE_DIR / ".filemoverapp" / "source_ledger.sqlite3"
+JOB_QUEUE_PATH = BASE_DIR / ".filemoverapp" / "jobs.json"
+# 復号済みクライアント設定のキャッシュ有効期間（秒）
+CLIENT_CONFIG_TTL = 7 * 24 * 60 * 60
+# トークン期限の何秒前にバックグラウンドで更新するか
+TOKEN_REFRESH_MARGIN = 5 * 60
 # TOKEN_PATH = get_resource_path("token.pickle")
 CREDENTIAL_ENC_PATH = get_resource_path("credentials.enc")
 # AUTH_COMPLETE_HTML_PATH = get_resource_path("auth_complete.html")
+# 設定はすべて SETTINGS_FILE にまとめて保存する（下の5つは以前の形式で、初回に読み込んで移行する）
+SETTINGS_FILE = get_resource_path("config_settings.json")
+# ほかのプロセスによる設定ファイルの書き換えを確かめる間隔（秒）
+CONFIG_REVALIDATE_INTERVAL = 1.0
 KEYWORDS_FILE = get_resource_path("config_keywords.json")
 BASE_CONFIG_FILE = get_resource_path("config_local.json")
 EVENT_FORMAT_FILE = get_resource_path("config_event_format.json")
+WATCH_CONFIG_FILE = get_resource_path("config_watch.json")
+DESTINATIONS_FILE = get_resource_path("config_destinations.json")
 DEFAULT_EVENT_FORMAT = "{date}_{event}"
 
+# 複数カレンダー取得時の同時接続数
+CALENDAR_FETCH_WORKERS = 4
+# Calendar API の1リクエストのタイムアウト（秒）
+CALENDAR_HTTP_TIMEOUT = 60
+
+# ファイル転送の並列数
+TRANSFER_WORKERS = 4
+# 保存済みと同じ内容のファイルの扱い（"skip": スキップ / "hardlink": ハードリンクを作成）
+DEDUPE_MODE = "skip"
+# コピー時の検証（None: なし / "hash": カーネル内コピーしながら元ファイルのハッシュ + サイズ照合 / "readback": 書き込み先も読み戻して照合）
+VERIFY_MODE = "hash"
+
+# ジョブキュー: ドライブの種類ごとに同時に読み書きするファイル数（HDDはシークで遅くなるので1本）
+DEVICE_STREAMS = {"hdd": 1, "ssd": 4, "network": 2, "unknown": 2}
+# 完了したジョブを一覧に残す件数
+JOB_HISTORY_LIMIT = 50
+
+# アーカイブ内のアーカイブを何階層までたどるか
+NESTED_ARCHIVE_DEPTH = 3
+# 入れ子のアーカイブはこのサイズまでメモリに置き、超えた分は保存先の一時ファイルへ逃がす
+NESTED_SPOOL_MEMORY = 64 * 1024 * 1024
+
+# 計測: この環境変数に出力先（.jsonl または Chrome trace の .json）を入れると区間の記録を有効にする
+TRACE_ENV = "FILEMOVER_TRACE"
+# 記録しておく区間の上限（超えた分は段階ごとの集計にだけ反映する）
+TRACE_MAX_SPANS = 200000
+
+# 監視フォルダ: サイズと更新日時がこの秒数変わらなければ書き込み完了とみなす
+WATCH_STABLE_SECONDS = 3
+# 新しいファイルがこの秒数届かなければ、それまでの分を1バッチとして取り込む
+WATCH_QUIET_SECONDS = 10
+# 1バッチの上限（件数・最初のファイルからの秒数）
+WATCH_MAX_BATCH = 5000
+WATCH_MAX_BATCH_AGE = 5 * 60
+# inotify が使えない環境での走査間隔（秒）
+WATCH_POLL_INTERVAL = 5
+# 撮影日時で振り分けるときのヘッダー読み込みの並列数と、予定の前後に含める余裕（秒）
+ROUTE_WORKERS = 8
+ROUTE_MARGIN_SECONDS = 30 * 60
+# 自動でイベントを決めるとき、何日前までに始まった予定を候補にするか
+WATCH_EVENT_LOOKBACK_DAYS = 7
+
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
 
 BASE_ROOT_DEFAULT = str(Path.home() / "Pictures")
@@ -38,46 +109,203 @@ SUPPORTED_IMAGE_EXTENSIONS = [
     ".cr2", ".nef", ".arw", ".dng", ".rw2", ".orf", ".heic"
 ]
 
+# === 設定ファイル ===
+def write_json_atomic(path, data):
+    """一時ファイルに書いて fsync してから置き換える（書き込み中に落ちても前の内容が残る）"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if temp.exists():
+            temp.unlink()
+        raise
+    if os.name != "nt":
+        # 置き換えたこと自体もディスクに残す
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _copy(value):
+    # 呼び出し側がリストを書き換えてもキャッシュに影響しないようにする
+    return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+_MISSING = object()
+
+class ConfigStore:
+    """設定を1つの JSON にまとめて読み込み、キャッシュしておく
+
+    ファイルの更新日時とサイズは revalidate_interval 秒に1回だけ確かめるので、頻繁な get はほぼ無料。
+    ほかのプロセスが書き換えた場合も次の確認で読み直し、値が変わったキーを購読者に通知する。
+    購読者は変更を起こしたスレッド（保存した側、または読み直した側）から呼ばれる。
+    """
+
+    def __init__(self, path, legacy_files=None, revalidate_interval: float = CONFIG_REVALIDATE_INTERVAL):
+        self.path = Path(path)
+        # キー → (旧形式のファイル, その中のキー。None なら中身全体)
+        self.legacy_files = legacy_files or {}
+        self.revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        self._data = {}
+        self._stamp = None
+        self._loaded = False
+        self._checked = 0.0
+        self._subscribers = []
+
+    # === 読み込み ===
+    def get(self, key: str, default=None):
+        self.revalidate()
+        return _copy(self._data.get(key, default))
+
+    def revalidate(self, force: bool = False):
+        """ファイルが変わっていれば読み直す（force=False なら間隔内の呼び出しは何もしない）"""
+        if not force and self._loaded and time.monotonic() - self._checked < self.revalidate_interval:
+            return
+        with self._lock:
+            changed = self._revalidate_locked()
+        if changed:
+            self._notify(changed)
+
+    def _revalidate_locked(self) -> set:
+        self._checked = time.monotonic()
+        stamp = _file_stamp(self.path)
+        if self._loaded and stamp == self._stamp:
+            return set()
+        if stamp is None:
+            data = self._migrate()
+            stamp = _file_stamp(self.path)
+        else:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("設定がオブジェクトではありません")
+            except (OSError, ValueError) as e:
+                # 壊れていても直前に読めた値を使い続ける（次の保存で書き直される）
+                print(f"⚠ 設定ファイルを読み込めませんでした: {e}")
+                data = self._data
+        old, loaded = self._data, self._loaded
+        self._data, self._stamp, self._loaded = data, stamp, True
+        if not loaded:
+            # 最初の読み込みは変更として通知しない
+            return set()
+        return {key for key in old.keys() | data.keys() if old.get(key, _MISSING) != data.get(key, _MISSING)}
+
+    def _migrate(self) -> dict:
+        """旧形式の設定ファイル（1項目1ファイル）から値を集めて、新しいファイルに書き出す"""
+        data = {}
+        for key, (legacy_path, field) in self.legacy_files.items():
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+                data[key] = legacy if field is None else legacy[field]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        if data:
+            write_json_atomic(self.path, data)
+        return data
+
+    # === 書き込み ===
+    def set(self, key: str, value):
+        self.update({key: value})
+
+    def update(self, values: dict):
+        """値をまとめて書き換えて保存し、実際に変わったキーを購読者に通知する"""
+        with self._lock:
+            changed = self._revalidate_locked()
+            data = dict(self._data)
+            for key, value in values.items():
+                value = _copy(value)
+                if data.get(key, _MISSING) != value:
+                    changed.add(key)
+                data[key] = value
+            write_json_atomic(self.path, data)
+            self._data, self._stamp = data, _file_stamp(self.path)
+        if changed:
+            self._notify(changed)
+
+    # === 購読 ===
+    def subscribe(self, callback, *keys):
+        """callback(変わったキーの集合) を登録する（keys を省略するとすべてのキー）。解除する関数を返す"""
+        entry = (callback, frozenset(keys) or None)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def _notify(self, changed: set):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, keys in subscribers:
+            if keys is None or keys & changed:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"⚠ 設定変更の通知に失敗しました: {e}")
+
+# 設定のキー
+BASE_ROOT_KEY = "BASE_ROOT"
+KEYWORDS_KEY = "KEYWORDS"
+EVENT_FORMAT_KEY = "EVENT_FORMAT"
+WATCH_KEY = "WATCH"
+BACKUP_ROOTS_KEY = "BACKUP_ROOTS"
+
+settings = ConfigStore(SETTINGS_FILE, {
+    BASE_ROOT_KEY: (BASE_CONFIG_FILE, "BASE_ROOT"),
+    KEYWORDS_KEY: (KEYWORDS_FILE, "KEYWORDS"),
+    EVENT_FORMAT_KEY: (EVENT_FORMAT_FILE, "format"),
+    WATCH_KEY: (WATCH_CONFIG_FILE, None),
+    BACKUP_ROOTS_KEY: (DESTINATIONS_FILE, "BACKUP_ROOTS"),
+})
+
 def save_base_root(path):
-    with open(BASE_CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump({"BASE_ROOT": path}, f, indent=2, ensure_ascii=False)
+    settings.set(BASE_ROOT_KEY, path)
 
 def load_base_root():
-    if os.path.exists(BASE_CONFIG_FILE):
-        try:
-            with open(BASE_CONFIG_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("BASE_ROOT", BASE_ROOT_DEFAULT)
-        except Exception:
-            return BASE_ROOT_DEFAULT
-    return BASE_ROOT_DEFAULT
+    return settings.get(BASE_ROOT_KEY, BASE_ROOT_DEFAULT)
 
 def save_keywords(keywords):
-    with open(KEYWORDS_FILE, "w", encoding="utf-8") as f:
-        json.dump({"KEYWORDS": keywords}, f, indent=2, ensure_ascii=False)
+    settings.set(KEYWORDS_KEY, list(keywords))
 
 def load_keywords():
-    if os.path.exists(KEYWORDS_FILE):
-        try:
-            with open(KEYWORDS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("KEYWORDS", DEFAULT_KEYWORDS)
-        except Exception:
-            return DEFAULT_KEYWORDS
-    return DEFAULT_KEYWORDS
-
-KEYWORDS = load_keywords()
+    return settings.get(KEYWORDS_KEY, DEFAULT_KEYWORDS)
 
 def save_event_format(format_str):
-    with open(EVENT_FORMAT_FILE, "w", encoding="utf-8") as f:
-        json.dump({"format": format_str}, f, indent=2, ensure_ascii=False)
+    settings.set(EVENT_FORMAT_KEY, format_str)
 
 def load_event_format():
-    if os.path.exists(EVENT_FORMAT_FILE):
-        try:
-            with open(EVENT_FORMAT_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("format", DEFAULT_EVENT_FORMAT)
-        except Exception:
-            return DEFAULT_EVENT_FORMAT
-    return DEFAULT_EVENT_FORMAT
\ No newline at end of file
+    return settings.get(EVENT_FORMAT_KEY, DEFAULT_EVENT_FORMAT)
+
+def save_watch_config(folders, default_event="", subfolder=""):
+    settings.set(WATCH_KEY, {"FOLDERS": list(folders), "DEFAULT_EVENT": default_event, "SUBFOLDER": subfolder})
+
+def load_watch_config() -> dict:
+    """監視フォルダの設定（FOLDERS / DEFAULT_EVENT / SUBFOLDER）"""
+    config = {"FOLDERS": [], "DEFAULT_EVENT": "", "SUBFOLDER": ""}
+    config.update(settings.get(WATCH_KEY) or {})
+    return config
+
+def save_backup_roots(roots):
+    settings.set(BACKUP_ROOTS_KEY, list(roots))
+
+def load_backup_roots() -> list:
+    """保存先の親フォルダと同じ構成で同時に書き込むバックアップ先の親フォルダ"""
+    return list(settings.get(BACKUP_ROOTS_KEY) or [])
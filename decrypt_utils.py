@@ -1,27 +1,191 @@
 import json
-import base64
-import boto3
-from cryptography.fernet import Fernet
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from auth_secrets import S3_BUCKET_NAME, CREDENTIALS_OBJECT_KEY, KEY_OBJECT_KEY
+from config import CLIENT_CONFIG_CACHE_PATH, CLIENT_CONFIG_TTL, LOCAL_KEY_PATH, make_hidden
 
-def fetch_from_s3(object_key: str) -> bytes:
+# boto3 / cryptography は読み込みに時間がかかるので、使うときに初めて import する
+# （起動時には読み込まず、画面表示後に ingest.preload_calendar_session() が裏で読み込む）
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """S3クライアントは生成コストが高いので1つを使い回す（環境変数でローカルのS3互換サーバーも指定可）"""
+    import boto3
+
+    return boto3.client(
+        "s3",
+        region_name="ap-northeast-1",
+        endpoint_url=os.environ.get("FILEMOVER_S3_ENDPOINT") or None,
+    )
+
+def fetch_from_s3(object_key: str, s3=None) -> bytes:
     """S3からファイルを読み込んでバイナリで返す"""
-    s3 = boto3.client("s3", region_name="ap-northeast-1")
+    s3 = s3 or get_s3_client()
     response = s3.get_object(Bucket=S3_BUCKET_NAME, Key=object_key)
     return response["Body"].read()
 
-def decrypt_credentials() -> dict:
+def decrypt_credentials(s3=None) -> dict:
     """S3から暗号ファイルと鍵を取得して復号した認証情報を返す"""
+    from cryptography.fernet import Fernet
 
-    # S3から暗号データと鍵を取得
-    encrypted_data = fetch_from_s3(CREDENTIALS_OBJECT_KEY)
-    print("データ取れた")
+    # S3から暗号データと鍵を並行して取得
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        data_future = pool.submit(fetch_from_s3, CREDENTIALS_OBJECT_KEY, s3)
+        key_future = pool.submit(fetch_from_s3, KEY_OBJECT_KEY, s3)
+        encrypted_data = data_future.result()
+        b64_key_raw = key_future.result()  # ← bytes型
 
     # base64復号 → Fernet形式に変換
-    b64_key_raw = fetch_from_s3(KEY_OBJECT_KEY)  # ← bytes型
     b64_key_str = b64_key_raw.decode("utf-8").strip()  # ← 文字列に変換して改行除去
     fernet = Fernet(b64_key_str)
 
     # 復号とJSON変換
     decrypted_data = fernet.decrypt(encrypted_data)
-    return json.loads(decrypted_data.decode("utf-8"))
\ No newline at end of file
+    return json.loads(decrypted_data.decode("utf-8"))
+
+# === 復号済みクライアント設定のローカルキャッシュ ===
+# キャッシュの鍵は平文でディスクに置かない（Windows は DPAPI、それ以外は keyring で OS の資格情報ストアに置く）
+KEYRING_SERVICE = "FileMoverApp"
+KEYRING_USERNAME = "client-config-key"
+
+def _dpapi(data: bytes, protect: bool) -> bytes:
+    """Windows の DPAPI でログオン中のユーザーに紐づけて暗号化・復号する"""
+    import ctypes
+    from ctypes import wintypes
+
+    class DATA_BLOB(ctypes.Structure):
+        _fields_ = [("cbData", wintypes.DWORD), ("pbData", ctypes.POINTER(ctypes.c_char))]
+
+    CRYPTPROTECT_UI_FORBIDDEN = 0x01
+    buffer = ctypes.create_string_buffer(data, len(data))
+    blob_in = DATA_BLOB(len(data), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+    blob_out = DATA_BLOB()
+    crypt32 = ctypes.windll.crypt32
+    function = crypt32.CryptProtectData if protect else crypt32.CryptUnprotectData
+    if not function(ctypes.byref(blob_in), None, None, None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out)):
+        raise ctypes.WinError()
+    try:
+        return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(blob_out.pbData)
+
+class DpapiKeyStore:
+    """DPAPI で保護した鍵を LOCAL_KEY_PATH に置く（他のユーザー・他の端末では復号できない）"""
+
+    def load(self):
+        try:
+            return _dpapi(LOCAL_KEY_PATH.read_bytes(), protect=False)
+        except OSError:
+            # 無い、または以前の平文の鍵（作り直すとキャッシュは読めなくなり、S3から取り直す）
+            return None
+
+    def save(self, key: bytes):
+        LOCAL_KEY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        make_hidden(LOCAL_KEY_PATH.parent)
+        tmp_path = LOCAL_KEY_PATH.with_suffix(".tmp")
+        tmp_path.write_bytes(_dpapi(key, protect=True))
+        os.replace(tmp_path, LOCAL_KEY_PATH)
+
+class KeyringKeyStore:
+    """keyring（macOS のキーチェーン、Linux の Secret Service など）に鍵を置く"""
+
+    def __init__(self, keyring):
+        self._keyring = keyring
+
+    def load(self):
+        key = self._keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME)
+        return key.encode("ascii") if key else None
+
+    def save(self, key: bytes):
+        self._keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, key.decode("ascii"))
+
+@lru_cache(maxsize=1)
+def default_key_store():
+    """この端末で使える鍵の保存先（無ければ None で、ディスクにはキャッシュしない）"""
+    if sys.platform == "win32":
+        return DpapiKeyStore()
+    try:
+        import keyring
+
+        store = KeyringKeyStore(keyring)
+        store.load()
+    except Exception:
+        # keyring が無い、または使えるバックエンドが無い（NoKeyringError など）
+        store = None
+    # 以前のバージョンが平文で置いた鍵は消す
+    try:
+        LOCAL_KEY_PATH.unlink()
+    except OSError:
+        pass
+    return store
+
+def _local_fernet(key_store):
+    """鍵の保存先から鍵を読み出す（初回は生成して保存する）"""
+    from cryptography.fernet import Fernet
+
+    key = key_store.load()
+    if key is None:
+        key = Fernet.generate_key()
+        key_store.save(key)
+    return Fernet(key)
+
+def _read_cached_config(ttl: float, key_store):
+    try:
+        if time.time() - CLIENT_CONFIG_CACHE_PATH.stat().st_mtime > ttl:
+            return None
+    except OSError:
+        return None
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return json.loads(_local_fernet(key_store).decrypt(CLIENT_CONFIG_CACHE_PATH.read_bytes()))
+    except (OSError, ValueError, InvalidToken):
+        return None
+
+def _write_cached_config(config_dict: dict, key_store):
+    CLIENT_CONFIG_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CLIENT_CONFIG_CACHE_PATH.with_suffix(".tmp")
+    tmp_path.write_bytes(_local_fernet(key_store).encrypt(json.dumps(config_dict).encode("utf-8")))
+    os.replace(tmp_path, CLIENT_CONFIG_CACHE_PATH)
+
+_config_lock = threading.Lock()
+# 鍵の保存先が無い端末では、復号した設定はこのプロセスのメモリにだけ置く（取得時刻, 設定）
+_memory_config = None
+
+def get_client_config(ttl: float = CLIENT_CONFIG_TTL, s3=None, key_store=None) -> dict:
+    """有効期間内ならキャッシュ、期限切れならS3から取得して復号したクライアント設定を返す
+
+    ディスクのキャッシュは鍵の保存先（key_store、省略時は default_key_store()）があるときだけ使う。
+    """
+    global _memory_config
+    with _config_lock:
+        key_store = key_store or default_key_store()
+        if key_store is None:
+            try:
+                # 鍵を守れないので、以前のキャッシュも消してメモリだけに置く
+                CLIENT_CONFIG_CACHE_PATH.unlink()
+            except OSError:
+                pass
+            if _memory_config is None or time.time() - _memory_config[0] > ttl:
+                _memory_config = (time.time(), decrypt_credentials(s3))
+            return _memory_config[1]
+        config_dict = _read_cached_config(ttl, key_store)
+        if config_dict is None:
+            config_dict = decrypt_credentials(s3)
+            _write_cached_config(config_dict, key_store)
+        return config_dict
+
+def prefetch_client_config() -> threading.Thread:
+    """S3取得と復号をバックグラウンドで済ませておく（失敗しても認証時に再試行される）"""
+    def run():
+        try:
+            get_client_config()
+        except Exception:
+            pass
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config import make_hidden
+from fast_copy import new_digest
+
+INDEX_FILENAME = ".filemoverapp_index.sqlite3"
+# 既存のライブラリを走査して登録し終えたインデックスの user_version
+SEEDED_VERSION = 1
+HASH_BUFFER_SIZE = 1024 * 1024
+# 重複時の扱い
+SKIP = "skip"
+HARDLINK = "hardlink"
+
+def hash_stream(stream, buffer_size: int = HASH_BUFFER_SIZE) -> bytes:
+    """転送時の検証と同じアルゴリズムで内容のハッシュを計算する"""
+    digest = new_digest()
+    read = stream.read
+    while True:
+        chunk = read(buffer_size)
+        if not chunk:
+            return digest.digest()
+        digest.update(chunk)
+
+def hash_file(path) -> bytes:
+    with open(path, "rb") as f:
+        return hash_stream(f)
+
+def is_library_file(name: str) -> bool:
+    """ライブラリの写真として登録するファイルか（インデックス・マニフェスト・書き込み途中のファイルを除く）"""
+    if name.startswith(INDEX_FILENAME):
+        return False
+    if name.startswith("manifest_") and name.endswith(".jsonl"):
+        return False
+    return not (name.startswith(".") and name.endswith(".part"))
+
+class ContentIndex:
+    """保存先（base_root）ごとの「サイズ + ハッシュ → 保存済みパス」の永続インデックス
+
+    全件をメモリに載せず、サイズで絞り込んでから必要な分だけハッシュを照合する。
+    ハッシュは同じサイズの候補が現れたときに一度だけ計算して保存する。
+    初めて開いたときは既存のライブラリを走査して登録する（サイズと更新日時のみなので速い）。
+    """
+
+    def __init__(self, base_root, seed: bool = True):
+        self.base_root = os.path.abspath(base_root)
+        self.db_path = os.path.join(self.base_root, INDEX_FILENAME)
+        os.makedirs(self.base_root, exist_ok=True)
+        is_new = not os.path.exists(self.db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash BLOB
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_size_hash ON files (size, hash);
+        """)
+        self._conn.commit()
+        if is_new:
+            make_hidden(Path(self.db_path))
+        if seed and self._conn.execute("PRAGMA user_version").fetchone()[0] < SEEDED_VERSION:
+            # 取り込み前からあるファイルとも重複を判定できるようにする（途中で落ちたら次回やり直す）
+            self.rebuild()
+
+    def close(self):
+        self._conn.close()
+
+    def _relative(self, path) -> str:
+        return os.path.relpath(os.path.abspath(path), self.base_root)
+
+    def _absolute(self, relative) -> str:
+        return os.path.join(self.base_root, relative)
+
+    # === 更新 ===
+    def add(self, path, size: int = None, mtime_ns: int = None, digest: bytes = None):
+        """保存したファイルを登録（ハッシュ未計算なら None のまま）"""
+        if size is None or mtime_ns is None:
+            st = os.stat(path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                               (self._relative(path), size, mtime_ns, digest))
+
+    def add_many(self, rows):
+        """(パス, サイズ, mtime_ns, ハッシュ) をまとめて登録"""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                   [(self._relative(p), s, m, h) for p, s, m, h in rows])
+
+    def remove(self, path):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self._relative(path),))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    # === 照合 ===
+    def find_duplicate(self, size: int, open_source):
+        """同じ内容の保存済みファイルを探して (パス または None, 計算したハッシュ または None) を返す
+
+        open_source() は取り込むファイルの読み取りストリームを返す関数。
+        同じサイズの候補がなければ中身は一切読まない。
+        先にハッシュを計算し、ハッシュが一致する行と未計算の行だけを照合するので、
+        同じサイズのファイルが大量にあっても1件ずつ stat しない。
+        計算したハッシュは取り込み後の登録に使い回せる。
+        """
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM files WHERE size = ? LIMIT 1", (size,)).fetchone()
+        if not exists:
+            return None, None
+
+        with open_source() as stream:
+            digest = hash_stream(stream)
+        with self._lock:
+            candidates = self._conn.execute(
+                "SELECT path, mtime_ns, hash FROM files WHERE size = ? AND (hash = ? OR hash IS NULL)",
+                (size, digest)).fetchall()
+        for relative, mtime_ns, stored in candidates:
+            path = self._absolute(relative)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # 削除済みのファイルはインデックスからも外す
+                self.remove(path)
+                continue
+            if st.st_size != size:
+                self.remove(path)
+                continue
+            if stored is None or st.st_mtime_ns != mtime_ns:
+                # 未計算・更新済みなら一度だけ計算して保存
+                stored = hash_file(path)
+                self.add(path, st.st_size, st.st_mtime_ns, stored)
+            if stored == digest:
+                return path, digest
+        return None, digest
+
+    def find_duplicate_file(self, src_path):
+        return self.find_duplicate(os.path.getsize(src_path), lambda: open(src_path, "rb"))
+
+    # === 再構築 ===
+    def rebuild(self, workers: int = 4, hash_files: bool = False, batch_size: int = 1000) -> int:
+        """既存のライブラリを並列に走査してインデックスを作り直し、登録した件数を返す
+
+        hash_files=False ならサイズと更新日時のみ登録し、ハッシュは照合時に計算する。
+        走査中は一時テーブルに貯め、最後に1トランザクションで置き換える（走査中も前の内容で照合できる）。
+        """
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS rebuild_files "
+                               "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash BLOB)")
+            self._conn.execute("DELETE FROM rebuild_files")
+            self._conn.commit()
+
+        def scan(directory):
+            """1フォルダ分のファイルと配下のフォルダを返す"""
+            files, subdirs = [], []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and is_library_file(entry.name):
+                            st = entry.stat()
+                            digest = hash_file(entry.path) if hash_files else None
+                            files.append((self._relative(entry.path), st.st_size, st.st_mtime_ns, digest))
+            except OSError:
+                pass
+            return files, subdirs
+
+        def stage(rows):
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO rebuild_files VALUES (?, ?, ?, ?)", rows)
+
+        total = 0
+        pending_rows = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [pool.submit(scan, self.base_root)]
+            while futures:
+                files, subdirs = futures.pop().result()
+                futures.extend(pool.submit(scan, d) for d in subdirs)
+                pending_rows.extend(files)
+                if len(pending_rows) >= batch_size:
+                    stage(pending_rows)
+                    total += len(pending_rows)
+                    pending_rows = []
+        if pending_rows:
+            stage(pending_rows)
+            total += len(pending_rows)
+        with self._lock, self._conn:
+            # 計算済みのハッシュは、サイズと更新日時が変わっていなければ引き継ぐ
+            self._conn.execute("""
+                UPDATE rebuild_files SET hash = (
+                    SELECT files.hash FROM files WHERE files.path = rebuild_files.path
+                    AND files.size = rebuild_files.size AND files.mtime_ns = rebuild_files.mtime_ns)
+                WHERE hash IS NULL""")
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("INSERT INTO files SELECT * FROM rebuild_files")
+            self._conn.execute("DELETE FROM rebuild_files")
+            self._conn.execute(f"PRAGMA user_version = {SEEDED_VERSION}")
+        return total
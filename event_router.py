@@ -0,0 +1,90 @@
+import bisect
+import datetime
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from archive_reader import ArchiveError, is_archive, is_image, open_archive
+from capture_time import read_capture_time
+from config import ROUTE_MARGIN_SECONDS, ROUTE_WORKERS
+from event_store import event_timestamp
+from event_template import compile_event_format
+
+class EventIntervalIndex:
+    """予定の [開始, 終了) 区間を重ならない区切りに分け、時刻からイベント名を二分探索で引く
+
+    重なった予定は開始が遅い（より内側の）ものを優先する。区切りごとの勝者は作成時に決めておくので、
+    何日も続く予定があっても lookup は O(log n)。
+    margin 秒だけ前後に広げて、開始直前・終了直後の撮影も拾う。
+    """
+
+    def __init__(self, events, fmt: str, margin: float = ROUTE_MARGIN_SECONDS):
+        template = compile_event_format(fmt)
+        intervals = []
+        for event in events:
+            start = event_timestamp(event.get("start"))
+            end = event_timestamp(event.get("end") or event.get("start"))
+            intervals.append((start - margin, max(end, start) + margin, template.render(event)))
+        self._count = len(intervals)
+        # 区切りの開始時刻と、その区切りで勝つイベント名（どの予定にも入らない区切りは None）
+        self._bounds = []
+        self._names = []
+        # 開始順に入れ、区切りごとに「開始が最も遅い（同じなら後に渡された）」区間をヒープの先頭に置く
+        order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        points = sorted({point for start, end, _ in intervals for point in (start, end)})
+        active = []
+        next_event = 0
+        for point in points:
+            while next_event < len(order) and intervals[order[next_event]][0] <= point:
+                i = order[next_event]
+                heapq.heappush(active, (-intervals[i][0], -i))
+                next_event += 1
+            # 終わった区間は先頭に来たときだけ取り除けば十分
+            while active and intervals[-active[0][1]][1] <= point:
+                heapq.heappop(active)
+            name = intervals[-active[0][1]][2] if active else None
+            if self._names and self._names[-1] == name:
+                continue
+            self._bounds.append(point)
+            self._names.append(name)
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, moment):
+        """moment（datetime または UNIX時刻）を含む予定のイベント名。なければ None"""
+        t = moment.timestamp() if isinstance(moment, datetime.datetime) else moment
+        i = bisect.bisect_right(self._bounds, t) - 1
+        return self._names[i] if i >= 0 else None
+
+def archive_capture_time(path):
+    """アーカイブは最初の画像メンバーの日時を使う（zipは中央ディレクトリだけを読み、展開はしない）"""
+    try:
+        with open_archive(path) as reader:
+            for member in reader.members():
+                if is_image(member.name):
+                    return datetime.datetime(*member.date_time).astimezone()
+    except (OSError, ArchiveError, ValueError):
+        pass
+    return read_capture_time(path, fallback_to_mtime=True)
+
+def capture_time_of(path):
+    if is_archive(path):
+        return archive_capture_time(path)
+    return read_capture_time(path)
+
+def route_by_capture_time(paths, index: EventIntervalIndex, workers: int = ROUTE_WORKERS):
+    """撮影日時でファイルを振り分け、({イベント名: [パス, ...]}, 該当なしのパス) を返す
+
+    ヘッダーの読み込みは並列に行い、振り分けの順序は入力順を保つ。
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        moments = list(executor.map(capture_time_of, paths))
+    routes = {}
+    unmatched = []
+    for path, moment in zip(paths, moments):
+        name = index.lookup(moment) if moment is not None else None
+        if name is None:
+            unmatched.append(path)
+        else:
+            routes.setdefault(name, []).append(path)
+    return routes, unmatched
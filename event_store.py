@@ -0,0 +1,177 @@
+import datetime
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from calendar_fetch import iter_event_pages
+from config import EVENT_STORE_PATH
+
+# 初回同期で取得する期間（日数）
+FULL_SYNC_DAYS = 365
+
+def event_timestamp(value: dict) -> float:
+    """イベントの start / end をソート・範囲判定用のUNIX時刻に変換"""
+    if not value:
+        return 0.0
+    raw = value.get("dateTime") or value.get("date")
+    if not raw:
+        return 0.0
+    dt = datetime.datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        # 終日予定はローカル時刻の0時として扱う
+        dt = dt.astimezone()
+    return dt.timestamp()
+
+def _is_sync_token_expired(error: Exception) -> bool:
+    """syncToken が失効した場合は 410 Gone が返る"""
+    resp = getattr(error, "resp", None)
+    return getattr(resp, "status", None) in (410, "410")
+
+class EventStore:
+    """Googleカレンダーの予定をローカルのSQLiteに保持し、syncTokenで差分同期する"""
+
+    def __init__(self, db_path=EVENT_STORE_PATH):
+        self.db_path = Path(db_path)
+        if str(db_path) != ":memory:":
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                calendar_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                start_ts REAL NOT NULL,
+                end_ts REAL NOT NULL,
+                summary TEXT,
+                description TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (calendar_id, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_start ON events (start_ts);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                calendar_id TEXT PRIMARY KEY,
+                sync_token TEXT,
+                synced_at TEXT
+            );
+        """)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    # === 同期 ===
+    def get_sync_token(self, calendar_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendar_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def sync(self, service, calendar_id: str = "primary", page_size: int = 250, on_page=None) -> int:
+        """差分（初回は全件）を取得してストアに反映し、反映した件数を返す
+
+        on_page(calendar_id, items) を渡すとページを反映するたびに呼ばれる。
+        """
+        sync_token = self.get_sync_token(calendar_id)
+        if sync_token:
+            try:
+                return self._sync_pages(service, calendar_id, page_size, on_page, syncToken=sync_token)
+            except Exception as e:
+                if not _is_sync_token_expired(e):
+                    raise
+                # トークン失効時はローカルを破棄して全件同期し直す
+                self.reset(calendar_id)
+
+        time_min = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=FULL_SYNC_DAYS)
+        return self._sync_pages(
+            service, calendar_id, page_size, on_page,
+            timeMin=time_min.isoformat().replace("+00:00", "Z"),
+        )
+
+    def _sync_pages(self, service, calendar_id, page_size, on_page, **params) -> int:
+        changed = 0
+        sync_token = None
+        for page in iter_event_pages(service, calendar_id, maxResults=page_size, singleEvents=True, **params):
+            items = page.get("items", [])
+            changed += self.apply_events(calendar_id, items)
+            sync_token = page.get("nextSyncToken")
+            if on_page:
+                on_page(calendar_id, items)
+        # 全ページ取得し終えてからトークンを保存（途中失敗時は次回やり直し）
+        self._save_sync_token(calendar_id, sync_token)
+        return changed
+
+    def apply_events(self, calendar_id: str, items) -> int:
+        """追加・変更はupsert、キャンセル（削除）された予定はストアから除く"""
+        upserts = []
+        deletes = []
+        for event in items:
+            if event.get("status") == "cancelled":
+                deletes.append((calendar_id, event["id"]))
+                continue
+            upserts.append((
+                calendar_id,
+                event["id"],
+                event_timestamp(event.get("start")),
+                event_timestamp(event.get("end") or event.get("start")),
+                event.get("summary", ""),
+                event.get("description", ""),
+                json.dumps(event, ensure_ascii=False),
+            ))
+        with self._lock, self._conn:
+            if deletes:
+                self._conn.executemany(
+                    "DELETE FROM events WHERE calendar_id = ? AND event_id = ?", deletes)
+            if upserts:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+        return len(upserts) + len(deletes)
+
+    def _save_sync_token(self, calendar_id: str, sync_token):
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (calendar_id, sync_token, now))
+
+    def reset(self, calendar_id: str = None):
+        """ローカルの予定と同期状態を破棄（アカウント変更時など）"""
+        with self._lock, self._conn:
+            if calendar_id is None:
+                self._conn.execute("DELETE FROM events")
+                self._conn.execute("DELETE FROM sync_state")
+            else:
+                self._conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+                self._conn.execute("DELETE FROM sync_state WHERE calendar_id = ?", (calendar_id,))
+
+    # === 参照 ===
+    def _select(self, columns, time_min, time_max, calendar_ids):
+        query = f"SELECT {columns} FROM events WHERE start_ts >= ? AND start_ts <= ?"
+        params = [
+            time_min.timestamp() if time_min else float("-inf"),
+            time_max.timestamp() if time_max else float("inf"),
+        ]
+        if calendar_ids is not None:
+            calendar_ids = list(calendar_ids)
+            query += f" AND calendar_id IN ({', '.join('?' * len(calendar_ids))})"
+            params.extend(calendar_ids)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY start_ts", params).fetchall()
+
+    def iter_events(self, time_min: datetime.datetime = None, time_max: datetime.datetime = None,
+                    calendar_ids=None):
+        """開始日時順に予定を返す"""
+        for (data,) in self._select("data", time_min, time_max, calendar_ids):
+            yield json.loads(data)
+
+    def iter_matching_events(self, matcher, time_min: datetime.datetime = None,
+                             time_max: datetime.datetime = None, calendar_ids=None):
+        """キーワードにヒットした予定だけを開始日時順に返す（JSONの復元はヒット分のみ）"""
+        for summary, description, data in self._select("summary, description, data", time_min, time_max, calendar_ids):
+            if matcher.is_hit_event(summary, description):
+                yield json.loads(data)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
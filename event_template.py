@@ -0,0 +1,182 @@
+import datetime
+import re
+from functools import lru_cache
+from operator import attrgetter
+
+# ファイル名に使えない文字（Windows基準）と制御文字
+INVALID_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+DEFAULT_DATE_FORMAT = "%Y%m%d"
+
+# 日付系のフィールド → イベントのキー
+DATE_FIELDS = {"date": "start", "start": "start", "end": "end"}
+# 文字列系のフィールド → イベントのキー
+TEXT_FIELDS = {"event": "summary", "location": "location", "description": "description"}
+# いずれか1つは必須
+REQUIRED_FIELDS = ("event", "date")
+
+class TemplateError(ValueError):
+    """イベント名フォーマットの構文エラー"""
+
+_SANITIZE_TABLE = {code: "_" for code in [*range(0x20), *map(ord, '\\/:*?"<>|')]}
+# 出力に「:」「/」などを含みうる strftime 指定子
+_UNSAFE_DATE_DIRECTIVES = re.compile(r"%[cxXrRTD]")
+
+def sanitize_filename(text: str) -> str:
+    """フォルダ名に使えない文字を「_」に置換"""
+    return (text or "").translate(_SANITIZE_TABLE).strip()
+
+def parse_event_date(value: dict, is_end: bool = False):
+    """start / end から datetime を取得（終日予定の end は排他的なので前日にする）"""
+    if not value:
+        return None
+    raw = value.get("dateTime")
+    if raw:
+        if raw.endswith("Z"):
+            raw = raw[:-1] + "+00:00"
+        return datetime.datetime.fromisoformat(raw)
+    if value.get("date"):
+        dt = datetime.datetime.fromisoformat(value["date"])
+        return dt - datetime.timedelta(days=1) if is_end else dt
+    return None
+
+def parse_format(format_str: str) -> list:
+    """フォーマット文字列を (種別, 値, 書式) のセグメント列に分解する
+
+    種別は "literal" / "date" / "text"。{{ と }} はそれぞれ { と } のエスケープ。
+    """
+    segments = []
+    literal = []
+    i = 0
+    length = len(format_str)
+    while i < length:
+        ch = format_str[i]
+        if ch in "{}" and format_str[i:i + 2] in ("{{", "}}"):
+            literal.append(ch)
+            i += 2
+            continue
+        if ch == "}":
+            raise TemplateError("対応する { がない } があります")
+        if ch != "{":
+            literal.append(ch)
+            i += 1
+            continue
+
+        end = format_str.find("}", i + 1)
+        if end < 0:
+            raise TemplateError("} で閉じられていないプレースホルダがあります")
+        body = format_str[i + 1:end]
+        if "{" in body:
+            raise TemplateError("プレースホルダの中に { は使えません")
+        name, _, spec = body.partition(":")
+        if name in DATE_FIELDS:
+            kind = "date"
+            spec = spec or DEFAULT_DATE_FORMAT
+        elif name in TEXT_FIELDS:
+            if spec:
+                raise TemplateError(f"{{{name}}} には書式を指定できません")
+            kind = "text"
+        else:
+            raise TemplateError(f"未対応の変数です: {{{name}}}")
+
+        if literal:
+            segments.append(("literal", "".join(literal), None))
+            literal = []
+        segments.append((kind, name, spec or None))
+        i = end + 1
+    if literal:
+        segments.append(("literal", "".join(literal), None))
+    return segments
+
+# 高速化対象の strftime 指定子 → (%-書式, 取得関数)
+_FAST_DIRECTIVES = {
+    "Y": ("%04d", "year"),
+    "m": ("%02d", "month"),
+    "d": ("%02d", "day"),
+    "H": ("%02d", "hour"),
+    "M": ("%02d", "minute"),
+    "S": ("%02d", "second"),
+}
+_DIRECTIVE = re.compile(r"%(.)", re.DOTALL)
+
+def compile_strftime(spec: str):
+    """数値だけの strftime 書式は %-書式へ変換して高速化（それ以外は strftime のまま）"""
+    attrs = []
+    unsupported = False
+
+    def convert(match):
+        nonlocal unsupported
+        directive = match.group(1)
+        if directive == "%":
+            return "%%"
+        if directive not in _FAST_DIRECTIVES:
+            unsupported = True
+            return match.group(0)
+        fmt, attr = _FAST_DIRECTIVES[directive]
+        attrs.append(attr)
+        return fmt
+
+    percent_format = _DIRECTIVE.sub(convert, spec)
+    # 末尾に単独の % が残る書式も strftime に任せる
+    if unsupported or "%" in _DIRECTIVE.sub("", spec):
+        return lambda dt: dt.strftime(spec)
+    if not attrs:
+        return lambda dt: percent_format % ()
+    if len(attrs) == 1:
+        getter = attrgetter(attrs[0])
+        return lambda dt: percent_format % getter(dt)
+    getter = attrgetter(*attrs)
+    return lambda dt: percent_format % getter(dt)
+
+class EventTemplate:
+    """解析済みのイベント名フォーマット。render() はイベント1件につき join 1回で組み立てる"""
+
+    def __init__(self, format_str: str):
+        self.format_str = format_str
+        self.segments = parse_format(format_str)
+        self.fields = {name for kind, name, _ in self.segments if kind != "literal"}
+        if not any(name in self.fields for name in REQUIRED_FIELDS):
+            raise TemplateError("{event} または {date} が含まれていません")
+        for kind, value, _ in self.segments:
+            if kind == "literal" and INVALID_FILENAME_CHARS.search(value):
+                raise TemplateError("フォルダ名に使えない文字が含まれています")
+
+        self._needs_start = any(DATE_FIELDS.get(name) == "start" for name in self.fields)
+        self._needs_end = "end" in self.fields
+        # セグメントごとに (固定文字列, 取得関数) を用意しておく
+        self._parts = [self._compile_segment(*segment) for segment in self.segments]
+
+    @staticmethod
+    def _compile_segment(kind, value, spec):
+        if kind == "literal":
+            return value, None
+        if kind == "date":
+            is_end = DATE_FIELDS[value] == "end"
+            format_date = compile_strftime(spec)
+            # 書式自体に使えない文字が出ない場合はサニタイズを省く
+            if INVALID_FILENAME_CHARS.search(spec) or _UNSAFE_DATE_DIRECTIVES.search(spec):
+                def get_date(event, start, end):
+                    dt = end if is_end else start
+                    return sanitize_filename(format_date(dt)) if dt else ""
+            else:
+                def get_date(event, start, end):
+                    dt = end if is_end else start
+                    return format_date(dt) if dt else ""
+            return None, get_date
+        key = TEXT_FIELDS[value]
+        def get_text(event, start, end):
+            text = event.get(key) or ""
+            # 使えない文字がなければ置換を省く
+            if INVALID_FILENAME_CHARS.search(text):
+                text = text.translate(_SANITIZE_TABLE)
+            return text.strip()
+        return None, get_text
+
+    def render(self, event: dict) -> str:
+        start = parse_event_date(event.get("start")) if self._needs_start else None
+        end = parse_event_date(event.get("end"), is_end=True) if self._needs_end else None
+        return "".join([text if getter is None else getter(event, start, end) for text, getter in self._parts])
+
+@lru_cache(maxsize=8)
+def compile_event_format(format_str: str) -> EventTemplate:
+    """同じフォーマット文字列は一度だけ解析する"""
+    return EventTemplate(format_str)
@@ -0,0 +1,151 @@
+import os
+import queue
+import shutil
+import threading
+from fast_copy import VerificationError, file_digest, new_digest, tune_buffer_size
+from tracing import VERIFY, span
+
+# 複数の保存先へ同時に書き込む転送方式
+FAN_OUT = "fan_out"
+# 書き込み先ごとに先読みしておくチャンク数（遅い書き込み先に合わせて読み込みが待つ）
+QUEUE_DEPTH = 4
+
+class FanOutTarget:
+    """書き込み先1つ分。失敗しても他の書き込み先は続ける（error に例外が入る）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.written = 0
+        self.error = None
+        self._fd = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def open(self):
+        try:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        except OSError as e:
+            self.error = e
+
+    def write(self, chunk):
+        if self.error is not None:
+            return
+        try:
+            view = memoryview(chunk)
+            done = 0
+            while done < len(chunk):
+                done += os.write(self._fd, view[done:])
+            self.written += len(chunk)
+        except OSError as e:
+            # 容量不足などはこの書き込み先だけの失敗として扱う
+            self.error = e
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError as e:
+                self.error = self.error or e
+            self._fd = None
+
+def _threaded_fan_out(read, targets, buffer_size, on_progress, digest) -> int:
+    """書き込み先ごとのスレッドへチャンクを配る（書き込み中はGILが解放されるので並行に進む）"""
+    queues = [queue.Queue(maxsize=QUEUE_DEPTH) for _ in targets]
+
+    def writer(target, chunks):
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            # 失敗後も受け取りだけは続け、読み込み側を止めない
+            target.write(chunk)
+
+    threads = [threading.Thread(target=writer, args=(target, chunks), daemon=True)
+               for target, chunks in zip(targets, queues)]
+    for thread in threads:
+        thread.start()
+    total = 0
+    try:
+        while True:
+            chunk = read(buffer_size)
+            if not chunk:
+                break
+            if digest is not None:
+                digest.update(chunk)
+            for target, chunks in zip(targets, queues):
+                if target.ok:
+                    chunks.put(chunk)
+            total += len(chunk)
+            if on_progress:
+                on_progress(len(chunk))
+            if not any(target.ok for target in targets):
+                break
+    finally:
+        for chunks in queues:
+            chunks.put(None)
+        for thread in threads:
+            thread.join()
+    return total
+
+def fan_out_stream(read, targets, buffer_size: int, on_progress=None, digest=None, threaded: bool = True) -> int:
+    """read(バイト数) で一度だけ読んだ内容をすべての書き込み先へ書き、読んだバイト数を返す
+
+    on_progress(バイト数) は読み込み1チャンクごとに呼ばれる（例外を送出すると中断できる）。
+    threaded=False なら同じスレッドで順に書く（小さいファイルはスレッドを起こすほうが遅い）。
+    """
+    for target in targets:
+        target.open()
+    try:
+        if threaded and len(targets) > 1:
+            return _threaded_fan_out(read, targets, buffer_size, on_progress, digest)
+        total = 0
+        while True:
+            chunk = read(buffer_size)
+            if not chunk:
+                return total
+            if digest is not None:
+                digest.update(chunk)
+            for target in targets:
+                target.write(chunk)
+            total += len(chunk)
+            if on_progress:
+                on_progress(len(chunk))
+            if not any(target.ok for target in targets):
+                return total
+    finally:
+        for target in targets:
+            target.close()
+
+def fan_out_file(src, dest_paths, on_progress=None, buffer_size: int = None, readback: bool = False):
+    """元ファイルを一度だけ読んで複数の保存先へ書き込み、(ハッシュ, [FanOutTarget, ...]) を返す
+
+    保存先ごとにサイズを照合し（readback=True なら読み戻してハッシュも照合）、
+    失敗した保存先は target.error に理由が入る。元ファイルの読み込みに失敗した場合だけ例外を送出する。
+    """
+    expected_size = os.path.getsize(src)
+    buffer_size = buffer_size or tune_buffer_size(expected_size)
+    targets = [FanOutTarget(path) for path in dest_paths]
+    digest = new_digest()
+    with open(src, "rb", buffering=0) as f:
+        copied = fan_out_stream(f.read, targets, buffer_size, on_progress, digest,
+                                threaded=expected_size > buffer_size)
+    if copied != expected_size and any(target.ok for target in targets):
+        raise VerificationError(f"サイズが一致しません（元 {expected_size} / 読込 {copied} バイト）: {src}")
+    result = digest.digest()
+    for target in targets:
+        if not target.ok:
+            continue
+        try:
+            if os.path.getsize(target.path) != expected_size:
+                raise VerificationError(f"書き込み後のサイズが一致しません: {target.path}")
+            if readback:
+                with span(VERIFY, expected_size, file=target.path):
+                    matched = file_digest(target.path, buffer_size) == result
+                if not matched:
+                    raise VerificationError(f"書き込み後のハッシュが一致しません: {target.path}")
+            shutil.copystat(src, target.path)
+        except OSError as e:
+            target.error = e
+    return result, targets
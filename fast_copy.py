@@ -0,0 +1,326 @@
+import errno
+import hashlib
+import os
+import queue
+import shutil
+import sys
+import threading
+from tracing import VERIFY, span
+
+# 転送方式
+RENAME = "rename"
+REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+BUFFERED = "buffered"
+# 読み込みと同時にハッシュを計算するコピー
+HASHED = "hashed"
+
+# 検証方法
+VERIFY_HASH = "hash"          # コピー中にハッシュ計算 + サイズ照合
+VERIFY_READBACK = "readback"  # さらに書き込み先を読み戻してハッシュ照合
+
+# Linux の FICLONE ioctl（Btrfs / XFS などでブロックを共有するコピー）
+FICLONE = 0x40049409
+# カーネル内コピーを進捗通知・キャンセルのために区切る単位
+KERNEL_COPY_CHUNK = 8 * 1024 * 1024
+
+def tune_buffer_size(size: int) -> int:
+    """ファイルサイズに応じたバッファサイズ（小さいファイルは小さく、RAWや動画は大きく）"""
+    if size < 1024 * 1024:
+        return 64 * 1024
+    if size < 64 * 1024 * 1024:
+        return 1024 * 1024
+    return 8 * 1024 * 1024
+
+def same_device(src, dest_dir) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(dest_dir).st_dev
+    except OSError:
+        return False
+
+def choose_backend(src, dest_dir, move: bool = False) -> str:
+    """ファイルの組み合わせごとに最適な転送方式を選ぶ"""
+    same = same_device(src, dest_dir)
+    if move and same:
+        return RENAME
+    if sys.platform.startswith("linux"):
+        if same:
+            return REFLINK
+        if hasattr(os, "copy_file_range"):
+            return COPY_FILE_RANGE
+        return SENDFILE
+    return BUFFERED
+
+def _reflink(src_fd, dst_fd) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+def _kernel_copy(copy_func, src_fd, dst_fd, on_progress) -> bool:
+    """copy_file_range / sendfile でユーザー空間を通さずにコピーする（未対応ならFalse）"""
+    copied = 0
+    while True:
+        try:
+            sent = copy_func(src_fd, dst_fd, KERNEL_COPY_CHUNK)
+        except OSError as e:
+            # ファイルシステム非対応などの場合は通常コピーへ（途中までなら最初からやり直す）
+            if copied == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                           errno.ENOTSUP, errno.EBADF):
+                return False
+            raise
+        if sent == 0:
+            return True
+        copied += sent
+        if on_progress:
+            on_progress(sent)
+
+if hasattr(os, "readv"):
+    def _read_into(fd, buffer) -> int:
+        return os.readv(fd, [buffer])
+else:
+    def _read_into(fd, buffer) -> int:
+        data = os.read(fd, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _buffered_copy(src_fd, dst_fd, buffer_size, on_progress, digest=None) -> int:
+    """通常のコピー。digest を渡すと読んだバイト列をそのままハッシュにも流す"""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = _read_into(src_fd, buffer)
+        if not n:
+            return total
+        if digest is not None:
+            digest.update(view[:n])
+        written = 0
+        while written < n:
+            written += os.write(dst_fd, view[written:n])
+        total += n
+        if on_progress:
+            on_progress(n)
+
+def copy_file(src, dst, backend: str = None, on_progress=None, buffer_size: int = None) -> str:
+    """src を dst へコピーし、実際に使った方式を返す（dst は既存の空ファイルでもよい）"""
+    size = os.path.getsize(src)
+    backend = backend or choose_backend(src, os.path.dirname(dst) or ".")
+    buffer_size = buffer_size or tune_buffer_size(size)
+    src_fd = os.open(src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            used = None
+            if backend == REFLINK and _reflink(src_fd, dst_fd):
+                used = REFLINK
+                if on_progress:
+                    on_progress(size)
+            if used is None and backend in (REFLINK, COPY_FILE_RANGE) and hasattr(os, "copy_file_range"):
+                if _kernel_copy(os.copy_file_range, src_fd, dst_fd, on_progress):
+                    used = COPY_FILE_RANGE
+            if used is None and backend in (REFLINK, COPY_FILE_RANGE, SENDFILE) and hasattr(os, "sendfile"):
+                if _kernel_copy(lambda s, d, n: os.sendfile(d, s, None, n), src_fd, dst_fd, on_progress):
+                    used = SENDFILE
+            if used is None:
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+                _buffered_copy(src_fd, dst_fd, buffer_size, on_progress)
+                used = BUFFERED
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return used
+
+class VerificationError(OSError):
+    """コピー結果が元ファイルと一致しない"""
+
+# 転送・重複判定で共通のハッシュ。多くのCPUでハードウェア支援（SHA拡張命令）が効く SHA-256 を使う
+DIGEST_ALGORITHM = "sha256"
+# これより大きいファイルはハッシュ計算を別スレッドで読み書きと並行させる
+PIPELINED_HASH_THRESHOLD = 8 * 1024 * 1024
+
+def new_digest():
+    return hashlib.new(DIGEST_ALGORITHM)
+
+def file_digest(path, buffer_size: int = 1024 * 1024) -> bytes:
+    digest = new_digest()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                return digest.digest()
+            digest.update(chunk)
+
+def _pipelined_hashed_copy(src_fd, dst_fd, buffer_size, on_progress, digest) -> int:
+    """読み書きとハッシュ計算を並行させるコピー（hashlib は計算中にGILを解放する）"""
+    chunks = queue.Queue(maxsize=4)
+
+    def hash_worker():
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            digest.update(chunk)
+
+    worker = threading.Thread(target=hash_worker, daemon=True)
+    worker.start()
+    total = 0
+    try:
+        while True:
+            chunk = os.read(src_fd, buffer_size)
+            if not chunk:
+                break
+            chunks.put(chunk)
+            view = memoryview(chunk)
+            written = 0
+            while written < len(chunk):
+                written += os.write(dst_fd, view[written:])
+            total += len(chunk)
+            if on_progress:
+                on_progress(len(chunk))
+    finally:
+        chunks.put(None)
+        worker.join()
+    return total
+
+def copy_with_checksum(src, dst, on_progress=None, buffer_size: int = None, readback: bool = False) -> bytes:
+    """元ファイルを一度だけ読みながらコピーとハッシュ計算を行い、検証してハッシュを返す"""
+    expected_size = os.path.getsize(src)
+    buffer_size = buffer_size or tune_buffer_size(expected_size)
+    digest = new_digest()
+    src_fd = os.open(src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            if expected_size >= PIPELINED_HASH_THRESHOLD:
+                copied = _pipelined_hashed_copy(src_fd, dst_fd, buffer_size, on_progress, digest)
+            else:
+                copied = _buffered_copy(src_fd, dst_fd, buffer_size, on_progress, digest)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    result = digest.digest()
+
+    # カードリーダーの不調などで途中までしか読めていないものを検出
+    if copied != expected_size or os.path.getsize(dst) != expected_size:
+        raise VerificationError(f"サイズが一致しません（元 {expected_size} / 読込 {copied} バイト）: {src}")
+    if readback:
+        with span(VERIFY, expected_size, file=dst):
+            matched = file_digest(dst, buffer_size) == result
+        if not matched:
+            raise VerificationError(f"書き込み後のハッシュが一致しません: {dst}")
+    shutil.copystat(src, dst)
+    return result
+
+def _hash_ranges(fd, ranges, digest, buffer_size):
+    """カーネル内コピーが終わった範囲 (開始位置, 長さ) を元ファイルから読んでハッシュに流す
+
+    直前にコピーした範囲なのでページキャッシュに載っており、ドライブからは読み直さない。
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        item = ranges.get()
+        if item is None:
+            return
+        offset, length = item
+        end = offset + length
+        while offset < end:
+            n = os.preadv(fd, [view[:min(buffer_size, end - offset)]], offset)
+            if not n:
+                break
+            digest.update(view[:n])
+            offset += n
+
+def kernel_copy_with_checksum(src, dst, backend: str, on_progress=None, buffer_size: int = None):
+    """reflink / copy_file_range / sendfile でコピーしつつ、コピー済みの範囲を別スレッドでハッシュする
+
+    (使った方式, ハッシュ) を返す。カーネル内コピーが使えなければ None（呼び出し側で通常のハッシュ付きコピーへ）。
+    """
+    if not hasattr(os, "preadv"):
+        return None
+    expected_size = os.path.getsize(src)
+    buffer_size = buffer_size or tune_buffer_size(expected_size)
+    digest = new_digest()
+    ranges = queue.Queue(maxsize=8)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            hasher = threading.Thread(target=_hash_ranges, args=(src_fd, ranges, digest, buffer_size), daemon=True)
+            hasher.start()
+            offset = [0]
+
+            def copied(nbytes):
+                ranges.put((offset[0], nbytes))
+                offset[0] += nbytes
+                if on_progress:
+                    on_progress(nbytes)
+
+            used = None
+            try:
+                if backend == REFLINK and _reflink(src_fd, dst_fd):
+                    # ブロックを共有するだけなので読み込みはハッシュの分だけ
+                    used = REFLINK
+                    for start in range(0, expected_size, KERNEL_COPY_CHUNK):
+                        copied(min(KERNEL_COPY_CHUNK, expected_size - start))
+                if used is None and backend in (REFLINK, COPY_FILE_RANGE) and hasattr(os, "copy_file_range"):
+                    if _kernel_copy(os.copy_file_range, src_fd, dst_fd, copied):
+                        used = COPY_FILE_RANGE
+                if used is None and backend in (REFLINK, COPY_FILE_RANGE, SENDFILE) and hasattr(os, "sendfile"):
+                    if _kernel_copy(lambda s, d, n: os.sendfile(d, s, None, n), src_fd, dst_fd, copied):
+                        used = SENDFILE
+            finally:
+                ranges.put(None)
+                hasher.join()
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    if used is None:
+        return None
+    if offset[0] != expected_size or os.path.getsize(dst) != expected_size:
+        raise VerificationError(f"サイズが一致しません（元 {expected_size} / コピー {offset[0]} バイト）: {src}")
+    shutil.copystat(src, dst)
+    return used, digest.digest()
+
+def transfer_file(src, dst, move: bool = False, on_progress=None, buffer_size: int = None, verify: str = None):
+    """コピーまたは移動を行い、(使った方式, ハッシュ または None) を返す
+
+    移動モードでは同じドライブならリネームのみ。別ドライブならコピー → 検証 → 元ファイル削除。
+    verify（VERIFY_HASH / VERIFY_READBACK）を指定するとコピー中にハッシュを計算して検証する。
+    VERIFY_HASH ではカーネル内コピーを使い、コピー済みの範囲をページキャッシュから読んでハッシュする。
+    VERIFY_READBACK は読んだバイト列をそのまま書くため、常にユーザー空間を通すコピーになる。
+    """
+    backend = choose_backend(src, os.path.dirname(dst) or ".", move)
+    if backend == RENAME:
+        # 進捗通知（キャンセル判定）はリネーム前に済ませ、移動後に例外で巻き戻らないようにする
+        if on_progress:
+            on_progress(os.path.getsize(src))
+        os.replace(src, dst)
+        return RENAME, None
+
+    digest = None
+    result = None
+    if verify == VERIFY_HASH and backend in (REFLINK, COPY_FILE_RANGE, SENDFILE):
+        result = kernel_copy_with_checksum(src, dst, backend, on_progress, buffer_size)
+    if result is not None:
+        used, digest = result
+    elif verify:
+        digest = copy_with_checksum(src, dst, on_progress, buffer_size, readback=verify == VERIFY_READBACK)
+        used = HASHED
+    else:
+        used = copy_file(src, dst, backend, on_progress, buffer_size)
+    if move:
+        if not verify and os.path.getsize(src) != os.path.getsize(dst):
+            raise VerificationError(f"コピー後のサイズが一致しないため元ファイルを残しました: {src}")
+        os.remove(src)
+    return used, digest
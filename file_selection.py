@@ -0,0 +1,169 @@
+import os
+import queue
+import stat
+import threading
+from array import array
+
+# フォルダ走査の結果を画面スレッドへ渡す単位
+SCAN_BATCH = 1000
+
+def scan_directory(directory):
+    """フォルダ内のファイルを (パス, サイズ) で返す（サブフォルダも含め、隠しファイルは除く）
+
+    os.scandir の stat 結果を使うので、Windowsではファイルごとのシステムコールが要らない。
+    同じフォルダ内は名前順、サブフォルダはファイルの後に名前順でたどる。
+    """
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path, entry.stat().st_size
+            except OSError:
+                continue
+        # スタックなので逆順に積むと名前順に取り出せる
+        pending.extend(reversed(subdirectories))
+
+class FileSelection:
+    """選択中のファイルの順序付き集合（追加順を保ち、重複は O(1) で判定する）
+
+    サイズは array に詰めて持ち、10万件を超えても1件あたりの使用量を抑える。
+    ドロップされたフォルダは expand() で裏のスレッドが走査し、画面スレッドは drain() で
+    少しずつ取り込む（集合を変更するのは画面スレッドだけなのでロックは要らない）。
+    """
+
+    def __init__(self):
+        self._paths = []
+        self._sizes = array("q")
+        self._index = {}
+        self.total_bytes = 0
+        self._found = queue.Queue()
+        self._scanners = []
+        # 走査ごとの中止フラグ（clear() 後に始めた走査は新しいフラグを使う）
+        self._cancelled = threading.Event()
+
+    @staticmethod
+    def normalize(path) -> str:
+        return os.path.normpath(os.path.abspath(path))
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __contains__(self, path):
+        return self.normalize(path) in self._index
+
+    def paths(self) -> list:
+        return list(self._paths)
+
+    def line_of(self, path):
+        """一覧での行番号（1始まり）。含まれていなければ None"""
+        index = self._index.get(self.normalize(path))
+        return None if index is None else index + 1
+
+    def _append(self, path, size) -> bool:
+        if path in self._index:
+            return False
+        self._index[path] = len(self._paths)
+        self._paths.append(path)
+        self._sizes.append(size)
+        self.total_bytes += size
+        return True
+
+    def add(self, paths) -> list:
+        """ファイルを追加し、新しく加わったパスを返す（フォルダは裏で走査を始める）"""
+        added = []
+        directories = []
+        for path in paths:
+            path = self.normalize(path)
+            if path in self._index:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # 読めないファイルも一覧には載せ、実行時にエラーとして報告する
+                size = 0
+            else:
+                if stat.S_ISDIR(st.st_mode):
+                    directories.append(path)
+                    continue
+                size = st.st_size
+            if self._append(path, size):
+                added.append(path)
+        if directories:
+            self.expand(directories)
+        return added
+
+    def expand(self, directories):
+        cancelled = self._cancelled
+        thread = threading.Thread(target=self._scan, args=(list(directories), cancelled), daemon=True)
+        self._scanners.append((thread, cancelled))
+        thread.start()
+
+    def _scan(self, directories, cancelled):
+        batch = []
+        for directory in directories:
+            for entry in scan_directory(directory):
+                if cancelled.is_set():
+                    return
+                batch.append(entry)
+                if len(batch) >= SCAN_BATCH:
+                    self._found.put((cancelled, batch))
+                    batch = []
+        if batch:
+            self._found.put((cancelled, batch))
+
+    @property
+    def scanning(self) -> bool:
+        self._scanners = [
+            (thread, cancelled) for thread, cancelled in self._scanners
+            if thread.is_alive() and not cancelled.is_set()
+        ]
+        return bool(self._scanners) or not self._found.empty()
+
+    def drain(self, limit: int = 5000) -> list:
+        """走査済みの分を最大 limit 件程度取り込み、新しく加わったパスを返す（画面スレッドから呼ぶ）"""
+        added = []
+        while len(added) < limit:
+            try:
+                cancelled, batch = self._found.get_nowait()
+            except queue.Empty:
+                break
+            # clear() より前に始めた走査が中止を確かめる前に積んだ分は捨てる
+            if cancelled.is_set():
+                continue
+            # 正規化済みのフォルダから作ったパスなのでそのまま使う
+            for path, size in batch:
+                if self._append(path, size):
+                    added.append(path)
+        return added
+
+    def retain(self, keep):
+        """keep(パス) が True のものだけを残す"""
+        paths, sizes = self._paths, self._sizes
+        self._paths, self._sizes, self._index = [], array("q"), {}
+        self.total_bytes = 0
+        for path, size in zip(paths, sizes):
+            if keep(path):
+                self._append(path, size)
+
+    def clear(self):
+        self._cancelled.set()
+        self._cancelled = threading.Event()
+        while not self._found.empty():
+            self._found.get_nowait()
+        self._paths, self._sizes, self._index = [], array("q"), {}
+        self.total_bytes = 0
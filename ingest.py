@@ -0,0 +1,251 @@
+import datetime
+import os
+import threading
+from config import DEDUPE_MODE, TRANSFER_WORKERS, VERIFY_MODE, WATCH_EVENT_LOOKBACK_DAYS, load_event_format
+from calendar_fetch import list_calendar_ids, sync_calendars
+from dedupe_index import ContentIndex
+from event_store import EventStore, event_timestamp
+from event_template import compile_event_format
+from ingest_journal import IngestJournal
+from keyword_matcher import get_keyword_matcher
+from manifest import IngestManifest
+from source_ledger import SourceLedger
+from tracing import AUTH, EVENT_FETCH, KEYWORD_FILTER, span
+from transfer_engine import TransferEngine
+
+# 取り込みの中核処理（GUI・CLIの両方から使う）
+# customtkinter / tkinterdnd2 / boto3 / googleapiclient はここでは読み込まない
+# （Google連携は get_calendar_session() を呼んだとき、または preload_calendar_session() で裏で読み込む）
+
+class IngestError(Exception):
+    """取り込みの準備・実行に失敗した（メッセージはそのまま利用者に見せられる）"""
+
+class CalendarAuthError(IngestError):
+    """Google認証に失敗した、または権限が不足している"""
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_calendar_session():
+    """認証情報とCalendarサービスを使い回すセッション（初回呼び出し時に生成）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            from calendar_session import CalendarSession
+            _session = CalendarSession()
+        return _session
+
+def preload_calendar_session() -> threading.Thread:
+    """Google連携のライブラリと初回認証用のクライアント設定を裏のスレッドで読み込んでおく
+
+    画面を表示した後に呼ぶ。読み込み中に予定の取得が始まっても、import のロックで待ち合わせるだけで
+    二重には読み込まない。失敗しても実際に使うときにもう一度試してエラーを表示する。
+    """
+    def run():
+        try:
+            session = get_calendar_session()
+            session.prefetch()
+            session.preload()
+        except Exception:
+            pass
+    thread = threading.Thread(target=run, name="preload-calendar", daemon=True)
+    thread.start()
+    return thread
+
+# キーワードにヒットしているか判定
+def is_hit_keywords_event(title: str, description: str = "") -> bool:
+    return get_keyword_matcher().is_hit_event(title, description)
+
+# 予定をフォーマット済みのイベント名に変換
+def format_event_names(events, fmt: str) -> list:
+    template = compile_event_format(fmt)
+    names = []
+    seen = set()
+    for event in events:
+        formatted = template.render(event)
+        # 複数カレンダーに同じ予定がある場合は1件にまとめる
+        if formatted not in seen:
+            seen.add(formatted)
+            names.append(formatted)
+    return names
+
+def fetch_hit_event_names(max_results=250, all_calendars=False, on_progress=None, fmt=None, days=365) -> list:
+    """キーワードにヒットした直近の予定をイベント名にして開始日時順に返す
+
+    on_progress(names) を渡すと、取得途中のヒット一覧が届くたびに呼ばれる（ワーカースレッドから）。
+    認証に失敗した場合は CalendarAuthError を送出する。
+    """
+    session = get_calendar_session()
+    try:
+        with span(AUTH):
+            session.credentials()
+    except Exception as e:
+        raise CalendarAuthError(str(e)) from e
+
+    service = session.service()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    since = now - datetime.timedelta(days=days)
+    low, high = since.timestamp(), now.timestamp()
+    if all_calendars:
+        with span(EVENT_FETCH, calendar="calendarList"):
+            calendar_ids = list_calendar_ids(service)
+    else:
+        calendar_ids = ['primary']
+    matcher = get_keyword_matcher()
+    fmt = fmt or load_event_format()
+
+    # ローカルストアへ差分同期してから絞り込む
+    store = EventStore()
+    try:
+        found = {}
+        found_lock = threading.Lock()
+
+        def report():
+            snapshot = sorted(found.values(), key=lambda e: event_timestamp(e.get('start')))
+            on_progress(format_event_names(snapshot, fmt))
+
+        def on_page(calendar_id, items):
+            with found_lock:
+                for event in items:
+                    key = (calendar_id, event['id'])
+                    if event.get('status') == 'cancelled':
+                        found.pop(key, None)
+                    elif (matcher.is_hit_event(event.get('summary', ''), event.get('description', ''))
+                          and low <= event_timestamp(event.get('start')) <= high):
+                        found[key] = event
+                    else:
+                        found.pop(key, None)
+                report()
+
+        if on_progress:
+            # まずはキャッシュ済みの予定で即座に一覧を埋める
+            for calendar_id in calendar_ids:
+                for event in store.iter_matching_events(matcher, since, now, [calendar_id]):
+                    found[(calendar_id, event['id'])] = event
+            if found:
+                report()
+
+        sync_calendars(
+            store,
+            session.service,
+            calendar_ids,
+            page_size=max_results,
+            on_page=on_page if on_progress else None,
+        )
+        with span(KEYWORD_FILTER) as sp:
+            matched_events = list(store.iter_matching_events(matcher, since, now, calendar_ids))
+            names = format_event_names(matched_events, fmt)
+            sp.set(hits=len(names))
+    finally:
+        store.close()
+
+    return names
+
+def cached_event_name(at: datetime.datetime = None, fmt=None, lookback_days=WATCH_EVENT_LOOKBACK_DAYS):
+    """同期済みの予定（通信なし）から、at の時点で直近に始まったヒット予定のイベント名を返す
+
+    該当がなければ None。
+    """
+    at = at or datetime.datetime.now(datetime.timezone.utc)
+    store = EventStore()
+    try:
+        latest = None
+        for event in store.iter_matching_events(get_keyword_matcher(), at - datetime.timedelta(days=lookback_days), at):
+            latest = event
+    finally:
+        store.close()
+    if latest is None:
+        return None
+    return compile_event_format(fmt or load_event_format()).render(latest)
+
+def build_event_index(fmt=None, days=365):
+    """同期済みのヒット予定（通信なし）から撮影日時 → イベント名の索引を作る"""
+    from event_router import EventIntervalIndex
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    store = EventStore()
+    try:
+        events = list(store.iter_matching_events(get_keyword_matcher(), now - datetime.timedelta(days=days), now))
+    finally:
+        store.close()
+    return EventIntervalIndex(events, fmt or load_event_format())
+
+def resolve_dest_dir(base_root, event_name: str, subfolder: str = "") -> str:
+    """保存先フォルダ（親フォルダ/イベント名/サブフォルダ）を作成して返す"""
+    dest_dir = os.path.join(base_root, event_name, subfolder)
+    os.makedirs(dest_dir, exist_ok=True)
+    return dest_dir
+
+class IngestSession:
+    """保存先ごとの重複判定インデックスを使い回しながら取り込みジョブを起動する"""
+
+    def __init__(self):
+        self.content_index = None
+        self.ledger = None
+
+    def _ledger(self):
+        if self.ledger is None:
+            self.ledger = SourceLedger()
+        return self.ledger
+
+    def filter_ingested(self, paths):
+        """以前に取り込んだ元ファイル（stat が同じもの）を除き、(未取り込み, 取り込み済み) を返す"""
+        return self._ledger().partition(list(paths))
+
+    def _index_for(self, base_root):
+        if self.content_index is None or self.content_index.base_root != os.path.abspath(base_root):
+            if self.content_index is not None:
+                self.content_index.close()
+            self.content_index = ContentIndex(base_root)
+        return self.content_index
+
+    def reindex(self, base_root, workers: int = TRANSFER_WORKERS, hash_files: bool = False) -> int:
+        """保存先のライブラリを走査し直して重複判定インデックスを作り直し、登録した件数を返す"""
+        return self._index_for(base_root).rebuild(workers=workers, hash_files=hash_files)
+
+    def start(self, sources, dest_dir, base_root, move=False, dedupe=DEDUPE_MODE, verify=VERIFY_MODE,
+              workers=TRANSFER_WORKERS, journal=None, resume=None, planned=None,
+              use_ledger: bool = True, mirrors=()) -> TransferEngine:
+        """転送をバックグラウンドで開始してエンジンを返す（journal を省略すると新規に作成）
+
+        planned には planner.PlanGroup.planned_names() を渡すと計画どおりの名前で保存する。
+        use_ledger=True なら取り込んだ元ファイルを記録し、zipは以前に展開したメンバーを飛ばす。
+        mirrors（planner.PlanGroup.mirror_dirs）には同じ内容を同時に書き込むバックアップ先を渡す。
+        """
+        sources = list(sources)
+        mirrors = list(mirrors)
+        if journal is None:
+            journal = IngestJournal.create(dest_dir, sources, {"base_root": str(base_root), "move": move,
+                                                               "dedupe": dedupe, "verify": verify,
+                                                               "mirrors": mirrors})
+        engine = TransferEngine(
+            dest_dir,
+            workers=workers,
+            move=move,
+            content_index=self._index_for(base_root),
+            dedupe=dedupe,
+            verify=verify,
+            manifest=IngestManifest(dest_dir),
+            journal=journal,
+            resume=resume,
+            ledger=self._ledger() if use_ledger else None,
+            mirrors=mirrors,
+        )
+        engine.start(sources, planned)
+        return engine
+
+    def close(self):
+        if self.content_index is not None:
+            self.content_index.close()
+            self.content_index = None
+        if self.ledger is not None:
+            self.ledger.close()
+            self.ledger = None
+
+def finish_engine(engine: TransferEngine):
+    """転送後の記録を閉じる（すべて完了していればジャーナルは削除される）"""
+    engine.manifest.close()
+    if engine.ledger:
+        engine.ledger.flush()
+    if engine.journal:
+        engine.journal.close()
@@ -0,0 +1,341 @@
+"""画面なしで取り込みを実行するコマンドライン版
+
+使い方:
+    python -m ingest_cli 写真.zip DCIM/ --event 2024-05-01_運動会 --subfolder カメラA
+    python -m ingest_cli /mnt/card --auto-event --workers 8 --json > progress.jsonl
+    python -m ingest_cli /mnt/card --route --default-event 未分類
+    python -m ingest_cli /mnt/card --event 運動会 --backup /mnt/backup1 --backup /mnt/backup2
+
+--json を付けると進捗・結果を1行1件のJSONで標準出力へ書き出す。
+--dry-run で転送計画（保存先の名前・容量）だけを表示し、--plan-out で JSON に保存、
+--plan で保存した計画をそのまま実行する。
+--backup（省略時はアプリで設定したバックアップ先）には保存先と同時に書き込む親フォルダを指定する。
+元ファイルは一度だけ読み、バックアップ先の失敗は保存先の取り込みを止めない。
+--trace で段階ごと（認証・予定取得・キーワード判定・計画・展開・コピー・検証）の区間を記録し、
+.jsonl なら JSON Lines、それ以外は Chrome trace（chrome://tracing で開ける）で書き出す。
+終了コード: 0 成功 / 1 一部のファイルが失敗 / 2 引数の誤り / 3 イベント名を決められない /
+          4 空き容量が足りない / 130 中断
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from config import DEDUPE_MODE, TRANSFER_WORKERS, VERIFY_MODE, load_backup_roots, load_base_root
+from dedupe_index import HARDLINK, SKIP
+from event_template import TemplateError
+from fast_copy import VERIFY_HASH, VERIFY_READBACK
+from file_selection import scan_directory
+from event_router import route_by_capture_time
+from ingest import (
+    IngestError,
+    IngestSession,
+    build_event_index,
+    fetch_hit_event_names,
+    finish_engine,)
+from planner import Plan, build_plan
+from tracing import enable as enable_tracing, tracer
+from transfer_engine import CANCELLED, DONE, FAILED, SKIPPED
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NO_EVENT = 3
+EXIT_NO_SPACE = 4
+EXIT_INTERRUPTED = 130
+
+def expand_sources(paths) -> list:
+    """フォルダが渡された場合は中のファイルをすべて（サブフォルダも含めて）対象にする"""
+    files = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(found for found, _ in scan_directory(path))
+        else:
+            files.append(path)
+    result = []
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            result.append(path)
+    return result
+
+class Reporter:
+    """進捗の出力先（--json なら JSON Lines、それ以外は人が読む形式）"""
+
+    def __init__(self, as_json: bool, stream=None):
+        self.as_json = as_json
+        self.stream = stream or sys.stdout
+
+    def emit(self, kind: str, **fields):
+        if self.as_json:
+            fields = {"type": kind, "time": round(time.time(), 3), **fields}
+            self.stream.write(json.dumps(fields, ensure_ascii=False) + "\n")
+        else:
+            self.stream.write(self._format(kind, fields) + "\n")
+        self.stream.flush()
+
+    @staticmethod
+    def _format(kind, fields) -> str:
+        if kind == "start":
+            return f"{fields['files']} 件を「{fields['dest_dir']}」へ取り込みます"
+        if kind == "file":
+            return f"[{fields['state']}] {fields['source']} {fields['message']}".rstrip()
+        if kind == "progress":
+            line = (f"{fields['done_files']}/{fields['total_files']} 件  "
+                    f"{fields['throughput'] / 1024 / 1024:.1f} MB/s")
+            for mirror in fields.get("mirrors", []):
+                line += f"  [{mirror['path']}: {mirror['bytes'] / 1024 / 1024:.1f} MB"
+                line += f" 失敗 {mirror['failed']}]" if mirror["failed"] else "]"
+            return line
+        if kind == "mirror_error":
+            return f"バックアップ先に書き込めませんでした: {fields['path']}: {fields['message']}"
+        if kind == "ledger_error":
+            return f"取り込み済みとして記録できませんでした（次回も取り込み対象になります）: {fields['path']}: {fields['message']}"
+        if kind == "index_error":
+            return f"重複判定のインデックスに登録できませんでした（次回このファイルとの重複を判定できません）: {fields['path']}: {fields['message']}"
+        if kind == "ingested":
+            return f"以前に取り込んだ {fields['files']} 件はスキップします"
+        if kind == "plan":
+            return (f"計画: {fields['files']} 件 {fields['bytes'] / 1024 / 1024:.1f} MB"
+                    f"（{fields['elapsed']:.2f} 秒）")
+        if kind == "route":
+            return (f"{fields['events']} 件の予定へ振り分けました（該当 {fields['matched']} / "
+                    f"該当なし {fields['unmatched']}、{fields['elapsed']:.1f} 秒）")
+        if kind == "summary":
+            return (f"完了 {fields['done']} / スキップ {fields['skipped']} / 失敗 {fields['failed']} / "
+                    f"中止 {fields['cancelled']}  ({fields['elapsed']:.1f} 秒)")
+        if kind == "reindex":
+            return f"インデックスを作り直しました: {fields['files']} 件（{fields['elapsed']:.1f} 秒） {fields['base_root']}"
+        if kind == "trace":
+            return "\n".join(f"  {name:15s} {total['count']:6d} 件 {total['seconds']:9.3f} 秒"
+                              + (f" {total['mb_per_s']:8.1f} MB/s" if total["mb_per_s"] else "")
+                              for name, total in fields["stages"].items())
+        return " ".join(f"{key}={value}" for key, value in fields.items())
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m ingest_cli", description="ファイル・zipをイベントごとのフォルダへ取り込む")
+    parser.add_argument("sources", nargs="*", help="取り込むファイル・zip・フォルダ")
+    event = parser.add_mutually_exclusive_group()
+    event.add_argument("--event", help="イベント名（保存先フォルダ名）")
+    event.add_argument("--auto-event", action="store_true",
+                       help="キーワードにヒットした直近の予定からイベント名を決める（Google認証が必要）")
+    event.add_argument("--route", action="store_true",
+                       help="ファイルごとの撮影日時（Exif/RAW、なければ更新日時）で同期済みの予定へ振り分ける")
+    parser.add_argument("--default-event", help="--route で該当する予定がないファイルのイベント名")
+    parser.add_argument("--format", dest="event_format", help="--auto-event / --route で使うイベント名のフォーマット")
+    parser.add_argument("--all-calendars", action="store_true", help="--auto-event で全カレンダーを対象にする")
+    parser.add_argument("--subfolder", default="", help="イベントフォルダ内のサブフォルダ名")
+    parser.add_argument("--base-root", help="保存先の親フォルダ（省略時はアプリの設定値）")
+    parser.add_argument("--backup", action="append", dest="backup_roots", metavar="ROOT",
+                        help="同時に書き込むバックアップ先の親フォルダ（複数指定可、省略時はアプリの設定値）")
+    parser.add_argument("--no-backup", action="store_true", help="設定済みのバックアップ先にも書き込まない")
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS, help="同時に転送するファイル数")
+    parser.add_argument("--move", action="store_true", help="転送に成功した元ファイルを削除する（zipは残す）")
+    parser.add_argument("--dedupe", choices=[SKIP, HARDLINK, "off"], default=DEDUPE_MODE,
+                        help="取り込み済みと同じ内容のファイルの扱い")
+    parser.add_argument("--verify", choices=[VERIFY_HASH, VERIFY_READBACK, "off"], default=VERIFY_MODE,
+                        help="コピーの検証方法")
+    parser.add_argument("--rescan", action="store_true", help="以前に取り込んだ元ファイルも対象にする")
+    parser.add_argument("--reindex", action="store_true",
+                        help="保存先の既存ファイルを走査し直して重複判定のインデックスを作り直す（元ファイルなしでも可）")
+    parser.add_argument("--dry-run", action="store_true", help="転送せずに計画だけを表示する")
+    parser.add_argument("--plan-out", help="転送計画をJSONで保存する")
+    parser.add_argument("--plan", dest="plan_file", help="保存した転送計画をそのまま実行する")
+    parser.add_argument("--json", action="store_true", help="進捗をJSON Linesで出力する")
+    parser.add_argument("--interval", type=float, default=1.0, help="進捗を出力する間隔（秒）")
+    parser.add_argument("--trace", metavar="PATH", help="段階ごとの所要時間を記録して書き出す（.jsonl / Chrome trace）")
+    return parser
+
+def resolve_event_name(args, reporter: Reporter):
+    if args.event:
+        return args.event.strip()
+    try:
+        names = fetch_hit_event_names(all_calendars=args.all_calendars, fmt=args.event_format)
+    except (IngestError, TemplateError, OSError) as e:
+        reporter.emit("error", message=f"予定を取得できませんでした: {e}")
+        return None
+    if not names:
+        reporter.emit("error", message="キーワードにヒットする予定がありません")
+        return None
+    # 開始日時順に並んでいるので最後が直近の予定
+    return names[-1]
+
+def plan_groups(args, sources, reporter: Reporter):
+    """(イベント名, ファイル一覧) のリストを返す。イベント名を決められなければ None"""
+    if not args.route:
+        event_name = resolve_event_name(args, reporter)
+        return [(event_name, sources)] if event_name else None
+    try:
+        index = build_event_index(args.event_format)
+    except TemplateError as e:
+        reporter.emit("error", message=f"フォーマットが正しくありません: {e}")
+        return None
+    started = time.monotonic()
+    routes, unmatched = route_by_capture_time(sources, index, args.workers * 2)
+    reporter.emit("route", events=len(routes), matched=len(sources) - len(unmatched),
+                  unmatched=len(unmatched), elapsed=round(time.monotonic() - started, 3))
+    groups = list(routes.items())
+    if unmatched:
+        if args.default_event:
+            groups.append((args.default_event, unmatched))
+        else:
+            reporter.emit("error", message="撮影日時に該当する予定がないため取り込みませんでした", paths=unmatched)
+    return groups or None
+
+def make_plan(args, reporter: Reporter, session: IngestSession):
+    """引数から転送計画を作る（--plan なら読み込む）。作れなければ終了コードを返す"""
+    if args.plan_file:
+        plan = Plan.load(args.plan_file)
+        plan.update_free_space()
+        return plan
+    if not (args.event or args.auto_event or args.route):
+        reporter.emit("error", message="--event / --auto-event / --route のいずれかを指定してください")
+        return EXIT_USAGE
+    sources = expand_sources(args.sources)
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        reporter.emit("error", message="ファイルが見つかりません", paths=missing)
+        return EXIT_USAGE
+    if not sources:
+        reporter.emit("error", message="取り込むファイルがありません")
+        return EXIT_USAGE
+    if not args.rescan:
+        # 以前に取り込んだ元ファイルは stat だけで除く
+        sources, ingested = session.filter_ingested(sources)
+        if ingested:
+            reporter.emit("ingested", files=len(ingested))
+        if not sources:
+            return EXIT_OK
+
+    groups = plan_groups(args, sources, reporter)
+    if not groups:
+        return EXIT_NO_EVENT
+    base_root = args.base_root or load_base_root()
+    started = time.monotonic()
+    backup_roots = [] if args.no_backup else (args.backup_roots or load_backup_roots())
+    plan = build_plan([(os.path.join(base_root, name, args.subfolder), paths) for name, paths in groups],
+                      args.move, base_root, backup_roots)
+    reporter.emit("plan", files=plan.total_files, bytes=plan.total_bytes, groups=len(plan.groups),
+                  elapsed=round(time.monotonic() - started, 3))
+    return plan
+
+def run(args, reporter: Reporter) -> int:
+    session = IngestSession()
+    try:
+        if args.reindex:
+            base_root = args.base_root or load_base_root()
+            started = time.monotonic()
+            files = session.reindex(base_root, args.workers)
+            reporter.emit("reindex", base_root=base_root, files=files, elapsed=round(time.monotonic() - started, 3))
+            if not args.sources and not args.plan_file:
+                return EXIT_OK
+        return execute_plan(args, reporter, session)
+    finally:
+        session.close()
+
+def execute_plan(args, reporter: Reporter, session: IngestSession) -> int:
+    plan = make_plan(args, reporter, session)
+    if isinstance(plan, int):
+        return plan
+    if args.plan_out:
+        plan.save(args.plan_out)
+    if args.dry_run:
+        if args.json:
+            reporter.emit("dry_run", **plan.to_dict())
+        else:
+            reporter.stream.write(plan.summary() + "\n")
+        return EXIT_NO_SPACE if plan.shortages else EXIT_OK
+    if plan.shortages:
+        for device in plan.shortages:
+            reporter.emit("error", message="空き容量が足りません", path=device.path,
+                          required=device.required, free=device.free)
+        return EXIT_NO_SPACE
+
+    base_root = plan.base_root or args.base_root or load_base_root()
+    engine = None
+    cancelled = False
+
+    # Ctrl+C / SIGTERM ではキャンセルして、途中までの分をジャーナルに残す
+    def on_signal(signum, frame):
+        nonlocal cancelled
+        cancelled = True
+        if engine:
+            engine.cancel()
+    previous = {sig: signal.signal(sig, on_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+    started = time.monotonic()
+    counts = {state: 0 for state in (DONE, SKIPPED, FAILED, CANCELLED)}
+    failed = False
+    try:
+        for group in plan.groups:
+            if cancelled:
+                counts[CANCELLED] += len(group.sources)
+                continue
+            dest_dir = group.dest_dir
+            os.makedirs(dest_dir, exist_ok=True)
+            engine = session.start(
+                group.sources, dest_dir, base_root,
+                move=plan.move,
+                dedupe=None if args.dedupe == "off" else args.dedupe,
+                verify=None if args.verify == "off" else args.verify,
+                workers=args.workers,
+                planned=group.planned_names(),
+                use_ledger=not args.rescan,
+                mirrors=group.mirror_dirs,
+            )
+            reporter.emit("start", dest_dir=dest_dir, files=len(group.sources), job=engine.journal.job_id)
+            try:
+                while not engine.wait(args.interval):
+                    for path, state, message in engine.poll():
+                        reporter.emit("file", source=path, state=state, message=message)
+                    progress = engine.progress()
+                    reporter.emit("progress", done_files=progress.done_files, total_files=progress.total_files,
+                                  done_bytes=progress.done_bytes, total_bytes=progress.total_bytes,
+                                  throughput=round(progress.throughput, 1), eta=progress.eta,
+                                  mirrors=[{"path": mirror, "bytes": written, "failed": failed}
+                                           for mirror, (written, failed) in progress.mirrors.items()])
+                for path, state, message in engine.poll():
+                    reporter.emit("file", source=path, state=state, message=message)
+            finally:
+                finish_engine(engine)
+            for state in engine.status.values():
+                counts[state] = counts.get(state, 0) + 1
+            for mirror_errors in engine.mirror_errors.values():
+                for path, error in mirror_errors:
+                    reporter.emit("mirror_error", path=path, message=str(error))
+            for path, error in engine.ledger_errors:
+                reporter.emit("ledger_error", path=path, message=str(error))
+            for path, error in engine.index_errors:
+                reporter.emit("index_error", path=path, message=str(error))
+            failed = failed or bool(engine.errors) or any(engine.mirror_errors.values())
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+    reporter.emit("summary", events=len(plan.groups), done=counts[DONE], skipped=counts[SKIPPED],
+                  failed=counts[FAILED], cancelled=counts[CANCELLED],
+                  elapsed=round(time.monotonic() - started, 3))
+    if tracer.enabled:
+        reporter.emit("trace", stages=tracer.totals())
+    if cancelled:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if failed else EXIT_OK
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    reporter = Reporter(args.json)
+    if args.trace:
+        enable_tracing()
+    try:
+        return run(args, reporter)
+    except OSError as e:
+        reporter.emit("error", message=str(e))
+        return EXIT_FAILED
+    finally:
+        if args.trace:
+            tracer.export(args.trace)
+
+if __name__ == "__main__":
+    sys.exit(main())
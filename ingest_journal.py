@@ -0,0 +1,219 @@
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from config import JOURNAL_DIR, VERIFY_MODE, make_hidden
+from fast_copy import file_digest
+from name_allocator import temp_path_for
+
+class ResumeState:
+    """ジャーナルを読み直して得た、前回の取り込みの進み具合"""
+
+    def __init__(self, header: dict):
+        self.header = header
+        self.sources = list(header.get("sources", []))
+        self.done = set()
+        # 元ファイル → 確保済みの保存先
+        self.started = {}
+        # zip → {メンバー名: 保存先}
+        self.members_started = {}
+        self.members_done = {}
+        # 保存先へ書き終えていたが完了を記録する前に中断したもの {元ファイル: (保存先, ハッシュ または None)}
+        self.recovered = {}
+
+    @property
+    def unfinished(self) -> list:
+        return [path for path in self.sources if path not in self.done]
+
+    def apply(self, record: dict):
+        op = record.get("op")
+        source = record.get("source")
+        if op == "start":
+            self.started[source] = record.get("dest")
+        elif op == "done":
+            self.done.add(source)
+        elif op == "member_start":
+            self.members_started.setdefault(source, {})[record["member"]] = record["dest"]
+        elif op == "member_done":
+            self.members_done.setdefault(source, set()).add(record["member"])
+
+class IngestJournal:
+    """取り込みジョブ1件分の先行書き込みログ（JSON Lines）
+
+    先頭行（job）の sources が予定、start / member_start が処理中、done / member_done が完了を表す。
+    レコードは書くたびにOSへ渡すのでアプリが落ちても失われない。
+    fsync は件数・時間でまとめて行い、小さなファイルの転送速度を落とさない。
+    """
+
+    def __init__(self, path, sources=(), fsync_every: int = 256, fsync_interval: float = 2.0):
+        self.path = str(path)
+        # まだ完了していない元ファイル（空になったジョブのジャーナルは close() で消す）
+        self._remaining = set(sources)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell():
+            # クラッシュで途切れた最終行に続けて書かないよう改行を補う
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    @classmethod
+    def create(cls, dest_dir, sources, options: dict = None, **kwargs):
+        JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+        make_hidden(JOURNAL_DIR.parent)
+        job_id = f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+        sources = list(sources)
+        journal = cls(JOURNAL_DIR / f"{job_id}.jsonl", sources, **kwargs)
+        journal._append({
+            "op": "job",
+            "job_id": job_id,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "dest_dir": dest_dir,
+            "sources": sources,
+            "options": options or {},
+        }, sync=True)
+        return journal
+
+    @classmethod
+    def reopen(cls, path, sources, **kwargs):
+        """中断したジョブのジャーナルに追記して、sources の続きを再開する"""
+        return cls(path, sources, **kwargs)
+
+    @property
+    def job_id(self) -> str:
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @property
+    def remaining(self) -> int:
+        return len(self._remaining)
+
+    # === 書き込み ===
+    def _append(self, record: dict, sync: bool = False):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            now = time.monotonic()
+            if sync or self._pending >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+                self._last_sync = now
+
+    def started(self, source, dest=None):
+        self._append({"op": "start", "source": source, "dest": dest})
+
+    def done(self, source, dest=None):
+        with self._lock:
+            self._remaining.discard(source)
+        self._append({"op": "done", "source": source, "dest": dest})
+
+    def member_started(self, source, member, dest):
+        self._append({"op": "member_start", "source": source, "member": member, "dest": dest})
+
+    def member_done(self, source, member, dest):
+        self._append({"op": "member_done", "source": source, "member": member, "dest": dest})
+
+    def close(self):
+        """ジャーナルを閉じる（すべて完了していれば削除する）"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+        if not self._remaining:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    # === 読み込み ===
+    @staticmethod
+    def load(path) -> ResumeState:
+        """ジャーナルを再生する（クラッシュで途中までしか書けていない行は無視）"""
+        state = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if state is None:
+                    if record.get("op") != "job":
+                        return None
+                    state = ResumeState(record)
+                else:
+                    state.apply(record)
+        return state
+
+def find_unfinished_journals() -> list:
+    """前回以前に完了しなかったジョブを (パス, ResumeState) で新しい順に返す"""
+    if not JOURNAL_DIR.exists():
+        return []
+    results = []
+    for path in sorted(JOURNAL_DIR.glob("*.jsonl"), reverse=True):
+        try:
+            state = IngestJournal.load(path)
+        except OSError:
+            continue
+        if state and state.unfinished:
+            results.append((path, state))
+        elif state:
+            # すべて完了していたものは片付ける
+            os.remove(path)
+    return results
+
+def _written_digest(source, dest, verify):
+    """dest が source を書き終えたものなら (True, ハッシュ または None) を返す（verify が有効なら中身も照合）"""
+    try:
+        if not os.path.isfile(dest) or os.path.getsize(source) != os.path.getsize(dest):
+            return False, None
+        if not verify:
+            return True, None
+        digest = file_digest(source)
+        return digest == file_digest(dest), digest
+    except OSError:
+        return False, None
+
+def prepare_resume(state: ResumeState):
+    """書き込み途中のファイルを整理する
+
+    移動モードで元ファイルが消えて一時ファイルだけ残っている場合（リネーム直前に落ちた）は
+    一時ファイルを本来の名前にして完了扱いにする。それ以外の一時ファイルは削除して再転送する。
+    保存先への置き換えの後、完了を記録する前に落ちた場合は、保存先が元ファイルと同じサイズ
+    （検証ありならハッシュも一致）なら完了扱いにし、state.recovered に載せる（もう一度コピーしない）。
+    """
+    options = state.header.get("options", {})
+    move = options.get("move", False)
+    verify = options.get("verify", VERIFY_MODE)
+    for source, dest in list(state.started.items()):
+        if not dest or source in state.done:
+            continue
+        temp = temp_path_for(dest)
+        if os.path.exists(temp):
+            if move and not os.path.exists(source):
+                os.replace(temp, dest)
+                state.done.add(source)
+                state.recovered[source] = (dest, None)
+            else:
+                os.remove(temp)
+        elif os.path.exists(source):
+            written, digest = _written_digest(source, dest, verify)
+            if written:
+                state.done.add(source)
+                state.recovered[source] = (dest, digest)
+    for source, members in state.members_started.items():
+        finished = state.members_done.get(source, set())
+        for member, dest in members.items():
+            temp = temp_path_for(dest)
+            if member not in finished and os.path.exists(temp):
+                os.remove(temp)
@@ -0,0 +1,481 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import uuid
+from pathlib import Path
+from config import DEVICE_STREAMS, JOB_HISTORY_LIMIT, JOB_QUEUE_PATH, TRANSFER_WORKERS, VERIFY_MODE, make_hidden
+from ingest import IngestSession, finish_engine
+from ingest_journal import IngestJournal, prepare_resume
+from transfer_engine import CANCELLED, DONE, FAILED, SKIPPED
+
+# ジョブの状態（完了・失敗・中止は transfer_engine と同じ値）
+QUEUED = "queued"
+RUNNING = "running"
+
+# ドライブの種類
+HDD = "hdd"
+SSD = "ssd"
+NETWORK = "network"
+UNKNOWN = "unknown"
+
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "sshfs", "9p", "afpfs", "davfs"}
+
+def _existing_ancestor(path) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def _linux_rotational(device: int):
+    """/sys/dev/block から回転ディスクかどうかを調べる（パーティションは親のディスクを見る）"""
+    block = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    if os.path.exists(os.path.join(block, "partition")):
+        block = os.path.dirname(block)
+    try:
+        with open(os.path.join(block, "queue", "rotational"), "r", encoding="ascii") as f:
+            return f.read().strip() == "1"
+    except OSError:
+        return None
+
+def _linux_filesystem(path) -> str:
+    """パスを含むマウントのファイルシステム名（/proc/self/mountinfo の最長一致）"""
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    try:
+        with open("/proc/self/mountinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                mount = fields[4].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(best):
+                    best, fstype = mount, fields[fields.index("-") + 1]
+    except (OSError, ValueError, IndexError):
+        pass
+    return fstype
+
+def _windows_is_remote(path) -> bool:
+    import ctypes
+
+    DRIVE_REMOTE = 4
+    root = os.path.splitdrive(os.path.abspath(path))[0] + "\\"
+    return ctypes.windll.kernel32.GetDriveTypeW(ctypes.c_wchar_p(root)) == DRIVE_REMOTE
+
+_kinds = {}
+_kinds_lock = threading.Lock()
+
+def probe_device(path):
+    """パスのあるドライブを (デバイス番号, 種類) で返す（種類はデバイスごとに一度だけ調べる）"""
+    anchor = _existing_ancestor(path)
+    device = os.stat(anchor).st_dev
+    with _kinds_lock:
+        kind = _kinds.get(device)
+    if kind is None:
+        kind = UNKNOWN
+        if sys.platform.startswith("linux"):
+            if _linux_filesystem(anchor) in NETWORK_FILESYSTEMS:
+                kind = NETWORK
+            else:
+                rotational = _linux_rotational(device)
+                if rotational is not None:
+                    kind = HDD if rotational else SSD
+        elif sys.platform == "win32" and _windows_is_remote(anchor):
+            # ローカルドライブのHDD/SSD判別はできないので UNKNOWN のまま
+            kind = NETWORK
+        with _kinds_lock:
+            _kinds[device] = kind
+    return device, kind
+
+class IngestJob:
+    """キューに積んだ取り込み1件（保存先フォルダ1つ分）"""
+
+    FIELDS = ("job_id", "sources", "dest_dir", "base_root", "move", "dedupe", "verify", "mirrors",
+              "use_ledger", "priority", "seq", "status", "created", "journal", "counts", "message")
+
+    def __init__(self, sources, dest_dir, base_root, move=False, dedupe=None, verify=VERIFY_MODE, mirrors=(),
+                 use_ledger=True, priority=0, seq=0, status=QUEUED, created=None, job_id=None, journal=None,
+                 counts=None, message=""):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.sources = list(sources)
+        self.dest_dir = dest_dir
+        self.base_root = base_root
+        self.move = move
+        self.dedupe = dedupe
+        self.verify = verify
+        self.mirrors = list(mirrors)
+        self.use_ledger = use_ledger
+        # 大きいほど先に実行する（同じ優先度は積んだ順）
+        self.priority = priority
+        self.seq = seq
+        self.status = status
+        self.created = created or datetime.datetime.now().isoformat(timespec="seconds")
+        # 実行中のジャーナル（中断後の再開に使う）
+        self.journal = journal
+        # 状態ごとの件数（完了後）
+        self.counts = counts or {}
+        self.message = message
+        # 以下は保存しない（実行中のみ）
+        self.planned = None
+        self.engine = None
+        self.session = None
+        self.workers = 0
+        self.devices = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def label(self) -> str:
+        return os.path.basename(os.path.normpath(self.dest_dir)) or self.dest_dir
+
+    def to_dict(self) -> dict:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        if self.finished:
+            # 履歴には件数だけ残し、jobs.json を小さく保つ
+            data["sources"] = []
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IngestJob":
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+class JobQueue:
+    """取り込みジョブの永続キュー
+
+    読み込み元と保存先（バックアップ先を含む）のドライブごとに同時に使えるファイル数の枠を持ち、
+    枠が空いているジョブから優先度順にバックグラウンドで実行する。
+    HDDは1本ずつ、SSDは複数本なので、カードリーダー → SSD と NAS → HDD は並行に進むが、
+    同じHDDを使う2つのジョブは順番に実行される。
+    アプリを終了しても jobs.json から読み直し、実行中だったジョブはジャーナルから再開する。
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, streams=None, probe=probe_device, session_factory=IngestSession,
+                 workers: int = TRANSFER_WORKERS, poll_interval: float = 0.5):
+        self.path = str(path)
+        self.streams = dict(DEVICE_STREAMS, **(streams or {}))
+        self.probe = probe
+        self.session_factory = session_factory
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._jobs = {}
+        self._seq = 0
+        # デバイスごとの使用中の本数
+        self._in_use = {}
+        # 保存先の親フォルダごとのセッション {base_root: [セッション, 使用中のジョブ数]}
+        self._sessions = {}
+        self._paused = False
+        # 変更のたびに増える（画面は値が変わったときだけ一覧を描き直す）
+        self.version = 0
+        self._load()
+
+    # === 永続化 ===
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in data.get("jobs", []):
+            try:
+                job = IngestJob.from_dict(entry)
+            except TypeError:
+                continue
+            if job.status == RUNNING:
+                # 前回の終了時に実行中だった分はジャーナルから続きを行う
+                job.status = QUEUED
+            self._jobs[job.job_id] = job
+            self._seq = max(self._seq, job.seq)
+
+    def _save(self):
+        """一時ファイルに書いてから置き換える（書き込み中に落ちても前の内容が残る）"""
+        self.version += 1
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        make_hidden(Path(self.path).parent)
+        temp = f"{self.path}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump({"jobs": [job.to_dict() for job in self._ordered()]}, f, indent=1, ensure_ascii=False)
+        os.replace(temp, self.path)
+
+    # === 操作 ===
+    def add(self, sources, dest_dir, base_root, planned=None, priority: int = 0, **options) -> IngestJob:
+        """ジョブを積む。planned（planner.PlanGroup.planned_names()）があれば計画どおりの名前で保存する"""
+        with self._lock:
+            self._seq += 1
+            job = IngestJob(sources, dest_dir, base_root, priority=priority, seq=self._seq, **options)
+            job.planned = planned
+            self._jobs[job.job_id] = job
+            self._save()
+        self._wake.set()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _ordered(self) -> list:
+        return sorted(self._jobs.values(), key=lambda job: (job.finished, -job.priority, job.seq))
+
+    def jobs(self) -> list:
+        """実行中・待機中を優先度順に、その後に完了したものを並べて返す"""
+        with self._lock:
+            return self._ordered()
+
+    def active_sources(self) -> set:
+        """待機中・実行中のジョブに含まれる元ファイル（同じファイルを二重に積まないため）"""
+        with self._lock:
+            return {path for job in self._jobs.values() if not job.finished for path in job.sources}
+
+    def set_priority(self, job_id, priority: int):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job.status == QUEUED:
+                job.priority = priority
+                self._save()
+        self._wake.set()
+
+    def move(self, job_id, offset: int):
+        """待機中のジョブを offset 件前（負）/ 後（正）へ並べ替える（優先度も入れ替わる相手に合わせる）"""
+        with self._lock:
+            queued = [job for job in self._ordered() if job.status == QUEUED]
+            index = next((i for i, job in enumerate(queued) if job.job_id == job_id), None)
+            if index is None:
+                return
+            target = min(max(index + offset, 0), len(queued) - 1)
+            if target == index:
+                return
+            job = queued.pop(index)
+            queued.insert(target, job)
+            neighbor = queued[target + 1] if target + 1 < len(queued) else queued[target - 1]
+            job.priority = neighbor.priority
+            # 並び順どおりに連番を振り直す
+            seqs = sorted(item.seq for item in queued)
+            for item, seq in zip(queued, seqs):
+                item.seq = seq
+            self._save()
+        self._wake.set()
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.message = "実行前に中止"
+                self._save()
+            elif job.engine:
+                job.engine.cancel()
+        self._wake.set()
+
+    def cancel_all(self):
+        for job in self.jobs():
+            self.cancel(job.job_id)
+
+    def pause(self):
+        """新しいジョブを始めず、実行中のジョブも一時停止する"""
+        with self._lock:
+            self._paused = True
+            for job in self._running():
+                job.engine.pause()
+            self.version += 1
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            for job in self._running():
+                job.engine.resume()
+            self.version += 1
+        self._wake.set()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def clear_finished(self):
+        with self._lock:
+            for job in [job for job in self._jobs.values() if job.finished]:
+                del self._jobs[job.job_id]
+            self._save()
+
+    def is_idle(self) -> bool:
+        with self._lock:
+            return all(job.finished for job in self._jobs.values())
+
+    # === 実行 ===
+    def start(self):
+        """スケジューラをバックグラウンドで動かす（画面をブロックしない）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """スケジューラを止める。実行中のジョブは中断して待機中に戻し、次回起動時にジャーナルから再開する"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.schedule()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        with self._lock:
+            for job in self._running():
+                job.engine.cancel()
+            for job in self._running():
+                job.engine.wait()
+                finish_engine(job.engine)
+                self._release(job)
+                job.engine = None
+                job.status = QUEUED
+            self._save()
+
+    def _running(self) -> list:
+        return [job for job in self._jobs.values() if job.status == RUNNING and job.engine]
+
+    def schedule(self):
+        """終わったジョブを片付け、枠が空いたジョブを始める（スケジューラのスレッドから定期的に呼ばれる）"""
+        with self._lock:
+            for job in self._running():
+                if job.engine.is_finished():
+                    self._reap(job)
+            if self._paused:
+                return
+            # 先に待っているジョブが使うドライブは、後ろのジョブに横取りさせない
+            reserved = set()
+            for job in self._ordered():
+                if job.status != QUEUED:
+                    continue
+                try:
+                    devices = self._devices_of(job)
+                except OSError as e:
+                    self._fail(job, f"ドライブを確認できません: {e}")
+                    continue
+                free = min(self.streams.get(kind, 1) - self._in_use.get(device, 0)
+                           for device, kind in devices.items())
+                if free > 0 and not reserved.intersection(devices):
+                    self._launch(job, min(self.workers, free))
+                else:
+                    reserved.update(devices)
+
+    def _devices_of(self, job) -> dict:
+        """ジョブが読み書きするドライブ {デバイス番号: 種類}（同じフォルダのファイルはまとめて調べる）"""
+        if job.devices is None:
+            devices = {}
+            directories = {os.path.dirname(os.path.abspath(path)) for path in job.sources}
+            for path in (*directories, job.dest_dir, *job.mirrors):
+                device, kind = self.probe(path)
+                devices[device] = kind
+            job.devices = devices
+        return job.devices
+
+    def _launch(self, job, workers: int):
+        for device in job.devices:
+            self._in_use[device] = self._in_use.get(device, 0) + workers
+        job.workers = workers
+        job.status = RUNNING
+        try:
+            journal = resume = None
+            sources = job.sources
+            if job.journal and os.path.exists(job.journal):
+                resume = IngestJournal.load(job.journal)
+                if resume:
+                    prepare_resume(resume)
+                    sources = [path for path in resume.unfinished if os.path.exists(path)]
+                    journal = IngestJournal.reopen(job.journal, sources)
+            os.makedirs(job.dest_dir, exist_ok=True)
+            job.session = self._acquire_session(job.base_root)
+            job.engine = job.session.start(
+                sources, job.dest_dir, job.base_root, move=job.move, dedupe=job.dedupe, verify=job.verify,
+                workers=workers, journal=journal, resume=resume, planned=job.planned,
+                use_ledger=job.use_ledger, mirrors=job.mirrors)
+            job.journal = job.engine.journal.path if job.engine.journal else None
+        except Exception as e:
+            self._release(job)
+            self._fail(job, str(e))
+            return
+        self._save()
+
+    def _release(self, job):
+        for device in job.devices or ():
+            self._in_use[device] = max(self._in_use.get(device, 0) - job.workers, 0)
+        job.workers = 0
+        if job.session:
+            self._release_session(job.base_root, job.session)
+            job.session = None
+
+    def _acquire_session(self, base_root):
+        """同じ親フォルダへ同時に書き込むジョブは1つのセッションを共有する
+
+        重複判定のインデックスと台帳のSQLite接続を1つにまとめ、ジョブ同士で書き込みのロックを取り合わない。
+        """
+        key = os.path.abspath(base_root)
+        entry = self._sessions.get(key)
+        if entry is None:
+            entry = self._sessions[key] = [self.session_factory(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_session(self, base_root, session):
+        key = os.path.abspath(base_root)
+        entry = self._sessions.get(key)
+        if entry is None or entry[0] is not session:
+            session.close()
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._sessions[key]
+            session.close()
+
+    def _fail(self, job, message):
+        job.status = FAILED
+        job.message = message
+        self._save()
+
+    def _reap(self, job):
+        engine = job.engine
+        finish_engine(engine)
+        self._release(job)
+        counts = {}
+        for state in engine.status.values():
+            counts[state] = counts.get(state, 0) + 1
+        job.counts = counts
+        mirror_failures = sum(len(errors) for errors in engine.mirror_errors.values())
+        if engine.cancelled:
+            job.status = CANCELLED
+        elif engine.errors:
+            job.status = FAILED
+        else:
+            job.status = DONE
+        job.message = f"完了 {counts.get(DONE, 0)} / スキップ {counts.get(SKIPPED, 0)} / 失敗 {counts.get(FAILED, 0)}"
+        if mirror_failures:
+            job.message += f" / バックアップ失敗 {mirror_failures}"
+        if engine.ledger_errors:
+            job.message += f" / 取り込み済みの記録失敗 {len(engine.ledger_errors)}"
+        if engine.index_errors:
+            job.message += f" / 重複判定の登録失敗 {len(engine.index_errors)}"
+        # すべて完了していればジャーナルは削除されている
+        if job.journal and not os.path.exists(job.journal):
+            job.journal = None
+        self._trim_history()
+        self._save()
+
+    def _trim_history(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        finished.sort(key=lambda job: job.seq)
+        for job in finished[:max(len(finished) - JOB_HISTORY_LIMIT, 0)]:
+            del self._jobs[job.job_id]
+
+    def owned_journals(self) -> set:
+        """キューが再開を受け持つジャーナル（起動時の再開確認から除く）"""
+        with self._lock:
+            return {os.path.abspath(job.journal) for job in self._jobs.values() if job.journal and not job.finished}
@@ -0,0 +1,105 @@
+import threading
+import unicodedata
+from collections import deque
+from config import KEYWORDS_KEY, load_keywords, settings
+
+# カタカナ → ひらがな変換テーブル（ァ〜ヶ）
+_KATA_TO_HIRA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+def normalize_text(text: str) -> str:
+    """NFKC正規化 + 大文字小文字・かなの揺れを吸収した文字列を返す"""
+    return unicodedata.normalize("NFKC", text or "").casefold().translate(_KATA_TO_HIRA)
+
+class KeywordMatcher:
+    """キーワード一覧をAho-Corasickオートマトンにまとめて一括判定する"""
+
+    def __init__(self, keywords):
+        self.keywords = [k for k in keywords if k and k.strip()]
+        # ノードごとの遷移表・失敗リンク・一致したキーワードの番号
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, keyword in enumerate(self.keywords):
+            self._add(normalize_text(keyword.strip()), index)
+        self._build_fail_links()
+
+    def _add(self, pattern: str, index: int):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = self._out[node] + (index,)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _scan(self, text: str):
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in normalize_text(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield out[node]
+
+    def search(self, text: str) -> bool:
+        """いずれかのキーワードを含んでいればTrue"""
+        for _ in self._scan(text):
+            return True
+        return False
+
+    def find_all(self, text: str) -> list:
+        """含まれているキーワードを登録順で返す"""
+        found = set()
+        for indexes in self._scan(text):
+            found.update(indexes)
+        return [self.keywords[i] for i in sorted(found)]
+
+    def is_hit_event(self, title: str, description: str = "") -> bool:
+        return self.search((title or "") + "\n" + (description or ""))
+
+# === 設定のキーワードが変わったときだけ作り直すキャッシュ ===
+_lock = threading.Lock()
+_cached_matcher = None
+# キーワードの変更通知を受けた回数（作っている途中に変わった古いマッチャーをキャッシュしないため）
+_generation = 0
+
+def _on_keywords_changed(changed):
+    global _cached_matcher, _generation
+    with _lock:
+        _cached_matcher = None
+        _generation += 1
+
+settings.subscribe(_on_keywords_changed, KEYWORDS_KEY)
+
+def get_keyword_matcher() -> KeywordMatcher:
+    """キーワードが変更されたときだけ再構築したマッチャーを返す"""
+    global _cached_matcher
+    settings.revalidate()
+    with _lock:
+        matcher, generation = _cached_matcher, _generation
+    if matcher is None:
+        # 設定の読み込みは通知を伴うことがあるので、ロックの外で行う
+        matcher = KeywordMatcher(load_keywords())
+        with _lock:
+            if generation == _generation:
+                _cached_matcher = matcher
+    return matcher
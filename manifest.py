@@ -0,0 +1,52 @@
+import datetime
+import json
+import os
+import threading
+from fast_copy import DIGEST_ALGORITHM
+
+class IngestManifest:
+    """取り込み1回分の記録（JSON Lines）を保存先フォルダに書き出す
+
+    1行が1ファイル（zipの場合は1メンバー）で、元パス・保存先・サイズ・ハッシュ・所要時間を持つ。
+    """
+
+    def __init__(self, dest_dir, started: datetime.datetime = None):
+        started = started or datetime.datetime.now()
+        self.path = os.path.join(dest_dir, f"manifest_{started:%Y%m%d_%H%M%S}.jsonl")
+        os.makedirs(dest_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # 行バッファリングで1件ごとに書き出す（クラッシュしても書けた分は残る）
+        self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._write({"type": "ingest", "started": started.isoformat(timespec="seconds"), "dest_dir": dest_dir})
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def record(self, source, destination, size, digest: bytes = None, status: str = "done",
+               started: float = None, elapsed: float = None, backend: str = None, member: str = None):
+        record = {
+            "type": "file",
+            "source": source,
+            "destination": destination,
+            "size": size,
+            "hash": digest.hex() if digest else None,
+            "algorithm": DIGEST_ALGORITHM if digest else None,
+            "status": status,
+        }
+        if member is not None:
+            record["member"] = member
+        if backend is not None:
+            record["backend"] = backend
+        if started is not None:
+            record["started"] = datetime.datetime.fromtimestamp(started).isoformat(timespec="milliseconds")
+        if elapsed is not None:
+            record["elapsed_ms"] = round(elapsed * 1000, 1)
+        self._write(record)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,72 @@
+import os
+import threading
+
+def temp_path_for(dest_path: str) -> str:
+    """書き込み途中のファイル名（完了後に dest_path へアトミックにリネームする）"""
+    directory, name = os.path.split(dest_path)
+    return os.path.join(directory, f".{name}.part")
+
+class NameAllocator:
+    """保存先フォルダ内で重複しないファイル名を払い出す
+
+    フォルダは最初に一度だけ走査し、以降は使用済みの名前の集合と「名前_連番」の
+    カウンタをメモリ上で管理する。払い出した名前は排他作成（O_EXCL）で空ファイルとして
+    確保するので、並列ワーカーや他のアプリが同時に書き込んでも上書きしない。
+    """
+
+    def __init__(self, directory, dry_run: bool = False):
+        self.directory = directory
+        # dry_run=True の場合はフォルダもファイルも作らず、名前の計算だけを行う（実行前の計画用）
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self._taken = set()
+        self._counters = {}
+        if dry_run and not os.path.isdir(directory):
+            return
+        os.makedirs(directory, exist_ok=True)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                self._taken.add(os.path.normcase(entry.name))
+
+    def allocate(self, filename: str) -> str:
+        """未使用のパスを確保して返す（IMG.jpg → IMG_1.jpg → IMG_2.jpg …）"""
+        base, ext = os.path.splitext(filename)
+        with self._lock:
+            candidate = filename
+            while True:
+                key = os.path.normcase(candidate)
+                if key not in self._taken:
+                    self._taken.add(key)
+                    path = os.path.join(self.directory, candidate)
+                    if self.dry_run or self._create(path):
+                        return path
+                # 同じ名前の連番は前回の続きから探す
+                counter_key = os.path.normcase(filename)
+                counter = self._counters.get(counter_key, 0) + 1
+                self._counters[counter_key] = counter
+                candidate = f"{base}_{counter}{ext}"
+
+    @staticmethod
+    def _create(path) -> bool:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return True
+        except FileExistsError:
+            # 走査後に外部で作られたファイル
+            return False
+
+    def claim(self, path: str):
+        """計画済みの名前をそのまま確保して返す（計画後に使われていた場合は None）"""
+        name = os.path.basename(path)
+        key = os.path.normcase(name)
+        with self._lock:
+            if key in self._taken:
+                return None
+            self._taken.add(key)
+            path = os.path.join(self.directory, name)
+            return path if self.dry_run or self._create(path) else None
+
+    def release(self, path: str):
+        """確保したが使わなかった名前を戻す（ファイル自体は呼び出し側で削除する）"""
+        with self._lock:
+            self._taken.discard(os.path.normcase(os.path.basename(path)))
@@ -0,0 +1,238 @@
+import datetime
+import json
+import os
+import shutil
+from archive_reader import ArchiveError, is_archive, is_image, open_archive, reader_for
+from fast_copy import same_device
+from name_allocator import NameAllocator
+from tracing import PLANNING, span
+
+class PlanItem:
+    """転送1件分の予定（zipメンバーの場合は member にzip内の名前が入る）
+
+    展開しないと中身が分からないアーカイブ（tar・入れ子のアーカイブ）は dest を None とし、
+    size にはアーカイブの大きさを見積もりとして入れる（名前は実行時に決める）。
+    """
+
+    __slots__ = ("source", "member", "dest", "size")
+
+    def __init__(self, source, dest, size, member=None):
+        self.source = source
+        self.member = member
+        self.dest = dest
+        self.size = size
+
+    def to_dict(self) -> dict:
+        return {"source": self.source, "member": self.member, "dest": self.dest, "size": self.size}
+
+class PlanGroup:
+    """同じ保存先フォルダへ転送するファイルの予定"""
+
+    def __init__(self, dest_dir, sources, mirror_dirs=()):
+        self.dest_dir = dest_dir
+        self.sources = list(sources)
+        # 同時に書き込むバックアップ先フォルダ
+        self.mirror_dirs = list(mirror_dirs)
+        self.items = []
+        # 元の名前では保存できず連番にした件数
+        self.renamed = 0
+        # 読めなかったファイル（パス, 理由）
+        self.errors = []
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(item.size for item in self.items)
+
+    def planned_names(self) -> dict:
+        """実行時にそのまま使う保存先（ファイル: パス → 保存先 / zipメンバー: (パス, メンバー名) → 保存先）"""
+        names = {}
+        for item in self.items:
+            if item.dest is None:
+                continue
+            names[(item.source, item.member) if item.member else item.source] = item.dest
+        return names
+
+class DeviceUsage:
+    """保存先ドライブごとの必要量と空き容量"""
+
+    def __init__(self, path, required: int, free: int):
+        self.path = path
+        self.required = required
+        self.free = free
+
+    @property
+    def sufficient(self) -> bool:
+        return self.required <= self.free
+
+class Plan:
+    """実行前に作る転送計画（表示・JSON出力してから、そのまま実行できる）"""
+
+    def __init__(self, groups, move: bool = False, created=None, base_root=None):
+        self.groups = list(groups)
+        self.move = move
+        # 重複判定インデックスの場所（保存先の親フォルダ）
+        self.base_root = base_root
+        self.created = created or datetime.datetime.now().isoformat(timespec="seconds")
+        self.devices = []
+
+    @property
+    def total_files(self) -> int:
+        return sum(len(group.items) for group in self.groups)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(group.total_bytes for group in self.groups)
+
+    def update_free_space(self):
+        """保存したJSONから実行するときなどに、空き容量を測り直す"""
+        for device in self.devices:
+            device.free = shutil.disk_usage(_existing_ancestor(device.path)).free
+
+    @property
+    def shortages(self) -> list:
+        return [device for device in self.devices if not device.sufficient]
+
+    def summary(self) -> str:
+        lines = [f"{self.total_files} 件 / {self.total_bytes / 1024 / 1024:.1f} MB"]
+        for group in self.groups:
+            line = f"・{group.dest_dir}: {len(group.items)} 件 {group.total_bytes / 1024 / 1024:.1f} MB"
+            if group.renamed:
+                line += f"（同名のため連番 {group.renamed} 件）"
+            lines.append(line)
+            for mirror in group.mirror_dirs:
+                lines.append(f"  バックアップ: {mirror}")
+            for path, reason in group.errors[:5]:
+                lines.append(f"  読めません: {os.path.basename(path)}: {reason}")
+        for device in self.devices:
+            mark = "" if device.sufficient else "  ※空き容量が不足しています"
+            lines.append(f"保存先ドライブ {device.path}: 必要 {device.required / 1024 / 1024:.1f} MB / "
+                         f"空き {device.free / 1024 / 1024:.1f} MB{mark}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "move": self.move,
+            "base_root": self.base_root,
+            "total_files": self.total_files,
+            "total_bytes": self.total_bytes,
+            "groups": [
+                {
+                    "dest_dir": group.dest_dir,
+                    "mirror_dirs": group.mirror_dirs,
+                    "sources": group.sources,
+                    "renamed": group.renamed,
+                    "errors": [[path, reason] for path, reason in group.errors],
+                    "items": [item.to_dict() for item in group.items],
+                }
+                for group in self.groups
+            ],
+            "devices": [
+                {"path": device.path, "required": device.required, "free": device.free}
+                for device in self.devices
+            ],
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path) -> "Plan":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        groups = []
+        for entry in data.get("groups", []):
+            group = PlanGroup(entry["dest_dir"], entry.get("sources", []), entry.get("mirror_dirs", []))
+            group.renamed = entry.get("renamed", 0)
+            group.errors = [tuple(error) for error in entry.get("errors", [])]
+            group.items = [PlanItem(item["source"], item["dest"], item["size"], item.get("member"))
+                           for item in entry.get("items", [])]
+            groups.append(group)
+        plan = cls(groups, data.get("move", False), data.get("created"), data.get("base_root"))
+        plan.devices = [DeviceUsage(d["path"], d["required"], d["free"]) for d in data.get("devices", [])]
+        return plan
+
+def backup_dirs(dest_dir, base_root, backup_roots) -> list:
+    """保存先フォルダに対応するバックアップ先（各バックアップの親フォルダに同じ「イベント/サブフォルダ」）"""
+    relative = os.path.relpath(dest_dir, base_root)
+    return [os.path.normpath(os.path.join(root, relative)) for root in backup_roots]
+
+def _existing_ancestor(path) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def _add_required(required_by_device: dict, device, anchor, size: int):
+    first_anchor, total = required_by_device.get(device, (anchor, 0))
+    required_by_device[device] = (first_anchor, total + size)
+
+def _plan_group(group: PlanGroup, move: bool, required_by_device: dict):
+    # フォルダはまだ作らず、既存のファイル名だけを見て実際に付く名前を決める
+    allocator = NameAllocator(group.dest_dir, dry_run=True)
+    anchor = _existing_ancestor(group.dest_dir)
+    device = os.stat(anchor).st_dev
+    # バックアップ先は移動でも必ずコピーになる
+    mirror_anchors = [_existing_ancestor(mirror) for mirror in group.mirror_dirs]
+    mirror_devices = [(os.stat(mirror_anchor).st_dev, mirror_anchor) for mirror_anchor in mirror_anchors]
+    for path in group.sources:
+        filename = os.path.basename(path)
+        try:
+            if is_archive(path) and reader_for(filename).cheap_listing:
+                # zip は中央ディレクトリ、7z はヘッダーだけを読み、展開はしない
+                with open_archive(path) as reader:
+                    for member in reader.members():
+                        if is_image(member.name):
+                            member_name = os.path.basename(member.name.replace("\\", "/"))
+                            dest = allocator.allocate(member_name)
+                            group.renamed += os.path.basename(dest) != member_name
+                        elif reader_for(member.name):
+                            # 入れ子のアーカイブは中身を数えず、大きさだけ見積もる
+                            dest = None
+                        else:
+                            continue
+                        group.items.append(PlanItem(path, dest, member.file_size, member.filename))
+                        _add_required(required_by_device, device, anchor, member.file_size)
+                        for mirror_device, mirror_anchor in mirror_devices:
+                            _add_required(required_by_device, mirror_device, mirror_anchor, member.file_size)
+                continue
+            size = os.stat(path).st_size
+        except (OSError, ArchiveError) as e:
+            group.errors.append((path, str(e)))
+            continue
+        if is_archive(path):
+            # tar は一覧を得るだけでも全体の伸張が要るので、アーカイブの大きさで見積もる
+            group.items.append(PlanItem(path, None, size))
+            _add_required(required_by_device, device, anchor, size)
+            for mirror_device, mirror_anchor in mirror_devices:
+                _add_required(required_by_device, mirror_device, mirror_anchor, size)
+            continue
+        dest = allocator.allocate(filename)
+        group.renamed += os.path.basename(dest) != filename
+        group.items.append(PlanItem(path, dest, size))
+        # 同じドライブ内の移動はリネームで済むので空き容量を使わない
+        needed = 0 if move and not mirror_devices and same_device(path, anchor) else size
+        _add_required(required_by_device, device, anchor, needed)
+        for mirror_device, mirror_anchor in mirror_devices:
+            _add_required(required_by_device, mirror_device, mirror_anchor, size)
+
+def build_plan(groups, move: bool = False, base_root=None, backup_roots=()) -> Plan:
+    """[(保存先フォルダ, ファイル一覧), ...] から転送計画を作る
+
+    ファイルは stat、zip・7zはメンバー一覧の読み込みだけで、中身は読まない。
+    backup_roots を渡すと、base_root 以下と同じ構成のバックアップ先の空き容量も確認する。
+    """
+    plan = Plan([PlanGroup(dest_dir, sources, backup_dirs(dest_dir, base_root, backup_roots) if backup_roots else ())
+                 for dest_dir, sources in groups], move, base_root=base_root)
+    required_by_device = {}
+    with span(PLANNING, groups=len(plan.groups)) as sp:
+        for group in plan.groups:
+            _plan_group(group, move, required_by_device)
+        for anchor, required in required_by_device.values():
+            plan.devices.append(DeviceUsage(anchor, required, shutil.disk_usage(anchor).free))
+        sp.set(files=plan.total_files, total_bytes=plan.total_bytes)
+    return plan
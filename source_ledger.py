@@ -0,0 +1,241 @@
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zipfile
+from functools import lru_cache
+from pathlib import Path
+from config import SOURCE_LEDGER_PATH, make_hidden
+
+# 1回のSQLで問い合わせるキーの数（SQLiteのパラメータ上限より十分小さく）
+LOOKUP_BATCH = 500
+# 記録はこの件数ごとにまとめて書き込む
+FLUSH_EVERY = 1000
+
+@lru_cache(maxsize=4096)
+def find_mount_point(directory) -> str:
+    """フォルダを含むマウント先（Windowsではドライブのルート）。同じフォルダのファイルは使い回す"""
+    if os.path.ismount(directory):
+        return directory
+    parent = os.path.dirname(directory)
+    return directory if parent == directory else find_mount_point(parent)
+
+def _unescape_mountinfo(field: str) -> str:
+    # 空白などは \040 のような8進表記で書かれている
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+def _windows_volume_serial(root):
+    import ctypes
+
+    serial = ctypes.c_uint32()
+    if ctypes.windll.kernel32.GetVolumeInformationW(
+            ctypes.c_wchar_p(root), None, 0, ctypes.byref(serial), None, None, None, 0):
+        return f"serial:{serial.value:08x}"
+    return None
+
+def _linux_volume_uuid(mount):
+    """/proc/self/mountinfo でマウント元のデバイスを調べ、/dev/disk/by-uuid から UUID を引く"""
+    try:
+        with open("/proc/self/mountinfo", "r", encoding="utf-8") as f:
+            source = None
+            for line in f:
+                fields = line.split()
+                if len(fields) > 4 and _unescape_mountinfo(fields[4]) == mount:
+                    source = fields[fields.index("-") + 2]
+        if not source or not source.startswith("/dev/"):
+            return None
+        device = os.path.realpath(source)
+        with os.scandir("/dev/disk/by-uuid") as entries:
+            for entry in entries:
+                if os.path.realpath(entry.path) == device:
+                    return f"uuid:{entry.name}"
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+@lru_cache(maxsize=64)
+def _volume_id_of_mount(mount) -> str:
+    volume = None
+    if sys.platform == "win32":
+        volume = _windows_volume_serial(mount)
+    elif sys.platform.startswith("linux"):
+        volume = _linux_volume_uuid(mount)
+    # 判別できない場合はマウント先とデバイス番号で代用（抜き差しで変わることがある）
+    return volume or f"mount:{mount}:{os.stat(mount).st_dev}"
+
+def source_key(path):
+    """カードを別のドライブ文字・マウント先で挿しても変わらない (ボリュームID, ボリューム内の相対パス)"""
+    path = os.path.abspath(path)
+    mount = find_mount_point(os.path.dirname(path))
+    relative = os.path.relpath(path, mount)
+    return _volume_id_of_mount(mount), os.path.normcase(relative).replace(os.sep, "/")
+
+def _path_key(relative: str, member: str = None) -> int:
+    """相対パス（zipメンバーは zip内の名前を付けたもの）を8バイトの整数にする（保存容量を抑える）"""
+    text = relative if member is None else f"{relative}\0{member}"
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+class SourceLedger:
+    """取り込み済みの元ファイルを (ボリューム, 相対パス) → (サイズ, 更新日時 or CRC) で覚えておく
+
+    次回は stat（zipは中央ディレクトリの読み込み）だけで取り込み済みかを判定でき、中身は読まない。
+    パスは8バイトのハッシュで保持するので、数百万件でも数十MB程度に収まる。
+    """
+
+    def __init__(self, db_path=SOURCE_LEDGER_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        make_hidden(self.db_path.parent)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS volumes (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ledger (
+                volume INTEGER NOT NULL,
+                key INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                stamp INTEGER NOT NULL,
+                PRIMARY KEY (volume, key)
+            ) WITHOUT ROWID;
+        """)
+        self._volumes = dict(self._conn.execute("SELECT name, id FROM volumes"))
+        self._pending = []
+
+    def _volume(self, name: str) -> int:
+        volume = self._volumes.get(name)
+        if volume is None:
+            with self._conn:
+                cursor = self._conn.execute("INSERT OR IGNORE INTO volumes (name) VALUES (?)", (name,))
+                volume = cursor.lastrowid if cursor.rowcount else \
+                    self._conn.execute("SELECT id FROM volumes WHERE name = ?", (name,)).fetchone()[0]
+            self._volumes[name] = volume
+        return volume
+
+    # === 判定 ===
+    def _lookup(self, volume: int, keys) -> dict:
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[i:i + LOOKUP_BATCH]
+            rows = self._conn.execute(
+                f"SELECT key, size, stamp FROM ledger WHERE volume = ? AND key IN ({', '.join('?' * len(batch))})",
+                [volume, *batch])
+            for key, size, stamp in rows:
+                found[key] = (size, stamp)
+        return found
+
+    def partition(self, paths):
+        """ファイル一覧を (未取り込み, 取り込み済み) に分ける（stat のみ）"""
+        by_volume = {}
+        stats = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                by_volume.setdefault(None, []).append((path, None))
+                continue
+            volume_name, relative = source_key(path)
+            stats[path] = (st.st_size, st.st_mtime_ns)
+            by_volume.setdefault(volume_name, []).append((path, _path_key(relative)))
+        seen = set()
+        with self._lock:
+            self._flush()
+            for volume_name, entries in by_volume.items():
+                if volume_name is None or volume_name not in self._volumes:
+                    continue
+                found = self._lookup(self._volumes[volume_name], (key for _, key in entries))
+                for path, key in entries:
+                    if found.get(key) == stats[path]:
+                        seen.add(path)
+        new = [path for path in paths if path not in seen]
+        return new, [path for path in paths if path in seen]
+
+    def member_filter(self, zip_path):
+        """アーカイブのメンバーが取り込み済みか (メンバー) → bool で判定する関数を返す
+
+        サイズと stamp（zipはCRC、tarなどは更新日時）で照合する。
+        """
+        volume_name, relative = source_key(zip_path)
+        with self._lock:
+            self._flush()
+            volume = self._volumes.get(volume_name)
+            if volume is None:
+                return lambda info: False
+            if not zipfile.is_zipfile(zip_path):
+                # tar などは一覧を得るのにも全体の伸張が要るので、メンバーが届くたびに引く
+                return lambda info: self._member_done(volume, relative, info)
+            # メンバー一覧は中央ディレクトリから得られるので、zip1つ分をまとめて引く
+            with zipfile.ZipFile(zip_path) as zip_ref:
+                members = {_path_key(relative, info.filename): info.filename for info in zip_ref.infolist()}
+            found = self._lookup(volume, members)
+        done = {members[key]: value for key, value in found.items()}
+        listed = set(members.values())
+
+        def is_done(info):
+            if info.filename in listed:
+                return done.get(info.filename) == (info.file_size, info.stamp)
+            # 入れ子のアーカイブ内のメンバーは中央ディレクトリにないので個別に引く
+            return self._member_done(volume, relative, info)
+        return is_done
+
+    def _member_done(self, volume: int, relative: str, info) -> bool:
+        with self._lock:
+            self._flush()
+            found = self._lookup(volume, [_path_key(relative, info.filename)])
+        return next(iter(found.values()), None) == (info.file_size, info.stamp)
+
+    # === 記録 ===
+    def record(self, path):
+        """取り込みが終わった元ファイルを記録する（まとめて書き込む）"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        volume_name, relative = source_key(path)
+        self._append(volume_name, _path_key(relative), st.st_size, st.st_mtime_ns)
+
+    def record_member(self, zip_path, info):
+        volume_name, relative = source_key(zip_path)
+        self._append(volume_name, _path_key(relative, info.filename), info.file_size, info.stamp)
+
+    def _append(self, volume_name, key, size, stamp):
+        with self._lock:
+            self._pending.append((self._volume(volume_name), key, size, stamp))
+            if len(self._pending) >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def count(self) -> int:
+        with self._lock:
+            self._flush()
+            return self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    def forget_volume(self, path):
+        """カードを初期化して使い回すときなどに、そのボリュームの記録を消す"""
+        volume_name, _ = source_key(path)
+        with self._lock, self._conn:
+            volume = self._volumes.get(volume_name)
+            if volume is not None:
+                self._pending = [row for row in self._pending if row[0] != volume]
+                self._conn.execute("DELETE FROM ledger WHERE volume = ?", (volume,))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
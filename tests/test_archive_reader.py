@@ -0,0 +1,82 @@
+"""7z の読み込み（py7zr がある場合のみ）"""
+import datetime
+import os
+import zipfile
+import pytest
+
+py7zr = pytest.importorskip("py7zr")
+from archive_reader import ArchiveError, SevenZipArchiveReader, iter_archive_images
+from zip_extract import extract_images
+
+ARCHIVE_TIME = datetime.datetime(2024, 5, 1, 9, 30, 0)
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / "photos.7z")
+    with py7zr.SevenZipFile(path, "w") as z:
+        for i in range(3):
+            z.writestr(bytes([i]) * 5000, f"DCIM/IMG_{i:04d}.JPG")
+        z.writestr(b"notes", "DCIM/readme.txt")
+    os.utime(path, (ARCHIVE_TIME.timestamp(), ARCHIVE_TIME.timestamp()))
+    return path
+
+def without_times(reader):
+    for info in reader._infos:
+        info.creationtime = None
+    return reader
+
+def test_member_without_time_uses_archive_mtime(archive):
+    with without_times(SevenZipArchiveReader(archive)) as reader:
+        members = list(reader.members())
+    assert {member.date_time for member in members} == {ARCHIVE_TIME.timetuple()[:6]}
+
+def test_member_stamp_is_stable_across_runs(archive):
+    stamps = []
+    for _ in range(2):
+        with without_times(SevenZipArchiveReader(archive)) as reader:
+            stamps.append([(member.filename, member.date_time, member.stamp) for member in reader.members()])
+    assert stamps[0] == stamps[1]
+
+def test_nested_member_without_time_uses_outer_member_time(archive, tmp_path):
+    outer = str(tmp_path / "outer.zip")
+    with zipfile.ZipFile(outer, "w") as z:
+        info = zipfile.ZipInfo("inner/photos.7z", date_time=(2023, 1, 2, 3, 4, 6))
+        with open(archive, "rb") as f:
+            z.writestr(info, f.read())
+    original = SevenZipArchiveReader.members
+    try:
+        SevenZipArchiveReader.members = lambda self: original(without_times(self))
+        members = [(member.filename, member.date_time) for member in iter_archive_images(outer)]
+    finally:
+        SevenZipArchiveReader.members = original
+    assert members == [(f"inner/photos.7z/DCIM/IMG_{i:04d}.JPG", (2023, 1, 2, 3, 4, 6)) for i in range(3)]
+
+def test_only_images_are_extracted(archive, tmp_path):
+    dest = tmp_path / "event"
+    written = extract_images(archive, str(dest))
+    assert len(written) == 3
+    # 画像以外や一時フォルダは保存先に残らない
+    assert sorted(os.listdir(dest)) == ["IMG_0000.JPG", "IMG_0001.JPG", "IMG_0002.JPG"]
+    with open(dest / "IMG_0002.JPG", "rb") as f:
+        assert f.read() == bytes([2]) * 5000
+
+def test_members_are_read_in_stored_order(archive):
+    with SevenZipArchiveReader(archive) as reader:
+        members = [member for member in reader.members() if member.name.endswith(".JPG")]
+        with members[1].open() as f:
+            assert f.read(10) == bytes([1]) * 10
+        with pytest.raises(ArchiveError):
+            members[0].open()
+
+def test_corrupted_member_raises(tmp_path):
+    path = tmp_path / "broken.7z"
+    with py7zr.SevenZipFile(path, "w", filters=[{"id": py7zr.FILTER_COPY}]) as z:
+        z.writestr(b"A" * 5000, "IMG_0001.JPG")
+    data = bytearray(path.read_bytes())
+    data[100] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with SevenZipArchiveReader(str(path)) as reader:
+        member = next(iter(reader.members()))
+        with pytest.raises(ArchiveError):
+            with member.open() as f:
+                f.read()
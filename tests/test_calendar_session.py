@@ -0,0 +1,164 @@
+"""CalendarSession のトークン更新と、API呼び出しが requests のセッションを通ること
+
+Google のトークンの代わりに FakeCredentials を、通信の代わりに requests のアダプター（FakeTransport）を使う。
+"""
+import datetime
+import gzip
+import io
+import json
+import pickle
+import threading
+import pytest
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("google.auth.transport.requests")
+import requests
+import urllib3
+from googleapiclient.errors import HttpError
+from calendar_session import CalendarSession, SessionHttp
+from event_store import _is_sync_token_expired
+
+class FakeCredentials:
+    """google.oauth2.credentials.Credentials の代わり（refresh() は渡された request を記録する）"""
+
+    def __init__(self, token="old", expired=False, lifetime=3600):
+        self.token = token
+        self.refresh_token = "refresh"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=lifetime)
+        self._expired = expired
+        self.requests = []
+
+    @property
+    def expired(self):
+        return self._expired
+
+    @property
+    def valid(self):
+        return not self._expired
+
+    def refresh(self, request):
+        self.requests.append(request)
+        self.token = f"new{len(self.requests)}"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        self._expired = False
+
+    def before_request(self, request, method, url, headers):
+        headers["authorization"] = f"Bearer {self.token}"
+
+class FakeTransport(requests.adapters.BaseAdapter):
+    """送られたリクエストを記録し、用意した応答 (status, JSON, gzip) を返す"""
+
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        status, body, compressed = self.responses.pop(0) if self.responses else (200, {"items": []}, False)
+        response = requests.models.Response()
+        response.status_code = status
+        response.reason = "Gone" if status == 410 else "OK"
+        response.url = request.url
+        response.request = request
+        data = json.dumps(body).encode("utf-8")
+        response.headers["content-type"] = "application/json; charset=UTF-8"
+        if compressed:
+            data = gzip.compress(data)
+            response.headers["content-encoding"] = "gzip"
+        response.headers["content-length"] = str(len(data))
+        response.raw = urllib3.HTTPResponse(
+            body=io.BytesIO(data), headers=response.headers, status=status, preload_content=False)
+        return response
+
+    def close(self):
+        pass
+
+def calendar_service(transport):
+    from googleapiclient.discovery import build
+
+    http_session = requests.Session()
+    http_session.mount("https://", transport)
+    return build("calendar", "v3", http=SessionHttp(http_session), cache_discovery=False)
+
+@pytest.fixture
+def token_path(tmp_path):
+    return tmp_path / "token.pickle"
+
+def save_token(token_path, creds):
+    with open(token_path, "wb") as f:
+        pickle.dump(creds, f)
+
+def test_expired_token_is_refreshed_and_saved(token_path):
+    save_token(token_path, FakeCredentials(expired=True))
+    session = CalendarSession(token_path=token_path, client_config_loader=pytest.fail)
+    try:
+        creds = session.credentials()
+        assert creds.token == "new1"
+        with open(token_path, "rb") as f:
+            assert pickle.load(f).token == "new1"
+        # 更新のリクエストはコネクションを使い回すため同じものを使う
+        creds._expired = True
+        session.credentials()
+        assert creds.requests[0] is creds.requests[1]
+        assert isinstance(creds.requests[0].session, requests.Session)
+    finally:
+        session.close()
+
+def test_refresh_is_scheduled_before_expiry(token_path):
+    save_token(token_path, FakeCredentials(lifetime=1))
+    session = CalendarSession(token_path=token_path, refresh_margin=1, client_config_loader=pytest.fail)
+    try:
+        creds = session.credentials()
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=5)
+        while not creds.requests and datetime.datetime.now() < deadline:
+            threading.Event().wait(0.05)
+        assert creds.token == "new1"
+    finally:
+        session.close()
+
+def test_service_is_shared_and_uses_the_pooled_session(token_path):
+    save_token(token_path, FakeCredentials())
+    session = CalendarSession(token_path=token_path, client_config_loader=pytest.fail)
+    try:
+        service = session.service()
+        services = []
+        thread = threading.Thread(target=lambda: services.append(session.service()))
+        thread.start()
+        thread.join()
+        assert services == [service]
+
+        transport = FakeTransport((200, {"items": [{"id": "ev1"}], "nextSyncToken": "t1"}, True))
+        session._api_http.session.mount("https://", transport)
+        page = service.events().list(calendarId="primary", maxResults=10).execute()
+        assert page == {"items": [{"id": "ev1"}], "nextSyncToken": "t1"}
+        assert transport.sent[0].headers["authorization"] == "Bearer old"
+        assert "/calendars/primary/events" in transport.sent[0].url
+
+        # 認証情報が変わったらサービスを作り直す
+        session.reset()
+        save_token(token_path, FakeCredentials(token="other"))
+        assert session.service() is not service
+    finally:
+        session.close()
+
+def test_http_errors_keep_status_for_sync_token_reset():
+    service = calendar_service(FakeTransport((410, {"error": {"code": 410, "message": "Sync token is no longer valid"}},
+                                              False)))
+    with pytest.raises(HttpError) as raised:
+        service.events().list(calendarId="primary", syncToken="expired").execute()
+    assert raised.value.resp.status == 410
+    assert _is_sync_token_expired(raised.value)
+
+def test_connection_errors_are_retryable():
+    class Unreachable(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            raise requests.exceptions.ConnectionError("unreachable")
+
+        def close(self):
+            pass
+
+    http_session = requests.Session()
+    http_session.mount("https://", Unreachable())
+    with pytest.raises(ConnectionError):
+        SessionHttp(http_session).request("https://www.googleapis.com/calendar/v3/users/me/calendarList")
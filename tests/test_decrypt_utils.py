@@ -0,0 +1,118 @@
+"""クライアント設定の取得（S3 の代わりに FakeS3、鍵の保存先の代わりに MemoryKeyStore を使う）"""
+import io
+import json
+import sys
+import pytest
+
+pytest.importorskip("cryptography")
+from cryptography.fernet import Fernet
+import decrypt_utils
+from auth_secrets import CREDENTIALS_OBJECT_KEY, KEY_OBJECT_KEY, S3_BUCKET_NAME
+
+CLIENT_CONFIG = {"installed": {"client_id": "id.apps.googleusercontent.com", "client_secret": "secret"}}
+
+class FakeS3:
+    """get_object だけを持つ S3 クライアントの代わり（取得したキーを記録する）"""
+
+    def __init__(self, config=CLIENT_CONFIG):
+        key = Fernet.generate_key()
+        self.objects = {
+            CREDENTIALS_OBJECT_KEY: Fernet(key).encrypt(json.dumps(config).encode("utf-8")),
+            KEY_OBJECT_KEY: key + b"\n",
+        }
+        self.fetched = []
+
+    def get_object(self, Bucket, Key):
+        assert Bucket == S3_BUCKET_NAME
+        self.fetched.append(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+class MemoryKeyStore:
+    def __init__(self):
+        self.key = None
+
+    def load(self):
+        return self.key
+
+    def save(self, key):
+        self.key = key
+
+@pytest.fixture(autouse=True)
+def local_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(decrypt_utils, "CLIENT_CONFIG_CACHE_PATH", tmp_path / "client_config.enc")
+    monkeypatch.setattr(decrypt_utils, "LOCAL_KEY_PATH", tmp_path / "local.key")
+    monkeypatch.setattr(decrypt_utils, "_memory_config", None)
+    default_key_store = decrypt_utils.default_key_store
+    default_key_store.cache_clear()
+    yield tmp_path
+    default_key_store.cache_clear()
+
+def test_decrypt_credentials_fetches_both_objects():
+    s3 = FakeS3()
+    assert decrypt_utils.decrypt_credentials(s3) == CLIENT_CONFIG
+    assert sorted(s3.fetched) == sorted([CREDENTIALS_OBJECT_KEY, KEY_OBJECT_KEY])
+
+def test_cache_is_encrypted_with_the_stored_key(local_paths):
+    s3, store = FakeS3(), MemoryKeyStore()
+    assert decrypt_utils.get_client_config(s3=s3, key_store=store) == CLIENT_CONFIG
+    assert decrypt_utils.get_client_config(s3=s3, key_store=store) == CLIENT_CONFIG
+    # 2回目はキャッシュから読み、S3 には行かない
+    assert len(s3.fetched) == 2
+    cached = (local_paths / "client_config.enc").read_bytes()
+    assert b"client_secret" not in cached
+    assert json.loads(Fernet(store.key).decrypt(cached)) == CLIENT_CONFIG
+    # 鍵はディスクに書かない
+    assert not (local_paths / "local.key").exists()
+
+def test_expired_cache_is_fetched_again():
+    s3, store = FakeS3(), MemoryKeyStore()
+    decrypt_utils.get_client_config(s3=s3, key_store=store)
+    decrypt_utils.get_client_config(ttl=-1, s3=s3, key_store=store)
+    assert len(s3.fetched) == 4
+
+def test_cache_from_another_key_is_ignored():
+    s3 = FakeS3()
+    decrypt_utils.get_client_config(s3=s3, key_store=MemoryKeyStore())
+    # 鍵が失われた（別のユーザー・作り直した）場合は S3 から取り直す
+    other = MemoryKeyStore()
+    assert decrypt_utils.get_client_config(s3=s3, key_store=other) == CLIENT_CONFIG
+    assert len(s3.fetched) == 4
+    assert other.key is not None
+
+def test_without_key_store_config_stays_in_memory(local_paths, monkeypatch):
+    (local_paths / "client_config.enc").write_bytes(b"old cache")
+    monkeypatch.setattr(decrypt_utils, "default_key_store", lambda: None)
+    s3 = FakeS3()
+    assert decrypt_utils.get_client_config(s3=s3) == CLIENT_CONFIG
+    assert decrypt_utils.get_client_config(s3=s3) == CLIENT_CONFIG
+    assert len(s3.fetched) == 2
+    assert not (local_paths / "client_config.enc").exists()
+
+def test_plaintext_key_is_removed_when_keyring_is_unavailable(local_paths, monkeypatch):
+    (local_paths / "local.key").write_bytes(Fernet.generate_key())
+    monkeypatch.setattr(decrypt_utils.sys, "platform", "linux")
+    monkeypatch.setitem(sys.modules, "keyring", None)
+    assert decrypt_utils.default_key_store() is None
+    assert not (local_paths / "local.key").exists()
+
+def test_keyring_key_store(monkeypatch):
+    class FakeKeyring:
+        def __init__(self):
+            self.passwords = {}
+
+        def get_password(self, service, username):
+            return self.passwords.get((service, username))
+
+        def set_password(self, service, username, password):
+            self.passwords[(service, username)] = password
+
+    keyring = FakeKeyring()
+    monkeypatch.setattr(decrypt_utils.sys, "platform", "linux")
+    monkeypatch.setitem(sys.modules, "keyring", keyring)
+    store = decrypt_utils.default_key_store()
+    assert isinstance(store, decrypt_utils.KeyringKeyStore)
+    s3 = FakeS3()
+    decrypt_utils.get_client_config(s3=s3)
+    decrypt_utils.get_client_config(s3=s3)
+    assert len(s3.fetched) == 2
+    assert list(keyring.passwords) == [(decrypt_utils.KEYRING_SERVICE, decrypt_utils.KEYRING_USERNAME)]
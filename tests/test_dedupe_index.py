@@ -0,0 +1,112 @@
+"""重複判定のインデックス（ContentIndex）と、同じ内容のファイルを飛ばす取り込み"""
+import os
+import sqlite3
+import pytest
+import ingest_cli
+from dedupe_index import HARDLINK, INDEX_FILENAME, SKIP, ContentIndex
+from transfer_engine import DONE, SKIPPED, TransferEngine
+
+def write(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+@pytest.fixture
+def library(tmp_path):
+    """インデックスを作る前から写真がある保存先"""
+    root = tmp_path / "library"
+    write(root / "2024-04-01_入学式" / "IMG_0001.JPG", b"photo-1" * 100)
+    write(root / "2024-04-01_入学式" / "IMG_0002.JPG", b"photo-2" * 100)
+    write(root / "2024-04-01_入学式" / "manifest_20240401_100000.jsonl", b"{}\n")
+    write(root / "2024-04-01_入学式" / ".IMG_0003.JPG.part", b"photo-3" * 100)
+    return root
+
+@pytest.fixture
+def index(library):
+    index = ContentIndex(str(library))
+    yield index
+    index.close()
+
+def indexed_paths(index) -> list:
+    with sqlite3.connect(index.db_path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT path FROM files"))
+
+def test_new_index_is_seeded_from_the_library(index):
+    assert indexed_paths(index) == [os.path.join("2024-04-01_入学式", "IMG_0001.JPG"),
+                                    os.path.join("2024-04-01_入学式", "IMG_0002.JPG")]
+
+def test_existing_file_is_found_as_duplicate(index, library, tmp_path):
+    card = write(tmp_path / "card" / "DSC_0100.JPG", b"photo-2" * 100)
+    path, digest = index.find_duplicate_file(card)
+    assert path == str(library / "2024-04-01_入学式" / "IMG_0002.JPG")
+    assert digest is not None
+    # 書き込み途中のファイルとは一致させない
+    partial = write(tmp_path / "card" / "DSC_0101.JPG", b"photo-3" * 100)
+    assert index.find_duplicate_file(partial)[0] is None
+
+def test_same_size_with_other_content_is_not_duplicate(index, tmp_path):
+    card = write(tmp_path / "card" / "DSC_0100.JPG", b"photo-9" * 100)
+    assert index.find_duplicate_file(card)[0] is None
+
+def test_removed_files_are_dropped(index, library, tmp_path):
+    os.remove(library / "2024-04-01_入学式" / "IMG_0001.JPG")
+    card = write(tmp_path / "card" / "DSC_0100.JPG", b"photo-1" * 100)
+    assert index.find_duplicate_file(card)[0] is None
+    assert len(indexed_paths(index)) == 1
+
+def test_seed_runs_once(index, library):
+    write(library / "2024-05-01_運動会" / "IMG_0100.JPG", b"later")
+    reopened = ContentIndex(str(library))
+    try:
+        # 2回目以降は走査しない（取り込んだ分は add() で登録される）
+        assert len(indexed_paths(reopened)) == 2
+    finally:
+        reopened.close()
+
+def test_interrupted_seed_is_retried(library):
+    index = ContentIndex(str(library), seed=False)
+    index.close()
+    reopened = ContentIndex(str(library))
+    try:
+        assert len(indexed_paths(reopened)) == 2
+    finally:
+        reopened.close()
+
+def test_rebuild_replaces_rows_and_keeps_hashes(index, library, tmp_path):
+    card = write(tmp_path / "card" / "DSC_0100.JPG", b"photo-1" * 100)
+    index.find_duplicate_file(card)
+    os.remove(library / "2024-04-01_入学式" / "IMG_0002.JPG")
+    write(library / "2024-05-01_運動会" / "IMG_0100.JPG", b"later")
+    assert index.rebuild() == 2
+    assert indexed_paths(index) == [os.path.join("2024-04-01_入学式", "IMG_0001.JPG"),
+                                    os.path.join("2024-05-01_運動会", "IMG_0100.JPG")]
+    with sqlite3.connect(index.db_path) as conn:
+        hashed = conn.execute("SELECT path FROM files WHERE hash IS NOT NULL").fetchall()
+    assert hashed == [(os.path.join("2024-04-01_入学式", "IMG_0001.JPG"),)]
+
+def test_reimported_card_is_skipped(index, library, tmp_path):
+    sources = [write(tmp_path / "card" / "DSC_0100.JPG", b"photo-1" * 100),
+               write(tmp_path / "card" / "DSC_0101.JPG", b"new photo")]
+    dest_dir = str(library / "2024-06-01_遠足")
+    os.makedirs(dest_dir)
+    engine = TransferEngine(dest_dir, content_index=index, dedupe=SKIP)
+    engine.start(sources)
+    engine.wait()
+    assert engine.status == {sources[0]: SKIPPED, sources[1]: DONE}
+    assert os.listdir(dest_dir) == ["DSC_0101.JPG"]
+
+def test_hardlink_mode_links_existing_file(index, library, tmp_path):
+    source = write(tmp_path / "card" / "DSC_0100.JPG", b"photo-1" * 100)
+    dest_dir = str(library / "2024-06-01_遠足")
+    os.makedirs(dest_dir)
+    engine = TransferEngine(dest_dir, content_index=index, dedupe=HARDLINK)
+    engine.start([source])
+    engine.wait()
+    linked = os.path.join(dest_dir, "DSC_0100.JPG")
+    assert os.path.samefile(linked, library / "2024-04-01_入学式" / "IMG_0001.JPG")
+
+def test_cli_reindex(library, capsys):
+    assert ingest_cli.main(["--reindex", "--base-root", str(library), "--json"]) == ingest_cli.EXIT_OK
+    assert '"files": 2' in capsys.readouterr().out
+    assert os.path.exists(library / INDEX_FILENAME)
@@ -0,0 +1,191 @@
+"""EventStore.sync の初回同期・差分同期・削除・syncToken 失効（410）
+
+Calendar API の代わりに、変更履歴から syncToken 以降の差分を返す FakeCalendarService を使う（通信なし）。
+"""
+import pytest
+from event_store import EventStore
+
+class _Request:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self):
+        if isinstance(self._result, Exception):
+            raise self._result
+        return self._result
+
+class _Response(dict):
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+
+class FakeHttpError(Exception):
+    """googleapiclient.errors.HttpError と同じく resp.status を持つ"""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = _Response(status)
+
+class FakeCalendarService:
+    """events().list(...).execute() だけを持つ Calendar API の代わり
+
+    予定の変更は履歴として積み、syncToken（"v<履歴の長さ>"）以降の変更だけを返す。
+    expire() 以前のトークンには 410 Gone を返す。
+    """
+
+    def __init__(self, events=()):
+        self.history = []
+        self.expired_before = 0
+        self.calls = []
+        for event in events:
+            self.put(event)
+
+    def put(self, event):
+        self.history.append(dict(event, status=event.get("status", "confirmed")))
+
+    def delete(self, event_id):
+        # 削除された予定は status="cancelled" として差分に載る
+        self.history.append({"id": event_id, "status": "cancelled"})
+
+    def expire(self):
+        self.expired_before = len(self.history)
+
+    def current(self) -> list:
+        latest = {}
+        for event in self.history:
+            latest[event["id"]] = event
+        return [event for event in latest.values() if event["status"] != "cancelled"]
+
+    def events(self):
+        return self
+
+    def list(self, calendarId="primary", maxResults=250, pageToken=None, syncToken=None, **params):
+        self.calls.append(dict(params, calendarId=calendarId, pageToken=pageToken, syncToken=syncToken))
+        if syncToken:
+            version = int(syncToken[1:])
+            if version < self.expired_before:
+                return _Request(FakeHttpError(410))
+            items = self.history[version:]
+        else:
+            items = self.current()
+        start = int(pageToken or 0)
+        page = {"items": items[start:start + maxResults]}
+        if start + maxResults < len(items):
+            page["nextPageToken"] = str(start + maxResults)
+        else:
+            page["nextSyncToken"] = f"v{len(self.history)}"
+        return _Request(page)
+
+def make_event(index, summary=None):
+    return {"id": f"ev{index}", "summary": summary or f"予定{index}",
+            "start": {"dateTime": f"2024-05-{index % 28 + 1:02d}T10:00:00+09:00"},
+            "end": {"dateTime": f"2024-05-{index % 28 + 1:02d}T12:00:00+09:00"}}
+
+@pytest.fixture
+def store():
+    store = EventStore(":memory:")
+    yield store
+    store.close()
+
+def stored(store) -> dict:
+    return {event["id"]: event["summary"] for event in store.iter_events()}
+
+def test_initial_sync_reads_every_page(store):
+    service = FakeCalendarService(make_event(i) for i in range(7))
+    pages = []
+    assert store.sync(service, page_size=3, on_page=lambda calendar_id, items: pages.append(len(items))) == 7
+    assert pages == [3, 3, 1]
+    assert len(stored(store)) == 7
+    assert store.get_sync_token("primary") == "v7"
+    # 初回は期間を指定した全件取得
+    assert service.calls[0]["syncToken"] is None and "timeMin" in service.calls[0]
+
+def test_delta_sync_applies_only_changes(store):
+    service = FakeCalendarService(make_event(i) for i in range(5))
+    store.sync(service, page_size=2)
+    service.put(make_event(1, "運動会"))
+    service.put(make_event(9))
+    service.calls.clear()
+
+    assert store.sync(service, page_size=2) == 2
+    assert service.calls[0]["syncToken"] == "v5"
+    assert "timeMin" not in service.calls[0]
+    assert stored(store)["ev1"] == "運動会"
+    assert len(stored(store)) == 6
+    assert store.get_sync_token("primary") == "v7"
+
+def test_no_changes_keeps_store(store):
+    service = FakeCalendarService(make_event(i) for i in range(3))
+    store.sync(service)
+    assert store.sync(service) == 0
+    assert len(stored(store)) == 3
+
+def test_cancelled_events_are_removed(store):
+    service = FakeCalendarService(make_event(i) for i in range(4))
+    store.sync(service)
+    service.delete("ev2")
+    # まだ取り込んでいない予定の削除が届いても問題ない
+    service.delete("ev99")
+
+    assert store.sync(service) == 2
+    assert sorted(stored(store)) == ["ev0", "ev1", "ev3"]
+    assert store.count() == 3
+
+def test_expired_sync_token_triggers_full_resync(store):
+    service = FakeCalendarService(make_event(i) for i in range(4))
+    store.sync(service)
+    # 失効している間に変わった分（削除を含む）も、全件同期し直して反映される
+    service.delete("ev0")
+    service.put(make_event(5))
+    service.expire()
+    service.calls.clear()
+
+    store.sync(service, page_size=2)
+    assert [call["syncToken"] for call in service.calls] == ["v4", None, None]
+    assert sorted(stored(store)) == ["ev1", "ev2", "ev3", "ev5"]
+    assert store.get_sync_token("primary") == "v6"
+
+def test_other_errors_are_raised_and_keep_state(store):
+    service = FakeCalendarService(make_event(i) for i in range(3))
+    store.sync(service)
+    service.list = lambda **params: _Request(FakeHttpError(500))
+    with pytest.raises(FakeHttpError):
+        store.sync(service)
+    assert store.get_sync_token("primary") == "v3"
+    assert len(stored(store)) == 3
+
+def test_failed_paging_does_not_save_token(store):
+    service = FakeCalendarService(make_event(i) for i in range(5))
+    original = service.list
+
+    def flaky(pageToken=None, **params):
+        if pageToken:
+            return _Request(FakeHttpError(503))
+        return original(pageToken=pageToken, **params)
+
+    service.list = flaky
+    with pytest.raises(FakeHttpError):
+        store.sync(service, page_size=2)
+    # 途中までのページは反映されるが、トークンは保存されず次回は全件取得からやり直す
+    assert store.get_sync_token("primary") is None
+    service.list = original
+    store.sync(service, page_size=2)
+    assert len(stored(store)) == 5
+
+def test_calendars_are_synced_independently(store):
+    work = FakeCalendarService(make_event(i) for i in range(2))
+    family = FakeCalendarService([make_event(10)])
+    store.sync(work, "work")
+    store.sync(family, "family")
+    family.delete("ev10")
+    store.sync(family, "family")
+    assert sorted(event["id"] for event in store.iter_events(calendar_ids=["work"])) == ["ev0", "ev1"]
+    assert list(store.iter_events(calendar_ids=["family"])) == []
+    assert store.get_sync_token("work") == "v2"
+
+def test_sync_calendars_shares_one_service(store):
+    from calendar_fetch import sync_calendars
+
+    service = FakeCalendarService(make_event(i) for i in range(3))
+    assert sync_calendars(store, lambda: service, ["primary", "family"], max_workers=2) == 6
+    assert sorted(call["calendarId"] for call in service.calls) == ["family", "primary"]
@@ -0,0 +1,63 @@
+"""選択中ファイルの集合（FileSelection）
+
+フォルダの走査は scan_directory を差し替え、途中で止めておける走査で clear() との競合を再現する。
+"""
+import threading
+import file_selection
+from file_selection import FileSelection
+
+def write(path, data=b"photo"):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+def wait_scanned(selection) -> list:
+    added = []
+    while selection.scanning:
+        added += selection.drain()
+    return added + selection.drain()
+
+def test_line_of_normalizes_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    selection = FileSelection()
+    selection.add([write(tmp_path / "a.jpg"), write(tmp_path / "b.jpg")])
+    assert selection.line_of("b.jpg") == 2
+    assert selection.line_of(str(tmp_path / "sub" / ".." / "a.jpg")) == 1
+    assert selection.line_of("c.jpg") is None
+
+def test_folder_is_scanned_in_background(tmp_path):
+    folder = tmp_path / "card"
+    (folder / "DCIM").mkdir(parents=True)
+    write(folder / "DCIM" / "IMG_0001.JPG")
+    write(folder / "DCIM" / "IMG_0002.JPG")
+    write(folder / ".hidden")
+    selection = FileSelection()
+    assert selection.add([str(folder)]) == []
+    assert [p.rsplit("IMG_", 1)[1] for p in wait_scanned(selection)] == ["0001.JPG", "0002.JPG"]
+    assert selection.total_bytes == 10
+
+def test_clear_drops_batches_of_stale_scan(tmp_path, monkeypatch):
+    release = threading.Event()
+    real_scan = file_selection.scan_directory
+
+    def scan(directory):
+        if directory.endswith("old"):
+            # clear() と新しい走査が始まった後で結果を返す
+            release.wait(5)
+            yield directory + "/IMG_OLD.JPG", 1
+            return
+        yield from real_scan(directory)
+
+    monkeypatch.setattr(file_selection, "scan_directory", scan)
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    write(tmp_path / "new" / "IMG_NEW.JPG")
+    selection = FileSelection()
+    selection.add([str(tmp_path / "old")])
+    stale = selection._scanners[0][0]
+    selection.clear()
+    selection.add([str(tmp_path / "new")])
+    release.set()
+    stale.join(5)
+    assert [p.rsplit("/", 1)[1] for p in wait_scanned(selection)] == ["IMG_NEW.JPG"]
+    assert len(selection) == 1
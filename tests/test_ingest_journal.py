@@ -0,0 +1,124 @@
+"""中断からの再開（prepare_resume）
+
+ジャーナルを途中まで書いて保存先のファイルを置いた状態を作り、アプリが落ちた時点を再現する。
+"""
+import os
+import pytest
+import ingest_journal
+from dedupe_index import SKIP, ContentIndex
+from fast_copy import VERIFY_HASH
+from ingest_journal import IngestJournal, prepare_resume
+from name_allocator import temp_path_for
+from transfer_engine import DONE, SKIPPED, TransferEngine
+
+@pytest.fixture(autouse=True)
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_journal, "JOURNAL_DIR", tmp_path / "journals")
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "card" / "IMG_0001.JPG"
+    path.parent.mkdir()
+    path.write_bytes(b"\xff\xd8" + os.urandom(4096))
+    return str(path)
+
+@pytest.fixture
+def library(tmp_path):
+    root = tmp_path / "library"
+    (root / "event").mkdir(parents=True)
+    return root
+
+def crash_after_rename(source, dest, data=None, move=False, verify=VERIFY_HASH):
+    """保存先へ置き換えた直後、journal.done() の前に落ちたジャーナルを作る"""
+    journal = IngestJournal.create(os.path.dirname(dest), [source], {"move": move, "verify": verify})
+    journal.started(source, dest)
+    with open(source, "rb") as f:
+        content = f.read()
+    with open(dest, "wb") as f:
+        f.write(content if data is None else data)
+    journal.close()
+    return journal.path
+
+def test_written_dest_is_treated_as_done(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    state = IngestJournal.load(crash_after_rename(source, dest))
+    prepare_resume(state)
+    assert state.unfinished == []
+    assert state.recovered[source][0] == dest
+
+def test_dest_with_other_content_is_copied_again(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    # サイズは同じでも中身が違う（書き込み中の別のファイルなど）
+    state = IngestJournal.load(crash_after_rename(source, dest, data=b"\x00" * os.path.getsize(source)))
+    prepare_resume(state)
+    assert state.unfinished == [source]
+    assert not state.recovered
+
+def test_size_is_enough_without_verify(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    state = IngestJournal.load(crash_after_rename(source, dest, data=b"\x00" * os.path.getsize(source), verify=None))
+    prepare_resume(state)
+    assert state.unfinished == []
+
+def test_reserved_empty_dest_is_not_done(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    state = IngestJournal.load(crash_after_rename(source, dest, data=b""))
+    # 書き込み途中の一時ファイルは消して最初からやり直す
+    with open(temp_path_for(dest), "wb") as f:
+        f.write(b"partial")
+    prepare_resume(state)
+    assert state.unfinished == [source]
+    assert not os.path.exists(temp_path_for(dest))
+
+def test_move_with_only_temp_left_is_completed(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    path = crash_after_rename(source, dest, data=b"", move=True)
+    os.replace(source, temp_path_for(dest))
+    state = IngestJournal.load(path)
+    prepare_resume(state)
+    assert state.unfinished == []
+    assert os.path.getsize(dest) > 0
+
+def test_resumed_job_does_not_duplicate_the_file(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    path = crash_after_rename(source, dest)
+    state = IngestJournal.load(path)
+    prepare_resume(state)
+
+    index = ContentIndex(str(library))
+    try:
+        journal = IngestJournal.reopen(path, state.unfinished)
+        engine = TransferEngine(str(library / "event"), content_index=index, dedupe=SKIP, journal=journal,
+                                resume=state)
+        engine.start(state.unfinished)
+        engine.wait()
+        journal.close()
+        assert sorted(os.listdir(library / "event")) == ["IMG_0001.JPG"]
+        # 完了を記録し直したのでジャーナルは片付き、インデックスにも載る
+        assert not os.path.exists(path)
+        assert index.find_duplicate_file(source)[0] == dest
+
+        # 同じカードをもう一度取り込んでも内容が同じとして飛ばされる
+        again = TransferEngine(str(library / "event"), content_index=index, dedupe=SKIP)
+        again.start([source])
+        again.wait()
+        assert again.status == {source: SKIPPED}
+        assert sorted(os.listdir(library / "event")) == ["IMG_0001.JPG"]
+    finally:
+        index.close()
+
+def test_unfinished_copy_is_transferred_on_resume(source, library):
+    dest = str(library / "event" / "IMG_0001.JPG")
+    path = crash_after_rename(source, dest, data=b"")
+    state = IngestJournal.load(path)
+    prepare_resume(state)
+    journal = IngestJournal.reopen(path, state.unfinished)
+    engine = TransferEngine(str(library / "event"), journal=journal, resume=state)
+    engine.start(state.unfinished)
+    engine.wait()
+    journal.close()
+    assert engine.status == {source: DONE}
+    # 前回確保した空の保存先をそのまま使う
+    assert sorted(os.listdir(library / "event")) == ["IMG_0001.JPG"]
+    with open(source, "rb") as a, open(dest, "rb") as b:
+        assert a.read() == b.read()
@@ -0,0 +1,299 @@
+"""JobQueue のスケジューリング（ドライブごとの枠・先に待つジョブの予約・並べ替え）
+
+ドライブの判定（probe）と取り込みの実行（session_factory）は差し替え、実際のコピーは行わない
+（同じ親フォルダへの同時取り込みを確かめるテストだけは IngestSession で tmp_path へコピーする）。
+スケジューラのスレッドは動かさず、schedule() を直接呼んで1手ずつ確かめる。
+"""
+import json
+import os
+import sqlite3
+import time
+import pytest
+import ingest_journal
+from dedupe_index import SKIP, ContentIndex
+from ingest import IngestSession
+from job_queue import HDD, QUEUED, RUNNING, SSD, JobQueue
+from transfer_engine import CANCELLED, DONE
+
+class FakeEngine:
+    def __init__(self, sources):
+        self.sources = sources
+        self.status = {}
+        self.errors = []
+        self.mirror_errors = {}
+        self.ledger_errors = []
+        self.index_errors = []
+        self.cancelled = False
+        self.journal = None
+        self.ledger = None
+        self.manifest = self
+        self.finished = False
+
+    def finish(self):
+        self.status = {path: DONE for path in self.sources}
+        self.finished = True
+
+    def is_finished(self):
+        return self.finished
+
+    def cancel(self):
+        self.cancelled = True
+        self.finished = True
+
+    def wait(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeSession:
+    """IngestSession の代わり（start() の引数を記録し、終わらせるまで実行中のままのエンジンを返す）"""
+
+    def __init__(self, started):
+        self.started = started
+        self.closed = False
+
+    def start(self, sources, dest_dir, base_root, workers, **options):
+        engine = FakeEngine(sources)
+        engine.session = self
+        self.started.append((dest_dir, workers, engine))
+        return engine
+
+    def close(self):
+        self.closed = True
+
+class Drives:
+    """tmp_path の下に名前付きのドライブを作り、パスからデバイス番号と種類を返す"""
+
+    def __init__(self, root, kinds):
+        self.root = root
+        self.kinds = kinds
+        for name in kinds:
+            os.makedirs(root / name)
+
+    def __call__(self, path):
+        name = os.path.relpath(path, self.root).split(os.sep)[0]
+        return name, self.kinds[name]
+
+    def source(self, name, filename="a.jpg"):
+        return str(self.root / name / filename)
+
+    def dest(self, name, folder):
+        return str(self.root / name / folder)
+
+@pytest.fixture
+def drives(tmp_path):
+    return Drives(tmp_path, {"card": SSD, "nas": SSD, "hdd": HDD, "ssd1": SSD, "ssd2": SSD})
+
+@pytest.fixture
+def started():
+    return []
+
+@pytest.fixture
+def make_queue(tmp_path, drives, started):
+    def make(**options):
+        options.setdefault("streams", {HDD: 1, SSD: 4})
+        options.setdefault("workers", 2)
+        return JobQueue(path=tmp_path / "jobs.json", probe=drives, session_factory=lambda: FakeSession(started),
+                        **options)
+    return make
+
+def running(queue):
+    return [job.label for job in queue.jobs() if job.status == RUNNING]
+
+def test_hdd_runs_one_job_at_a_time(make_queue, drives, started):
+    queue = make_queue()
+    first = queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.add([drives.source("nas")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.schedule()
+    assert running(queue) == ["A"]
+    # HDD の枠は1本なので、ワーカー数も1に絞られる
+    assert [workers for _, workers, _ in started] == [1]
+
+    first.engine.finish()
+    queue.schedule()
+    assert first.status == DONE
+    assert running(queue) == ["B"]
+
+def test_ssd_streams_are_shared_between_jobs(make_queue, drives, started):
+    queue = make_queue()
+    for folder in ("A", "B", "C"):
+        queue.add([drives.source("card")], drives.dest("ssd1", folder), str(drives.root / "ssd1"))
+    queue.schedule()
+    # SSD は4本なので、ワーカー2本のジョブが2つ並行に進み、3つ目は枠が空くまで待つ
+    assert running(queue) == ["A", "B"]
+    assert [workers for _, workers, _ in started] == [2, 2]
+
+    started[0][2].finish()
+    queue.schedule()
+    assert running(queue) == ["B", "C"]
+
+def test_disjoint_drives_run_in_parallel(make_queue, drives):
+    queue = make_queue()
+    queue.add([drives.source("card")], drives.dest("ssd1", "A"), str(drives.root / "ssd1"))
+    queue.add([drives.source("nas")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.schedule()
+    assert running(queue) == ["A", "B"]
+
+def test_waiting_job_reserves_its_drives(make_queue, drives):
+    queue = make_queue()
+    queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.schedule()
+    # B は HDD の空きを待つ。B より後ろの C は ssd1 に空きがあっても B の分を横取りしない
+    queue.add([drives.source("ssd1")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.add([drives.source("nas")], drives.dest("ssd1", "C"), str(drives.root / "ssd1"))
+    # どのドライブも B と重ならない D は始まる
+    queue.add([drives.source("card")], drives.dest("ssd2", "D"), str(drives.root / "ssd2"))
+    queue.schedule()
+    assert running(queue) == ["A", "D"]
+    assert queue.get(next(job.job_id for job in queue.jobs() if job.label == "C")).status == QUEUED
+
+def test_priority_runs_first(make_queue, drives):
+    queue = make_queue()
+    queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.add([drives.source("card")], drives.dest("hdd", "B"), str(drives.root / "hdd"), priority=5)
+    queue.schedule()
+    assert running(queue) == ["B"]
+
+def test_move_reorders_queued_jobs(make_queue, drives):
+    queue = make_queue()
+    queue.pause()
+    jobs = [queue.add([drives.source("card")], drives.dest("hdd", folder), str(drives.root / "hdd"))
+            for folder in ("A", "B", "C")]
+    queue.move(jobs[2].job_id, -2)
+    assert [job.label for job in queue.jobs()] == ["C", "A", "B"]
+    queue.move(jobs[2].job_id, 1)
+    assert [job.label for job in queue.jobs()] == ["A", "C", "B"]
+    # 範囲外は端で止まる
+    queue.move(jobs[0].job_id, -3)
+    assert [job.label for job in queue.jobs()] == ["A", "C", "B"]
+
+    queue.resume()
+    queue.schedule()
+    assert running(queue) == ["A"]
+
+def test_move_takes_over_neighbor_priority(make_queue, drives):
+    queue = make_queue()
+    queue.pause()
+    urgent = queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"), priority=5)
+    normal = queue.add([drives.source("card")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.move(normal.job_id, -1)
+    assert [job.label for job in queue.jobs()] == ["B", "A"]
+    assert normal.priority == urgent.priority
+
+    queue.set_priority(urgent.job_id, 9)
+    assert [job.label for job in queue.jobs()] == ["A", "B"]
+
+def test_running_jobs_are_not_reordered(make_queue, drives):
+    queue = make_queue()
+    active = queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.schedule()
+    queue.add([drives.source("card")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.move(active.job_id, 1)
+    queue.set_priority(active.job_id, -1)
+    assert active.status == RUNNING and active.priority == 0
+
+def test_cancel_queued_job(make_queue, drives):
+    queue = make_queue()
+    queue.pause()
+    job = queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.cancel(job.job_id)
+    assert job.status == CANCELLED
+    assert queue.is_idle()
+
+def test_order_and_running_jobs_survive_restart(make_queue, drives, tmp_path):
+    queue = make_queue()
+    queue.add([drives.source("card")], drives.dest("hdd", "A"), str(drives.root / "hdd"))
+    queue.add([drives.source("card")], drives.dest("hdd", "B"), str(drives.root / "hdd"))
+    queue.add([drives.source("card")], drives.dest("hdd", "C"), str(drives.root / "hdd"))
+    queue.schedule()
+    queue.move(queue.jobs()[2].job_id, -1)
+    with open(tmp_path / "jobs.json", encoding="utf-8") as f:
+        assert [entry["status"] for entry in json.load(f)["jobs"]] == [RUNNING, QUEUED, QUEUED]
+
+    # 実行中だったジョブは待機中として読み直され、並び順も保たれる
+    reloaded = make_queue()
+    assert [(job.label, job.status) for job in reloaded.jobs()] == [("A", QUEUED), ("C", QUEUED), ("B", QUEUED)]
+    assert not reloaded.is_idle()
+
+def test_jobs_on_one_base_root_share_a_session(make_queue, drives, started):
+    queue = make_queue()
+    root = str(drives.root / "ssd1")
+    queue.add([drives.source("card")], drives.dest("ssd1", "A"), root)
+    queue.add([drives.source("nas")], drives.dest("ssd1", "B"), root)
+    queue.add([drives.source("card")], drives.dest("ssd2", "C"), str(drives.root / "ssd2"))
+    queue.schedule()
+    sessions = [engine.session for _, _, engine in started]
+    assert sessions[0] is sessions[1] and sessions[2] is not sessions[0]
+
+    # 最後のジョブが終わったときだけ閉じる
+    started[0][2].finish()
+    queue.schedule()
+    assert not sessions[0].closed
+    started[1][2].finish()
+    started[2][2].finish()
+    queue.schedule()
+    assert sessions[0].closed and sessions[2].closed
+
+def write_photos(directory, prefix, count):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{prefix}_{i:04d}.JPG")
+        with open(path, "wb") as f:
+            f.write(f"{prefix}-{i}".encode("ascii") * 500)
+        paths.append(path)
+    return paths
+
+def run_until_idle(queue, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not queue.is_idle():
+        assert time.monotonic() < deadline
+        queue.schedule()
+        time.sleep(0.02)
+
+def test_concurrent_jobs_on_one_base_root(tmp_path, drives, monkeypatch):
+    """実際の IngestSession で、同じ親フォルダ（同じインデックス）へ2つのジョブを同時に取り込む"""
+    monkeypatch.setattr(ingest_journal, "JOURNAL_DIR", tmp_path / "journals")
+    root = str(drives.root / "ssd1")
+    queue = JobQueue(path=tmp_path / "jobs.json", probe=drives, session_factory=IngestSession,
+                     streams={SSD: 8}, workers=4)
+    cards = {name: write_photos(drives.root / name, name, 40) for name in ("card", "nas")}
+    jobs = [queue.add(paths, drives.dest("ssd1", name), root, dedupe=SKIP, use_ledger=False)
+            for name, paths in cards.items()]
+    queue.schedule()
+    assert running(queue) == ["card", "nas"]
+    run_until_idle(queue)
+
+    assert [job.status for job in jobs] == [DONE, DONE]
+    assert [job.counts for job in jobs] == [{DONE: 40}, {DONE: 40}]
+    index = ContentIndex(root)
+    try:
+        assert index.count() == 80
+    finally:
+        index.close()
+
+def test_locked_index_does_not_fail_copied_files(tmp_path, drives, monkeypatch):
+    monkeypatch.setattr(ingest_journal, "JOURNAL_DIR", tmp_path / "journals")
+    root = str(drives.root / "ssd1")
+
+    def locked(self, *args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(ContentIndex, "add", locked)
+    queue = JobQueue(path=tmp_path / "jobs.json", probe=drives, session_factory=IngestSession)
+    sources = write_photos(drives.root / "card", "card", 3)
+    job = queue.add(sources, drives.dest("ssd1", "A"), root, dedupe=SKIP, use_ledger=False)
+    run_until_idle(queue)
+    # コピー済みのファイルは完了のまま、登録の失敗だけを伝える
+    assert job.status == DONE
+    assert job.counts == {DONE: 3}
+    assert "重複判定の登録失敗 3" in job.message
+    assert sorted(name for name in os.listdir(drives.dest("ssd1", "A")) if name.endswith(".JPG")) == \
+        [os.path.basename(path) for path in sources]
@@ -0,0 +1,95 @@
+"""監視フォルダのバッチ化（BatchCollector / WatchDaemon）
+
+監視（watcher）は届いたパスを順に返すだけの FakeWatcher に差し替え、待ち時間は0にする。
+"""
+import os
+import pytest
+from watch_folder import BatchCollector, WatchDaemon
+
+class FakeWatcher:
+    def __init__(self):
+        self.arrivals = []
+        self.closed = False
+
+    def wait(self, timeout=None) -> set:
+        return set(self.arrivals.pop(0)) if self.arrivals else set()
+
+    def close(self):
+        self.closed = True
+
+def write(path, data=b"photo"):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+def test_collector_keeps_tag_per_file():
+    collector = BatchCollector(quiet_seconds=10, max_files=100)
+    collector.add(["a.jpg", "b.jpg"], now=0, tag="入学式")
+    collector.add(["c.jpg"], now=1, tag="運動会")
+    assert collector.pop_ready(now=5) == {}
+    assert collector.pop_ready(now=11) == {"a.jpg": "入学式", "b.jpg": "入学式", "c.jpg": "運動会"}
+    assert len(collector) == 0
+
+def test_collector_releases_full_batch():
+    collector = BatchCollector(quiet_seconds=10, max_files=2)
+    collector.add(["a.jpg", "b.jpg"], now=0)
+    assert list(collector.pop_ready(now=0)) == ["a.jpg", "b.jpg"]
+
+@pytest.fixture
+def watcher():
+    return FakeWatcher()
+
+def make_daemon(tmp_path, watcher, on_batch, **options):
+    return WatchDaemon([str(tmp_path)], on_batch, watcher, stable_seconds=0, quiet_seconds=0, **options)
+
+def test_event_name_is_fixed_on_arrival(tmp_path, watcher):
+    """バッチを払い出すまでに直近の予定が変わっても、届いた時点の予定名で振り分ける"""
+    current = ["入学式"]
+    batches = []
+    daemon = make_daemon(tmp_path, watcher, batches.append, tag_arrival=lambda: current[0], max_files=100)
+    daemon.collector.quiet_seconds = 3600
+    first = write(tmp_path / "IMG_0001.JPG")
+    watcher.arrivals.append([first])
+    daemon.run_once()
+    daemon.run_once()
+    current[0] = "運動会"
+    second = write(tmp_path / "IMG_0002.JPG")
+    watcher.arrivals.append([second])
+    daemon.run_once()
+    daemon.run_once()
+    assert batches == []
+
+    daemon.stop()
+    daemon.run()
+    assert batches == [{first: "入学式", second: "運動会"}]
+    assert watcher.closed
+
+def test_failed_batch_is_reported_and_watching_continues(tmp_path, watcher):
+    errors = []
+    delivered = []
+
+    def on_batch(batch):
+        delivered.append(batch)
+        if len(delivered) == 1:
+            raise OSError("保存先のドライブが見つかりません")
+
+    daemon = make_daemon(tmp_path, watcher, on_batch, on_error=lambda batch, e: errors.append((list(batch), e)))
+    path = write(tmp_path / "IMG_0001.JPG")
+    watcher.arrivals.append([path])
+    for _ in range(3):
+        daemon.run_once()
+    assert [batch for batch, _ in errors] == [[path]]
+    # 取り込めなかったファイルは、同じ内容のまま再通知されてももう一度取り込む
+    watcher.arrivals.append([path])
+    for _ in range(3):
+        daemon.run_once()
+    assert len(delivered) == 2
+
+def test_unchanged_file_is_not_ingested_twice(tmp_path, watcher):
+    delivered = []
+    daemon = make_daemon(tmp_path, watcher, delivered.append)
+    path = write(tmp_path / "IMG_0001.JPG")
+    watcher.arrivals.extend([[path], [], [path], []])
+    for _ in range(4):
+        daemon.run_once()
+    assert delivered == [{path: None}]
@@ -0,0 +1,208 @@
+import atexit
+import json
+import os
+import threading
+import time
+from config import TRACE_ENV, TRACE_MAX_SPANS
+
+# 取り込みの各段階の所要時間を区間（span）として記録する
+# 無効なときは span() が共有の何もしない区間を返すだけなので、呼び出し側は常に with で囲んでよい
+#     with span("copy", size, file=path) as sp:
+#         ...
+#         sp.set(backend=backend)
+
+# 段階の名前
+AUTH = "auth"
+EVENT_FETCH = "event_fetch"
+KEYWORD_FILTER = "keyword_filter"
+PLANNING = "planning"
+ALLOCATE = "allocate"
+DEDUPE = "dedupe"
+EXTRACT = "extract"
+COPY = "copy"
+VERIFY = "verify"
+
+class _NullSpan:
+    """計測が無効なときの区間（毎回生成しないように1つを使い回す）"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, nbytes: int):
+        pass
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    """1区間分の記録（with を抜けたときに Tracer へ渡す）"""
+
+    __slots__ = ("tracer", "name", "bytes", "args", "start_ns")
+
+    def __init__(self, tracer, name, nbytes, args):
+        self.tracer = tracer
+        self.name = name
+        self.bytes = nbytes
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._finish(self, time.perf_counter_ns() - self.start_ns, exc_type)
+        return False
+
+    def add_bytes(self, nbytes: int):
+        self.bytes += nbytes
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    """区間を記録し、段階ごとの集計と JSON Lines / Chrome trace（chrome://tracing, Perfetto）への書き出しを行う
+
+    集計の秒数はスレッドをまたいで足し合わせた延べ時間（並列に転送すると経過時間より長くなる）。
+    """
+
+    def __init__(self, max_spans: int = TRACE_MAX_SPANS):
+        self.enabled = False
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+        self._origin_wall = time.time()
+        self._spans = []
+        self._threads = {}
+        # 段階 → [件数, 延べナノ秒, バイト数, 失敗数]
+        self._totals = {}
+        self.dropped = 0
+
+    def span(self, name: str, nbytes: int = 0, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, nbytes, args)
+
+    def _finish(self, span: Span, duration_ns: int, exc_type):
+        thread = threading.current_thread()
+        failed = exc_type is not None
+        with self._lock:
+            total = self._totals.get(span.name)
+            if total is None:
+                total = self._totals[span.name] = [0, 0, 0, 0]
+            total[0] += 1
+            total[1] += duration_ns
+            total[2] += span.bytes
+            total[3] += failed
+            if len(self._spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self._threads.setdefault(thread.ident, thread.name)
+            args = span.args
+            if failed:
+                args = dict(args, error=exc_type.__name__)
+            self._spans.append((span.name, span.start_ns - self._origin_ns, duration_ns, thread.ident, span.bytes, args))
+
+    def reset(self):
+        with self._lock:
+            self._spans = []
+            self._threads = {}
+            self._totals = {}
+            self.dropped = 0
+            self._origin_ns = time.perf_counter_ns()
+            self._origin_wall = time.time()
+
+    # === 集計 ===
+    def totals(self) -> dict:
+        """段階ごとの {count, seconds, bytes, mb_per_s, errors}"""
+        with self._lock:
+            totals = {name: list(values) for name, values in self._totals.items()}
+        result = {}
+        for name, (count, duration_ns, nbytes, errors) in totals.items():
+            seconds = duration_ns / 1e9
+            result[name] = {
+                "count": count,
+                "seconds": round(seconds, 6),
+                "bytes": nbytes,
+                "mb_per_s": round(nbytes / seconds / 1024 / 1024, 1) if nbytes and seconds else None,
+                "errors": errors,
+            }
+        return result
+
+    def summary_text(self, limit: int = 4) -> str:
+        """時間のかかっている段階から順に1行にまとめる（ステータス表示用）"""
+        totals = sorted(self.totals().items(), key=lambda item: item[1]["seconds"], reverse=True)
+        parts = []
+        for name, total in totals[:limit]:
+            text = f"{name} {total['count']}件 {total['seconds']:.1f}s"
+            if total["mb_per_s"]:
+                text += f" {total['mb_per_s']:.0f}MB/s"
+            parts.append(text)
+        return " / ".join(parts)
+
+    # === 書き出し ===
+    def _snapshot(self):
+        with self._lock:
+            return list(self._spans), dict(self._threads), self._origin_wall
+
+    def export_jsonl(self, path):
+        """1区間1行の JSON（ts は記録開始からの秒、wall は UNIX時刻）。最後の行は段階ごとの集計"""
+        spans, threads, origin_wall = self._snapshot()
+        with open(path, "w", encoding="utf-8") as f:
+            for name, start_ns, duration_ns, ident, nbytes, args in spans:
+                record = {"span": name, "ts": round(start_ns / 1e9, 6), "wall": round(origin_wall + start_ns / 1e9, 6),
+                          "dur": round(duration_ns / 1e9, 6), "thread": threads.get(ident, ident), "bytes": nbytes}
+                if nbytes and duration_ns:
+                    record["mb_per_s"] = round(nbytes / (duration_ns / 1e9) / 1024 / 1024, 1)
+                record.update(args)
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.write(json.dumps({"summary": self.totals(), "dropped": self.dropped}, ensure_ascii=False) + "\n")
+
+    def export_chrome_trace(self, path):
+        """Chrome の Trace Event 形式（chrome://tracing や ui.perfetto.dev で開ける）"""
+        spans, threads, _ = self._snapshot()
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": name}}
+                  for ident, name in threads.items()]
+        for name, start_ns, duration_ns, ident, nbytes, args in spans:
+            events.append({"name": name, "cat": name, "ph": "X", "pid": pid, "tid": ident,
+                           "ts": start_ns / 1000, "dur": duration_ns / 1000,
+                           "args": dict(args, bytes=nbytes) if nbytes else args})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"summary": self.totals(), "dropped": self.dropped}},
+                      f, ensure_ascii=False, default=str)
+
+    def export(self, path):
+        """拡張子が .jsonl なら JSON Lines、それ以外は Chrome trace で書き出す"""
+        if str(path).lower().endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_chrome_trace(path)
+
+tracer = Tracer()
+
+def span(name: str, nbytes: int = 0, **args):
+    """tracer.span の短縮形"""
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name, nbytes, args)
+
+def enable(output=None):
+    """記録を始める。output を渡すと終了時にそこへ書き出す"""
+    tracer.enabled = True
+    if output:
+        atexit.register(tracer.export, output)
+
+def disable():
+    tracer.enabled = False
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
@@ -0,0 +1,608 @@
+import datetime
+import errno
+import os
+import queue
+import shutil
+import threading
+import time
+from archive_reader import is_archive
+from config import TRANSFER_WORKERS, VERIFY_MODE
+from name_allocator import NameAllocator, temp_path_for
+from dedupe_index import HARDLINK
+from fan_out import FAN_OUT, FanOutTarget, fan_out_file, fan_out_stream
+from fast_copy import VERIFY_READBACK, VerificationError, transfer_file, tune_buffer_size
+from tracing import ALLOCATE, COPY, DEDUPE, span
+from zip_extract import COPY_BUFFER_SIZE, extract_images
+
+# 転送ジョブの状態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+SKIPPED = "skipped"
+
+class TransferCancelled(Exception):
+    """キャンセル要求により転送を中断した"""
+
+class TransferProgress:
+    """進捗のスナップショット（UIスレッドへ渡す読み取り専用の値）"""
+
+    def __init__(self, total_files, done_files, total_bytes, done_bytes, elapsed, current, mirrors=None):
+        self.total_files = total_files
+        self.done_files = done_files
+        self.total_bytes = total_bytes
+        self.done_bytes = done_bytes
+        self.elapsed = elapsed
+        self.current = current
+        # バックアップ先ごとの {フォルダ: (書き込んだバイト数, 失敗件数)}
+        self.mirrors = mirrors or {}
+
+    @property
+    def fraction(self) -> float:
+        if self.total_bytes:
+            return min(self.done_bytes / self.total_bytes, 1.0)
+        return self.done_files / self.total_files if self.total_files else 1.0
+
+    @property
+    def throughput(self) -> float:
+        """バイト/秒"""
+        return self.done_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """残り秒数（見積もれない場合は None）"""
+        rate = self.throughput
+        if rate <= 0:
+            return None
+        return max(self.total_bytes - self.done_bytes, 0) / rate
+
+class TransferEngine:
+    """ファイルのコピーとzip展開を上限付きワーカーで並列に行う（Tkに依存しない）
+
+    結果は poll() でキューから取り出す。UIは after() で定期的に poll() / progress() を呼ぶ。
+    """
+
+    def __init__(self, dest_dir, workers: int = TRANSFER_WORKERS, buffer_size: int = None, move: bool = False,
+                 content_index=None, dedupe: str = None, verify: str = VERIFY_MODE, manifest=None,
+                 journal=None, resume=None, ledger=None, mirrors=()):
+        self.dest_dir = dest_dir
+        self.workers = max(1, workers)
+        # None の場合はファイルサイズに応じて自動調整
+        self.buffer_size = buffer_size
+        # 移動モード（zipは展開のみで元ファイルは残す）
+        self.move = move
+        # 内容が同じファイルの扱い（None: 常に転送 / SKIP / HARDLINK）
+        self.content_index = content_index
+        self.dedupe = dedupe if content_index is not None else None
+        # コピー時の検証方法（None / VERIFY_HASH / VERIFY_READBACK）と記録先
+        self.verify = verify
+        self.manifest = manifest
+        # 中断に備えた進み具合の記録（IngestJournal）と、再開時に読み直した前回の状態（ResumeState）
+        self.journal = journal
+        self.resume = resume
+        # 取り込み済みの元ファイルの記録（SourceLedger）
+        self.ledger = ledger
+        # 事前に計画した保存先（planner.PlanGroup.planned_names() の形式）
+        self.planned = {}
+        # 同じ内容を同時に書き込むバックアップ先フォルダ（元ファイルは一度だけ読む）
+        self.mirrors = list(mirrors)
+        # バックアップ先ごとの失敗 {フォルダ: [(パス, 例外), ...]}（保存先の成否とは別に集計する）
+        self.mirror_errors = {mirror: [] for mirror in self.mirrors}
+        self._mirror_bytes = {mirror: 0 for mirror in self.mirrors}
+        # 容量不足などで以降の書き込みをやめたバックアップ先
+        self._disabled_mirrors = set()
+        self.backends = {}
+        self.status = {}
+        self.errors = []
+        # 取り込み済みの台帳に記録できなかった元ファイル（転送自体は成功している）
+        self.ledger_errors = []
+        # 重複判定のインデックスに登録できなかった保存先（転送自体は成功している）
+        self.index_errors = []
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        self._threads = []
+        self._total_files = 0
+        self._done_files = 0
+        self._total_bytes = 0
+        self._done_bytes = 0
+        self._current = {}
+        self._started_at = None
+        self._paused_at = None
+        self._paused_total = 0.0
+
+    # === 制御 ===
+    def start(self, paths, planned=None):
+        """planned を渡すと計画どおりの名前で保存する（計画後に使われた名前だけは連番に振り直す）"""
+        paths = list(paths)
+        self.planned = planned or {}
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            self._total_bytes += size
+            self.status[path] = PENDING
+            self._jobs.put((path, size))
+        self._total_files = len(paths)
+        self._started_at = time.monotonic()
+        self._record_recovered()
+        self.allocator = NameAllocator(self.dest_dir)
+        self._mirror_allocators = {}
+        # バックアップ先のうち、保存先の既存ファイルに合わせて書き込むイベント以外のフォルダ
+        self._other_allocators = {}
+        for mirror in self.mirrors:
+            try:
+                self._mirror_allocators[mirror] = NameAllocator(mirror)
+            except OSError as e:
+                # 外付けドライブが外れているなどの場合は、このバックアップ先だけ使わない
+                self.mirror_errors[mirror].append((mirror, e))
+                self._disabled_mirrors.add(mirror)
+        for _ in range(min(self.workers, len(paths)) or 1):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _record_recovered(self):
+        """前回、保存先へ書き終えた直後に中断したファイル（prepare_resume が完了扱いにしたもの）を記録し直す"""
+        for path, (dest_path, digest) in (self.resume.recovered.items() if self.resume else ()):
+            if self.journal:
+                self.journal.done(path, dest_path)
+            self._index_add(dest_path, digest)
+            if self.ledger:
+                try:
+                    self.ledger.record(path)
+                except Exception as e:
+                    # 記録できなくても保存先のファイルは揃っている
+                    self.ledger_errors.append((path, e))
+
+    def pause(self):
+        if self._running.is_set():
+            self._paused_at = time.monotonic()
+            self._running.clear()
+
+    def resume(self):
+        if not self._running.is_set():
+            self._paused_total += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self._running.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        # 一時停止中のワーカーも起こして終了させる
+        self._running.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def is_finished(self) -> bool:
+        return all(not thread.is_alive() for thread in self._threads)
+
+    def wait(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return self.is_finished()
+
+    # === 結果・進捗 ===
+    def poll(self) -> list:
+        """前回以降に終わったファイルを (パス, 状態, メッセージ) のリストで返す"""
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def progress(self) -> TransferProgress:
+        with self._lock:
+            now = self._paused_at or time.monotonic()
+            elapsed = now - self._started_at - self._paused_total if self._started_at else 0.0
+            current = next(iter(self._current.values()), None)
+            mirrors = {mirror: (self._mirror_bytes[mirror], len(self.mirror_errors[mirror])) for mirror in self.mirrors}
+            return TransferProgress(self._total_files, self._done_files, self._total_bytes,
+                                    self._done_bytes, elapsed, current, mirrors)
+
+    # === ワーカー ===
+    def _checkpoint(self, nbytes=0):
+        """チャンクごとに呼ばれ、進捗加算・一時停止・キャンセルを処理する"""
+        if nbytes:
+            with self._lock:
+                self._done_bytes += nbytes
+        if not self._running.is_set():
+            self._running.wait()
+        if self._cancelled.is_set():
+            raise TransferCancelled()
+
+    def _worker(self):
+        while not self._cancelled.is_set():
+            try:
+                path, size = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            ident = threading.get_ident()
+            with self._lock:
+                self._current[ident] = path
+            self.status[path] = RUNNING
+            copied = [0]
+
+            def on_progress(nbytes):
+                copied[0] += nbytes
+                self._checkpoint(nbytes)
+
+            try:
+                self._checkpoint()
+                state, message = self._transfer(path, on_progress)
+            except TransferCancelled:
+                state, message = CANCELLED, ""
+            except Exception as e:
+                state, message = FAILED, str(e)
+                self.errors.append((path, e))
+            with self._lock:
+                self._current.pop(ident, None)
+                self._done_files += 1
+                # zip展開は元のサイズと書き込み量が一致しないので、完了時に見積もり分へ揃える
+                if state in (DONE, SKIPPED):
+                    self._done_bytes += size - copied[0]
+            if self.ledger and state in (DONE, SKIPPED):
+                try:
+                    self.ledger.record(path)
+                except Exception as e:
+                    # 台帳に書けなくても転送は済んでいる（次回この元ファイルを台帳で飛ばせないだけ）
+                    # ほかのプロセスが台帳をロックしている場合などにワーカーごと止まらないようにする
+                    self.ledger_errors.append((path, e))
+            self.status[path] = state
+            self._results.put((path, state, message))
+
+        # キャンセル後に残ったジョブ
+        while True:
+            try:
+                path, _ = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            self.status[path] = CANCELLED
+            self._results.put((path, CANCELLED, ""))
+
+    def _transfer(self, path, on_progress):
+        """1ファイル分を処理して (状態, メッセージ) を返す"""
+        filename = os.path.basename(path)
+        started = time.time()
+        if is_archive(path):
+            written = extract_images(path, self.dest_dir, self.buffer_size or COPY_BUFFER_SIZE, on_progress,
+                                     self._member_reserver(path), self._member_filter(path),
+                                     self._on_member_written(path)
+                                     if self.manifest or self.content_index or self.journal or self.ledger else None,
+                                     self._reserve_mirrors if self.mirrors else None, self._settle_mirror)
+            if self.journal:
+                self.journal.done(path)
+            return DONE, f"{len(written)} 件展開"
+
+        digest = None
+        if self.dedupe:
+            with span(DEDUPE, file=path) as sp:
+                duplicate, digest = self.content_index.find_duplicate_file(path)
+                sp.set(duplicate=duplicate)
+            if duplicate:
+                state, message, primary_path = self._handle_duplicate(path, duplicate, digest, on_progress, started)
+                if self.mirrors:
+                    # 保存先にあってもバックアップ先にはまだないことがある（重複判定は保存先だけで行う）
+                    self._mirror_existing(primary_path, os.path.getsize(path), lambda: open(path, "rb"),
+                                          lambda target: shutil.copystat(path, target), on_progress)
+                return state, message
+
+        size = os.path.getsize(path)
+        dest_path = self._resumed_dest(path) or self._planned_dest(path) or self._reserve_path(filename)
+        temp_path = temp_path_for(dest_path)
+        if self.journal:
+            self.journal.started(path, dest_path)
+        # 移動モードで元ファイルが一時ファイルへ移った（リネーム、またはコピー後に削除した）か
+        moved = False
+        try:
+            # 一時ファイルに書き切ってから本来の名前へアトミックに置き換える
+            mirrors = self._reserve_mirrors(dest_path)
+            with span(COPY, size, file=path) as sp:
+                if mirrors:
+                    backend = FAN_OUT
+                    copied_digest, mirrored = self._fan_out(path, temp_path, mirrors, on_progress)
+                else:
+                    backend, copied_digest = transfer_file(path, temp_path, self.move, on_progress,
+                                                           self.buffer_size, self.verify)
+                    moved = self.move
+                sp.set(backend=backend)
+                os.replace(temp_path, dest_path)
+        except BaseException:
+            if moved:
+                # 一時ファイルが唯一の実体なので消さずに元の場所へ戻す
+                # （戻せなければ残しておき、再開時に prepare_resume が保存先へ確定させる）
+                try:
+                    os.replace(temp_path, path)
+                except OSError:
+                    pass
+            else:
+                # 途中で止まったファイルは残さない
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            try:
+                os.remove(dest_path)
+                self.allocator.release(dest_path)
+            except OSError:
+                pass
+            raise
+        if mirrors and self.move and mirrored:
+            # 保存先とすべてのバックアップ先に揃ったときだけ元ファイルを消す
+            os.remove(path)
+        if self.journal:
+            self.journal.done(path, dest_path)
+        digest = copied_digest or digest
+        with self._lock:
+            self.backends[backend] = self.backends.get(backend, 0) + 1
+        self._index_add(dest_path, digest)
+        if self.manifest:
+            moved = self.move and (not mirrors or mirrored)
+            self.manifest.record(path, dest_path, size, digest, "moved" if moved else "copied",
+                                 started, time.time() - started, backend)
+        return DONE, dest_path
+
+    def _fan_out(self, path, temp_path, mirrors, on_progress):
+        """元ファイルを一度だけ読んで保存先とバックアップ先へ同時に書き込み、(ハッシュ, すべて成功したか) を返す"""
+        try:
+            digest, targets = fan_out_file(path, [temp_path, *(temp_path_for(mirror) for mirror in mirrors)],
+                                           on_progress, self.buffer_size, self.verify == VERIFY_READBACK)
+        except BaseException:
+            # 元ファイルを読めない・中止した場合はバックアップ先にも残さない
+            for mirror in mirrors:
+                for leftover in (temp_path_for(mirror), mirror):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+                self._mirror_allocators[os.path.dirname(mirror)].release(mirror)
+            raise
+        primary = targets[0]
+        for mirror, target in zip(mirrors, targets[1:]):
+            self._settle_mirror(mirror, target)
+        if not primary.ok:
+            raise primary.error
+        return digest, all(target.ok for target in targets)
+
+    def _reserve_mirrors(self, dest_path, info=None) -> list:
+        """保存先と同じ名前でバックアップ先の名前を確保する（使われていれば連番）"""
+        filename = os.path.basename(dest_path)
+        reserved = []
+        for mirror in self.mirrors:
+            if mirror in self._disabled_mirrors:
+                continue
+            try:
+                reserved.append(self._mirror_allocators[mirror].allocate(filename))
+            except OSError as e:
+                self._fail_mirror(mirror, os.path.join(mirror, filename), e)
+        return reserved
+
+    def _settle_mirror(self, mirror_path, target):
+        """バックアップ先の一時ファイルを確定する。失敗はそのバックアップ先だけの失敗として記録する"""
+        mirror = os.path.dirname(mirror_path)
+        if target.ok:
+            try:
+                os.replace(target.path, mirror_path)
+            except OSError as e:
+                target.error = e
+        if target.ok:
+            with self._lock:
+                self._mirror_bytes[mirror] += target.written
+            return
+        for leftover in (target.path, mirror_path):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        self._mirror_allocators[mirror].release(mirror_path)
+        self._fail_mirror(mirror, mirror_path, target.error)
+
+    def _fail_mirror(self, mirror, mirror_path, error):
+        with self._lock:
+            self.mirror_errors[mirror].append((mirror_path, error))
+            if getattr(error, "errno", None) in (errno.ENOSPC, errno.EROFS, errno.EDQUOT, errno.ENOENT, errno.EIO):
+                # ドライブが一杯・書き込み不可・外れた場合は、残りのファイルでは試さない
+                self._disabled_mirrors.add(mirror)
+
+    def _resumed_dest(self, path):
+        """前回の中断時に確保していた保存先（空のまま残っているもの）を再利用する"""
+        if self.resume is None:
+            return None
+        dest_path = self.resume.started.get(path)
+        if dest_path and os.path.isfile(dest_path) and os.path.getsize(dest_path) == 0:
+            return dest_path
+        return None
+
+    def _planned_dest(self, key):
+        dest_path = self.planned.get(key)
+        return self.allocator.claim(dest_path) if dest_path else None
+
+    def _member_reserver(self, zip_path):
+        """zipメンバーの保存先を確保してジャーナルに記録する"""
+        resumed = self.resume.members_started.get(zip_path, {}) if self.resume else {}
+
+        def reserve(filename, info):
+            dest_path = resumed.get(info.filename)
+            if not (dest_path and os.path.isfile(dest_path) and os.path.getsize(dest_path) == 0):
+                dest_path = self._planned_dest((zip_path, info.filename)) or self._reserve_path(filename)
+            if self.journal:
+                self.journal.member_started(zip_path, info.filename, dest_path)
+            return dest_path
+        return reserve
+
+    def _member_filter(self, zip_path):
+        """書き出さないメンバー（前回展開済み・以前に取り込んだ・保存済みと同じ内容）を判定する関数を返す"""
+        finished = self.resume.members_done.get(zip_path, set()) if self.resume else set()
+        ingested = self.ledger.member_filter(zip_path) if self.ledger else None
+        if not finished and not self.dedupe and not ingested:
+            return None
+
+        def is_skipped(info):
+            if info.filename in finished or (ingested and ingested(info)):
+                return True
+            if not self.dedupe:
+                return False
+            duplicate = self._duplicate_member(info)
+            if duplicate is None:
+                return False
+            if self.mirrors:
+                mtime = time.mktime(datetime.datetime(*info.date_time).timetuple())
+                self._mirror_existing(duplicate, info.file_size, info.open_buffered,
+                                      lambda target: os.utime(target, (mtime, mtime)), self._checkpoint)
+            return True
+        return is_skipped
+
+    def _on_member_written(self, zip_path):
+        """zipメンバーを書き出すたびにインデックスと記録へ反映する"""
+        last = [time.time()]
+
+        def on_written(dest_path, info, digest):
+            now = time.time()
+            if self.journal:
+                self.journal.member_done(zip_path, info.filename, dest_path)
+            if self.ledger:
+                try:
+                    self.ledger.record_member(zip_path, info)
+                except Exception as e:
+                    self.ledger_errors.append((f"{zip_path}/{info.filename}", e))
+            self._index_add(dest_path, digest)
+            if self.manifest:
+                self.manifest.record(zip_path, dest_path, info.file_size, digest, "extracted",
+                                     last[0], now - last[0], member=info.filename)
+            last[0] = now
+        return on_written
+
+    def _index_add(self, dest_path, digest):
+        """保存したファイルを重複判定のインデックスへ登録する
+
+        ほかのジョブ・プロセスがインデックスをロックしている場合などに失敗しても、転送は済んでいるので
+        失敗扱いにはしない（次回このファイルとの重複を見逃すだけ）。
+        """
+        if self.content_index is None:
+            return
+        try:
+            self.content_index.add(dest_path, digest=digest)
+        except Exception as e:
+            self.index_errors.append((dest_path, e))
+
+    def _duplicate_member(self, info):
+        """保存済みの同じ内容のファイルのパス（なければ None）"""
+        # tar のメンバーは一度しか読めないので、比較用に読み込んだ中身を書き出しにも使う
+        with span(DEDUPE, file=info.filename) as sp:
+            duplicate, _ = self.content_index.find_duplicate(info.file_size, info.open_buffered)
+            sp.set(duplicate=duplicate)
+        return duplicate
+
+    def _mirror_existing(self, primary_path, size, open_source, copy_times, on_progress=None):
+        """保存先にはすでにある内容を、同じ位置にまだ持っていないバックアップ先へ書き込む
+
+        バックアップ先では保存先と同じ相対位置（イベント/サブフォルダ/ファイル名）を見て、
+        同じサイズのファイルがあれば持っているとみなす。失敗はバックアップ先ごとの失敗として記録する。
+        """
+        try:
+            relative = os.path.relpath(primary_path, self.dest_dir)
+        except ValueError:
+            # Windowsで保存先とドライブが異なる場合は位置を合わせられない
+            return
+        pending = []
+        for mirror in self.mirrors:
+            if mirror in self._disabled_mirrors:
+                continue
+            counterpart = os.path.normpath(os.path.join(mirror, relative))
+            try:
+                if os.path.getsize(counterpart) == size:
+                    continue
+            except OSError:
+                pass
+            try:
+                pending.append((mirror, self._allocator_near(mirror, counterpart).allocate(os.path.basename(counterpart))))
+            except OSError as e:
+                self._fail_mirror(mirror, counterpart, e)
+        if not pending:
+            return
+        targets = [FanOutTarget(temp_path_for(mirror_path)) for _, mirror_path in pending]
+        buffer_size = self.buffer_size or tune_buffer_size(size)
+        try:
+            with open_source() as src:
+                fan_out_stream(src.read, targets, buffer_size, on_progress, threaded=size > buffer_size)
+        except BaseException:
+            for (mirror, mirror_path), target in zip(pending, targets):
+                self._discard_mirror(mirror, mirror_path, target.path)
+            raise
+        for (mirror, mirror_path), target in zip(pending, targets):
+            if target.ok:
+                try:
+                    if target.written != size:
+                        raise VerificationError(f"書き込み後のサイズが一致しません: {mirror_path}")
+                    copy_times(target.path)
+                    os.replace(target.path, mirror_path)
+                except OSError as e:
+                    target.error = e
+            if target.ok:
+                with self._lock:
+                    self._mirror_bytes[mirror] += target.written
+            else:
+                self._discard_mirror(mirror, mirror_path, target.path)
+                self._fail_mirror(mirror, mirror_path, target.error)
+
+    def _allocator_near(self, mirror, path):
+        """バックアップ先で path のフォルダに名前を確保する NameAllocator（イベントのフォルダ以外は作って使い回す）"""
+        directory = os.path.dirname(path)
+        if directory == mirror:
+            return self._mirror_allocators[mirror]
+        with self._lock:
+            allocator = self._other_allocators.get(directory)
+            if allocator is None:
+                os.makedirs(directory, exist_ok=True)
+                allocator = self._other_allocators[directory] = NameAllocator(directory)
+            return allocator
+
+    def _discard_mirror(self, mirror, mirror_path, temp_path):
+        for leftover in (temp_path, mirror_path):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        self._allocator_near(mirror, mirror_path).release(mirror_path)
+
+    def _handle_duplicate(self, path, duplicate, digest, on_progress, started):
+        """保存済みと同じ内容のファイルはスキップ、またはハードリンクで済ませ、(状態, メッセージ, 保存先の実体) を返す"""
+        size = os.path.getsize(path)
+        if self.dedupe == HARDLINK:
+            dest_path = self._reserve_path(os.path.basename(path))
+            try:
+                os.remove(dest_path)
+                os.link(duplicate, dest_path)
+            except OSError:
+                # 別ドライブなどでリンクできない場合はスキップ扱い
+                self.allocator.release(dest_path)
+            else:
+                on_progress(size)
+                if self.manifest:
+                    self.manifest.record(path, dest_path, size, digest, "hardlinked", started, time.time() - started)
+                if self.journal:
+                    self.journal.done(path, dest_path)
+                return DONE, f"ハードリンク: {duplicate}", dest_path
+        on_progress(size)
+        if self.manifest:
+            self.manifest.record(path, duplicate, size, digest, "skipped", started, time.time() - started)
+        if self.journal:
+            self.journal.done(path, duplicate)
+        return SKIPPED, f"同じ内容のファイルがあるためスキップ: {duplicate}", duplicate
+
+    def _reserve_path(self, filename) -> str:
+        """重複しない保存先を決めて空ファイルで確保する（ワーカー間の競合を防ぐ）"""
+        with span(ALLOCATE, file=filename):
+            return self.allocator.allocate(filename)
@@ -0,0 +1,450 @@
+"""監視フォルダに届いたファイルを自動で取り込むデーモン
+
+使い方:
+    python -m watch_folder /mnt/staging ~/Downloads/cards --default-event 未分類 --json
+    python -m watch_folder            # 設定の WATCH → FOLDERS を監視
+
+Linuxでは inotify でイベントを待つので、何も届かない間はCPUをほとんど使わない。
+inotify が使えない環境では WATCH_POLL_INTERVAL 秒ごとにフォルダを走査する。
+"""
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from config import (
+    TRANSFER_WORKERS,
+    WATCH_MAX_BATCH,
+    WATCH_MAX_BATCH_AGE,
+    WATCH_POLL_INTERVAL,
+    WATCH_QUIET_SECONDS,
+    WATCH_STABLE_SECONDS,
+    load_base_root,
+    load_watch_config,)
+from event_router import route_by_capture_time
+from ingest import IngestSession, build_event_index, cached_event_name, finish_engine, resolve_dest_dir
+
+# ダウンロード途中・書き込み途中を表す拡張子（完了するとリネームされる）
+INCOMPLETE_SUFFIXES = (".part", ".crdownload", ".download", ".tmp", ".partial")
+
+def is_candidate(path: str) -> bool:
+    name = os.path.basename(path)
+    return not name.startswith(".") and not name.lower().endswith(INCOMPLETE_SUFFIXES)
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def scan_files(folder):
+    """フォルダ以下のファイルを (パス, (サイズ, 更新日時)) で返す（隠しフォルダは見ない）"""
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and is_candidate(entry.path):
+                            st = entry.stat(follow_symlinks=False)
+                            yield entry.path, (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+class PollingWatcher:
+    """一定間隔でフォルダを走査して、前回から増えた・変わったファイルを返す"""
+
+    def __init__(self, folders, interval: float = WATCH_POLL_INTERVAL):
+        self.folders = list(folders)
+        self.interval = interval
+        # 起動時にあったファイルは対象外（取り込み済みとみなす）
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        for folder in self.folders:
+            snapshot.update(scan_files(folder))
+        return snapshot
+
+    def wait(self, timeout=None) -> set:
+        """変化したファイルのパスを返す（timeout 秒まで待つ）"""
+        now = time.monotonic()
+        delay = self._next_scan - now
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0:
+            time.sleep(delay)
+            if time.monotonic() < self._next_scan:
+                return set()
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = self._scan()
+        changed = {path for path, key in snapshot.items() if self._snapshot.get(path) != key}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+# inotify のフラグ（<sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Linux の inotify でフォルダ（サブフォルダを含む）の変化を待つ"""
+
+    def __init__(self, folders):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify はこの環境では使えません")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        self.folders = list(folders)
+        self._dirs = {}
+        for folder in self.folders:
+            self._add_tree(folder)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"監視を追加できません: {directory}")
+        self._dirs[wd] = directory
+
+    def _add_tree(self, folder) -> set:
+        """フォルダ以下をすべて監視に加え、すでにあるファイルを返す"""
+        self._add_watch(folder)
+        found = set()
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for d in dirs:
+                try:
+                    self._add_watch(os.path.join(root, d))
+                except OSError:
+                    pass
+            found.update(os.path.join(root, f) for f in files)
+        return found
+
+    def wait(self, timeout=None) -> set:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # 取りこぼしたので全体を見直す
+                    for folder in self.folders:
+                        changed.update(path for path, _ in scan_files(folder))
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # カードのコピーなどでフォルダごと届いた（監視追加前に作られた中身も拾う）
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                        try:
+                            changed.update(self._add_tree(path))
+                        except OSError:
+                            pass
+                    continue
+                changed.add(path)
+        return {path for path in changed if is_candidate(path)}
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def create_watcher(folders, force_polling: bool = False):
+    """inotify が使えればそれを、だめならポーリングで監視する"""
+    if not force_polling:
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folders)
+
+class StabilityTracker:
+    """サイズと更新日時が一定時間変わらなくなったファイルを書き込み完了として取り出す"""
+
+    def __init__(self, stable_seconds: float = WATCH_STABLE_SECONDS):
+        self.stable_seconds = stable_seconds
+        # パス → ((サイズ, 更新日時), 最後に変化を見た時刻)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, paths, now=None):
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            key = _stat_key(path)
+            if key is None:
+                self._pending.pop(path, None)
+            else:
+                self._pending[path] = (key, now)
+
+    def pop_stable(self, now=None) -> list:
+        """落ち着いたファイルを返す（保留中のものは stat し直して変化を確認する）"""
+        now = time.monotonic() if now is None else now
+        stable = []
+        for path, (key, since) in list(self._pending.items()):
+            if now - since < self.stable_seconds:
+                continue
+            current = _stat_key(path)
+            if current is None:
+                del self._pending[path]
+            elif current != key:
+                # 通知なしに書き込みが続いていた
+                self._pending[path] = (current, now)
+            else:
+                del self._pending[path]
+                stable.append(path)
+        return stable
+
+    def next_check(self):
+        """次に確認すべき時刻（保留がなければ None）"""
+        if not self._pending:
+            return None
+        return min(since for _, since in self._pending.values()) + self.stable_seconds
+
+class BatchCollector:
+    """届いたファイルをまとめ、静かになったら（または上限で）1バッチとして払い出す
+
+    add() の tag（届いた時点の直近の予定など）はファイルごとに保持し、バッチ {パス: tag} として返す。
+    """
+
+    def __init__(self, quiet_seconds: float = WATCH_QUIET_SECONDS, max_files: int = WATCH_MAX_BATCH,
+                 max_age: float = WATCH_MAX_BATCH_AGE):
+        self.quiet_seconds = quiet_seconds
+        self.max_files = max_files
+        self.max_age = max_age
+        self._paths = {}
+        self._first = None
+        self._last = None
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, paths, now=None, tag=None):
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            self._paths[path] = tag
+        if paths:
+            self._first = self._first or now
+            self._last = now
+
+    def deadline(self):
+        if not self._paths:
+            return None
+        return min(self._last + self.quiet_seconds, self._first + self.max_age)
+
+    def pop_ready(self, now=None, force: bool = False) -> dict:
+        """払い出すバッチ {パス: tag}（まだなら空）"""
+        now = time.monotonic() if now is None else now
+        if not self._paths:
+            return {}
+        if not (force or len(self._paths) >= self.max_files or now >= self.deadline()):
+            return {}
+        batch = dict(self._paths)
+        self._paths.clear()
+        self._first = self._last = None
+        return batch
+
+class WatchDaemon:
+    """監視 → 書き込み完了待ち → バッチ化 → 取り込み を繰り返す
+
+    on_batch(バッチ) のバッチは {パス: tag}。tag は書き込みが終わってバッチに加えた時点で tag_arrival() を
+    呼んだ値（届いた時点の直近の予定名など。バッチを払い出すまでに予定が変わっても届いた時点の値が残る）。
+    取り込みで例外が起きても（ネットワークドライブが外れているなど）on_error(バッチ, 例外) に渡して監視を続ける。
+    """
+
+    def __init__(self, folders, on_batch, watcher=None, stable_seconds: float = WATCH_STABLE_SECONDS,
+                 quiet_seconds: float = WATCH_QUIET_SECONDS, max_files: int = WATCH_MAX_BATCH, on_error=None,
+                 tag_arrival=None):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.on_batch = on_batch
+        self.on_error = on_error
+        self.tag_arrival = tag_arrival
+        self.watcher = watcher or create_watcher(self.folders)
+        self.tracker = StabilityTracker(stable_seconds)
+        self.collector = BatchCollector(quiet_seconds, max_files)
+        # 取り込み済みの (サイズ, 更新日時)。同じ内容のまま再通知されても二重に取り込まない
+        self._ingested = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _timeout(self, now):
+        deadlines = [d for d in (self.tracker.next_check(), self.collector.deadline()) if d is not None]
+        timeout = max(min(deadlines) - now, 0.05) if deadlines else None
+        # 停止要求に気づけるよう、待ち時間は長くても数秒で区切る
+        return 2.0 if timeout is None else min(timeout, 2.0)
+
+    def run_once(self):
+        changed = self.watcher.wait(self._timeout(time.monotonic()))
+        now = time.monotonic()
+        if changed:
+            self.tracker.touch(changed, now)
+        stable = [path for path in self.tracker.pop_stable(now) if self._ingested.get(path) != _stat_key(path)]
+        if stable:
+            self.collector.add(stable, now, self.tag_arrival() if self.tag_arrival else None)
+        batch = self.collector.pop_ready(now, force=self._stop.is_set())
+        if batch:
+            for path in batch:
+                self._ingested[path] = _stat_key(path)
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        try:
+            self.on_batch(batch)
+        except Exception as e:
+            # 取り込めなかった分は、次に変更が届いたときにもう一度取り込めるよう記録から外す
+            for path in batch:
+                self._ingested.pop(path, None)
+            if self.on_error is None:
+                raise
+            self.on_error(batch, e)
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+            # 停止時に溜まっていた分も取り込む
+            batch = self.collector.pop_ready(force=True)
+            if batch:
+                self._deliver(batch)
+        finally:
+            self.watcher.close()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m watch_folder", description="監視フォルダに届いたファイルを自動で取り込む")
+    parser.add_argument("folders", nargs="*", help="監視するフォルダ（省略時は設定の WATCH → FOLDERS）")
+    parser.add_argument("--default-event", help="予定から決められないときのイベント名")
+    parser.add_argument("--subfolder", help="イベントフォルダ内のサブフォルダ名")
+    parser.add_argument("--base-root", help="保存先の親フォルダ（省略時はアプリの設定値）")
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS, help="同時に転送するファイル数")
+    parser.add_argument("--move", action="store_true", help="取り込んだ元ファイルを削除する（zipは残す）")
+    parser.add_argument("--poll", action="store_true", help="inotify を使わずに走査で監視する")
+    parser.add_argument("--json", action="store_true", help="進捗をJSON Linesで出力する")
+    return parser
+
+def main(argv=None) -> int:
+    from ingest_cli import EXIT_OK, EXIT_USAGE, Reporter
+
+    args = build_parser().parse_args(argv)
+    settings = load_watch_config()
+    folders = args.folders or settings["FOLDERS"]
+    default_event = args.default_event if args.default_event is not None else settings["DEFAULT_EVENT"]
+    subfolder = args.subfolder if args.subfolder is not None else settings["SUBFOLDER"]
+    reporter = Reporter(args.json)
+    if not folders or not all(os.path.isdir(folder) for folder in folders):
+        reporter.emit("error", message="監視するフォルダが見つかりません", folders=folders)
+        return EXIT_USAGE
+
+    base_root = args.base_root or load_base_root()
+    session = IngestSession()
+    # 実行中の取り込み（停止の合図で中止する）
+    running = [None]
+    stopping = threading.Event()
+
+    def arrival_event():
+        """届いた時点で直近にヒットした予定名（撮影日時で決められないファイルに使う）"""
+        return cached_event_name(datetime.datetime.now(datetime.timezone.utc))
+
+    def on_batch(batch):
+        if stopping.is_set():
+            reporter.emit("error", message="停止したため取り込みませんでした", files=len(batch))
+            return
+        # 撮影日時で予定へ振り分け、決められないものは届いた時点の直近のヒット予定（なければ既定のイベント名）へ
+        routes, unmatched = route_by_capture_time(list(batch), build_event_index(), args.workers * 2)
+        undecided = 0
+        for path in unmatched:
+            event_name = batch[path] or default_event
+            if event_name:
+                routes.setdefault(event_name, []).append(path)
+            else:
+                undecided += 1
+        if undecided:
+            reporter.emit("error", message="イベント名を決められないため取り込みませんでした", files=undecided)
+        for event_name, group in routes.items():
+            if stopping.is_set():
+                reporter.emit("error", message="停止したため取り込みませんでした", event=event_name, files=len(group))
+                continue
+            dest_dir = resolve_dest_dir(base_root, event_name, subfolder)
+            engine = running[0] = session.start(group, dest_dir, base_root, move=args.move, workers=args.workers)
+            if stopping.is_set():
+                engine.cancel()
+            reporter.emit("batch", event=event_name, dest_dir=dest_dir, files=len(group), job=engine.journal.job_id)
+            try:
+                engine.wait()
+                for path, state, message in engine.poll():
+                    reporter.emit("file", source=path, state=state, message=message)
+            finally:
+                running[0] = None
+                finish_engine(engine)
+
+    def on_error(paths, error):
+        reporter.emit("error", message=f"取り込みに失敗しました（監視は続けます）: {error}", files=len(paths))
+
+    def on_signal(signum, frame):
+        # 実行中の取り込みも中止する（途中までの分はジャーナルに残り、アプリの起動時に再開できる）
+        stopping.set()
+        daemon.stop()
+        engine = running[0]
+        if engine:
+            engine.cancel()
+
+    daemon = WatchDaemon(folders, on_batch, create_watcher(folders, args.poll), on_error=on_error,
+                         tag_arrival=arrival_event)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, on_signal)
+    reporter.emit("watch", folders=folders, backend=type(daemon.watcher).__name__)
+    try:
+        daemon.run()
+    finally:
+        session.close()
+    return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import datetime
+import os
+import shutil
+import time
+from archive_reader import iter_archive_images
+from fan_out import FanOutTarget, fan_out_stream
+from fast_copy import new_digest
+from name_allocator import NameAllocator, temp_path_for
+from tracing import EXTRACT, span
+
+# ストリーミングコピー時のバッファサイズ
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def copy_stream(src, dst, buffer_size: int = COPY_BUFFER_SIZE, on_progress=None, digest=None):
+    """バッファ単位でコピーし、書き込むたびに on_progress(バイト数) を呼ぶ
+
+    digest（hashlibのオブジェクト）を渡すと同じチャンクでハッシュも計算する。
+    """
+    if on_progress is None and digest is None:
+        shutil.copyfileobj(src, dst, buffer_size)
+        return
+    read = src.read
+    write = dst.write
+    while True:
+        chunk = read(buffer_size)
+        if not chunk:
+            return
+        if digest is not None:
+            digest.update(chunk)
+        write(chunk)
+        if on_progress:
+            on_progress(len(chunk))
+
+def extract_images(zip_path, target_dir, buffer_size: int = COPY_BUFFER_SIZE, on_progress=None,
+                   reserve_path=None, is_duplicate=None, on_written=None, mirror_dests=None, on_mirrored=None) -> list:
+    """アーカイブ（zip / tar / 7z、入れ子も含む）内の画像だけを一時フォルダを経由せずに target_dir へ直接書き出す
+
+    各メンバーは保存先の隣の一時ファイル（.名前.part）に書き、完了後にリネームする。
+    on_progress(バイト数) は書き込みのたびに呼ばれる（例外を送出すると中断できる）。
+    メンバーは archive_reader.ArchiveMember（ZipInfo と同じ filename / file_size / date_time を持つ）で渡す。
+    reserve_path(ファイル名, メンバー) を渡すと保存先の決定をそちらに任せる（並列転送時の重複防止）。
+    is_duplicate(メンバー) が True を返したメンバーは書き出さない。
+    on_written(保存先, メンバー, ハッシュ) を渡すとメンバーごとにハッシュを計算して通知する
+    （zipの CRC32 は zipfile が読み込み時に検証する）。
+    mirror_dests(保存先, メンバー) がバックアップ先のパス一覧を返すと、メンバーを一度だけ展開して
+    すべてへ同時に書き込み、バックアップ先ごとに on_mirrored(バックアップ先, FanOutTarget) で結果を通知する
+    （バックアップ先の失敗では止めない）。
+    """
+    written = []
+    # 入れ子のアーカイブの一時ファイルは保存先と同じドライブに置く
+    for info in iter_archive_images(zip_path, spool_dir=target_dir):
+        try:
+            if is_duplicate and is_duplicate(info):
+                continue
+            if reserve_path is None:
+                # 最初の画像が見つかった時点でフォルダを一度だけ走査する
+                allocate = NameAllocator(target_dir).allocate
+                reserve_path = lambda filename, _info: allocate(filename)
+            # フォルダ階層は無視してファイル名だけで格納（パストラバーサル対策も兼ねる）
+            filename = os.path.basename(info.name.replace("\\", "/"))
+            dest_path = reserve_path(filename, info)
+            temp_path = temp_path_for(dest_path)
+            digest = new_digest() if on_written else None
+            mirrors = mirror_dests(dest_path, info) if mirror_dests else []
+            mirror_targets = [FanOutTarget(temp_path_for(mirror)) for mirror in mirrors]
+            # バックアップ先の結果を on_mirrored に渡したら、以降の後始末はそちらに任せる
+            settled = False
+            try:
+                # アーカイブ内の更新日時を引き継ぐ
+                mtime = time.mktime(datetime.datetime(*info.date_time).timetuple())
+                with span(EXTRACT, info.file_size, file=zip_path, member=info.filename):
+                    if mirrors:
+                        target = FanOutTarget(temp_path)
+                        with info.open() as src:
+                            fan_out_stream(src.read, [target, *mirror_targets], buffer_size, on_progress, digest,
+                                           threaded=info.file_size > buffer_size)
+                        for mirror, mirror_target in zip(mirrors, mirror_targets):
+                            if mirror_target.ok:
+                                try:
+                                    os.utime(mirror_target.path, (mtime, mtime))
+                                except OSError as e:
+                                    mirror_target.error = e
+                            on_mirrored(mirror, mirror_target)
+                        settled = True
+                        if not target.ok:
+                            raise target.error
+                    else:
+                        with info.open() as src, open(temp_path, "wb") as dst:
+                            copy_stream(src, dst, buffer_size, on_progress, digest)
+                    os.utime(temp_path, (mtime, mtime))
+                    os.replace(temp_path, dest_path)
+            except BaseException:
+                # 途中で止まったファイルは残さない
+                leftovers = [temp_path, dest_path]
+                if not settled:
+                    leftovers += [mirror_target.path for mirror_target in mirror_targets] + mirrors
+                for leftover in leftovers:
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+                raise
+            written.append(dest_path)
+            if on_written:
+                on_written(dest_path, info, digest.digest())
+        finally:
+            # 重複判定のために読み込んだ中身を手放す
+            info.release()
+    return written